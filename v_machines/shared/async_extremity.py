@@ -0,0 +1,429 @@
+import asyncio
+import os
+import socket
+import time
+import logging
+from queue import Empty
+from typing import Optional
+from processing import Processing
+from compression import HeaderDecompressor
+from framing import PacketFramer, FramingError
+from metrics import Counters, PacketTracer, Metrics
+from packet_queue import PacketQueue, QUEUE_BYTES
+from session import Backoff
+from pmtu import PathMTU, PacketTooBig, PMTU_INTERVAL, set_device_mtu
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 65535  # largest packet the TUN device can hand over: a shorter read would truncate it
+READ_BATCH = 64  # maximum number of packets read from the tunnel per wakeup
+
+
+class InboundProtocol(asyncio.BufferedProtocol):
+    """
+    Receives packets from a connection accepted on the local port and writes them to the tunnel.
+
+    The stream is received directly into the buffer of a `PacketFramer` (no intermediate
+    `bytes`), then every complete packet is written to the tunnel fd from the event loop.
+
+    Attributes:
+        extremity (AsyncExtremity): The endpoint owning the tunnel.
+        framer (PacketFramer): Splits the received stream into packets.
+        encapsulated (bool): True if the peer sends encapsulated packets (remote endpoint),
+                             False if it sends raw IPv6 packets.
+        decompressor (HeaderDecompressor): Expands the compressed headers sent by a peer of
+                                           the threads engine.
+    """
+
+    def __init__(self, extremity: "AsyncExtremity") -> None:
+        """
+        Initializes the protocol for one inbound connection.
+
+        Args:
+            extremity (AsyncExtremity): The endpoint owning the tunnel.
+        """
+        self.extremity = extremity
+        self.framer = PacketFramer()
+        self.encapsulated = False
+        self.transport = None
+        self.decompressor = HeaderDecompressor(extremity.counters)
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        """
+        Identifies the peer: connections from the destination address carry encapsulated packets.
+
+        Args:
+            transport (asyncio.BaseTransport): The transport of the accepted connection.
+        """
+        self.transport = transport
+        peer_address = transport.get_extra_info("peername")[0]
+        self.encapsulated = peer_address.split(":")[-1] == self.extremity.dst_address
+        logger.info(f"Connected with: {peer_address}")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        """
+        Returns the free space of the framer buffer to receive into.
+
+        Args:
+            sizehint (int): Minimum size suggested by the event loop (ignored).
+
+        Returns:
+            memoryview: The writable part of the framer buffer.
+        """
+        return self.framer.get_buffer()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """
+        Writes every complete packet received so far to the tunnel.
+
+        Args:
+            nbytes (int): Number of bytes received into the buffer.
+        """
+        self.framer.commit(nbytes)
+        try:
+            extremity = self.extremity
+            for packet in self.framer.packets():
+                extremity.counters.peer_received_packets += 1
+                extremity.counters.peer_received_bytes += len(packet)
+                if extremity.tracer.every and extremity.tracer.sample():
+                    extremity.trace("peer -> tunnel", packet)
+                if self.encapsulated:
+                    packet = extremity.processing.decapsulate(packet, self.decompressor)
+                    if packet is None:
+                        continue
+                extremity.save_to_local_tun(packet)
+        except FramingError as e:
+            logger.error(f"Failed to read data from {self.transport.get_extra_info('peername')[0]}: {e}")
+            self.transport.close()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """
+        Logs the end of the connection.
+
+        Args:
+            exc (Optional[Exception]): The error that closed the connection, if any.
+        """
+        logger.info("Inbound connection closed.")
+
+
+class OutboundProtocol(asyncio.Protocol):
+    """
+    The connection to the remote endpoint, used to send encapsulated packets.
+
+    It pauses the reading of the tunnel when the socket buffer is full (backpressure)
+    and signals its end through the `closed` future.
+
+    Attributes:
+        extremity (AsyncExtremity): The endpoint owning the tunnel.
+        closed (asyncio.Future): Resolved when the connection is lost.
+    """
+
+    def __init__(self, extremity: "AsyncExtremity") -> None:
+        """
+        Initializes the protocol of the outbound connection.
+
+        Args:
+            extremity (AsyncExtremity): The endpoint owning the tunnel.
+        """
+        self.extremity = extremity
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def data_received(self, data: bytes) -> None:
+        """
+        Ignores data sent back on the outbound connection (the peer answers on its own connection).
+
+        Args:
+            data (bytes): The received data.
+        """
+
+    def pause_writing(self) -> None:
+        """
+        Stops reading the tunnel while the socket buffer is above its high-water mark.
+        """
+        self.extremity.pause_tun_reading()
+
+    def resume_writing(self) -> None:
+        """
+        Resumes reading the tunnel once the socket buffer has drained.
+        """
+        self.extremity.resume_tun_reading()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """
+        Signals the end of the connection to the reconnection loop.
+
+        Args:
+            exc (Optional[Exception]): The error that closed the connection, if any.
+        """
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class AsyncExtremity:
+    """
+    An endpoint equivalent to `Extremity` running on a single asyncio event loop.
+
+    The tunnel fd is registered with `loop.add_reader`; packets read from it are encapsulated
+    and written straight to the transport of the remote endpoint, and packets received
+    from the peers are written straight to the tunnel. There is no thread and no queue
+    between the tunnel and the sockets, except `backlog`, which holds the packets read
+    while the connection to the remote endpoint is re-established.
+
+    Attributes:
+        src_port (int): Source port for the local system.
+        dst_port (int): Destination port for the remote system.
+        proto (str): Protocol to use (only 'tcp' is supported by this engine).
+        reuse_port (bool): Whether the listening socket shares its port with other workers.
+        tun_fd (int): File descriptor for the tunnel interface.
+        dst_address (str): Destination address (IPv4).
+        src_address (str): Source address (IPv4).
+        tun_address (str): The tunnel's IP address.
+        processing (Processing): Encapsulation and decapsulation handler.
+        counters (Counters): Packet counters of the data path.
+        tracer (PacketTracer): Selects the packets traced in the logs (1 in N).
+        metrics (Metrics): Counters and send latency histogram.
+        peer (Optional[asyncio.Transport]): The connection to the remote endpoint, if established.
+        backlog (PacketQueue): Packets read while `peer` is None, sent once it is connected again.
+        connects (int): Successful connections to the remote endpoint so far.
+        path_mtu (PathMTU): Largest packet sent to the peer (path MTU minus the carrier overhead).
+        too_big (PacketTooBig): Builds the ICMPv6 answers to the packets over `path_mtu`.
+    """
+
+    def __init__(self, tun_address: str, tun_fd: int, src_address: str, dst_address: str, src_port: int, dst_port: int, proto: str = "tcp", reuse_port: bool = False, trace_every: int = 0, queue_bytes: int = QUEUE_BYTES, drop_policy: str = "tail", mtu: Optional[int] = None) -> None:
+        """
+        Initializes the endpoint with the same parameters as `Extremity`.
+
+        Args:
+            tun_address (str): Tunnel interface address (IPv6).
+            tun_fd (int): File descriptor for the tunnel interface.
+            src_address (str): Source address (IPv4).
+            dst_address (str): Destination address (IPv4).
+            src_port (int): Source port for local system communication.
+            dst_port (int): Destination port for remote communication.
+            proto (str): Protocol to be used (only 'tcp').
+            reuse_port (bool): Listen with `SO_REUSEPORT` (one worker process per TUN queue).
+            trace_every (int): Log a trace of 1 packet out of `trace_every` (0: no packet trace).
+            queue_bytes (int): Byte budget of the backlog kept while the peer is reconnected.
+            drop_policy (str): Packet dropped when the backlog is full ("tail", "head" or "codel").
+            mtu (Optional[int]): Fixed MTU of the tunnel (None: follow the path MTU to the peer).
+        """
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.proto = proto.lower()
+        self.reuse_port = reuse_port
+        self.tun_fd = tun_fd
+        self.dst_address = dst_address
+        self.src_address = src_address
+        self.tun_address = tun_address
+        self.processing = Processing(self.src_address, self.dst_address)
+        self.counters = Counters()
+        self.tracer = PacketTracer(trace_every)
+        self.metrics = Metrics(self.counters)
+        self.peer = None
+        self.connects = 0
+        self.metrics.gauge("peer_connected", lambda: int(self.peer is not None))
+        self.metrics.counter("peer_connects", lambda: self.connects)
+        # Bounded like the queues of the threads engine: a long outage drops instead of growing
+        self.backlog = PacketQueue(queue_bytes, drop_policy, self.counters)
+        self.metrics.gauge("backlog_depth", self.backlog.qsize)
+        self.metrics.gauge("backlog_bytes", lambda: self.backlog.bytes)
+        self.metrics.counter("backlog_dropped_packets", lambda: self.backlog.dropped_packets)
+        self.metrics.counter("backlog_dropped_bytes", lambda: self.backlog.dropped_bytes)
+        self.path_mtu = PathMTU(self.dst_address, self.proto, mtu)
+        self.too_big = PacketTooBig(tun_address)
+        self.metrics.gauge("path_mtu", lambda: self.path_mtu.mtu)
+        self.loop = None
+        self.tun_reading = False
+
+    def start(self) -> None:
+        """
+        Runs the endpoint until it is interrupted, like `Extremity.start`.
+        """
+        if self.proto != "tcp":
+            raise ValueError(f"The asyncio engine does not support the protocol: {self.proto}")
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        """
+        Starts the listening server, the tunnel reader and the connection to the remote endpoint.
+        """
+        self.loop = asyncio.get_running_loop()
+        os.set_blocking(self.tun_fd, False)
+
+        server_socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_socket.bind(("", self.src_port))
+        server = await self.loop.create_server(lambda: InboundProtocol(self), sock=server_socket)
+        logger.info(f"TCP connection mode started on {self.src_port}")
+
+        self.resume_tun_reading()
+        if not self.path_mtu.fixed:
+            self.loop.create_task(self.watch_mtu())
+        async with server:
+            await self.connect_peer()
+
+    async def watch_mtu(self) -> None:
+        """
+        Probes the path MTU to the peer every `PMTU_INTERVAL` seconds; the MTU of the TUN
+        device follows the MTU of the tunnel.
+        """
+        while True:
+            await asyncio.sleep(PMTU_INTERVAL)
+            if not self.path_mtu.refresh():
+                continue
+            logger.info(f"Path MTU to {self.dst_address} is {self.path_mtu.link_mtu}: tunnel MTU {self.path_mtu.mtu}")
+            try:
+                set_device_mtu(self.tun_fd, self.path_mtu.mtu)
+            except OSError as e:
+                logger.error(f"Failed to set the MTU of the tunnel: {e}")
+
+    async def connect_peer(self) -> None:
+        """
+        Keeps a connection to the remote endpoint open, reconnecting with a jittered
+        exponential backoff (see `Backoff`) when it is lost.
+        """
+        backoff = Backoff()
+        while True:
+            try:
+                transport, protocol = await self.loop.create_connection(
+                    lambda: OutboundProtocol(self), self.dst_address, self.dst_port)
+            except OSError:
+                await asyncio.sleep(backoff.next_delay())
+                continue
+            backoff.reset()
+            self.connects += 1
+            logger.info(f"Connexion established with: {self.dst_address}")
+            self.peer = transport
+            self.send_backlog()
+            await protocol.closed
+            self.peer = None
+            self.resume_tun_reading()
+            logger.error(f"Connection lost with: {self.dst_address}")
+
+    def send_backlog(self) -> None:
+        """
+        Sends the packets kept in the backlog while the remote endpoint was not connected,
+        before any packet read from the tunnel afterwards (both run on the event loop).
+        """
+        buffers = []
+        enqueue_times = []
+        while True:
+            try:
+                enqueue_time, ipv6_packet = self.backlog.get_nowait()
+            except Empty:
+                break
+            enqueue_times.append(enqueue_time)
+            buffers.append(self.processing.encapsulation_header(ipv6_packet))
+            buffers.append(ipv6_packet)
+        if not buffers:
+            return
+        self.peer.writelines(buffers)
+        self.counters.peer_sent_packets += len(enqueue_times)
+        self.counters.peer_sent_bytes += sum(len(buffer) for buffer in buffers[1::2])
+        now = time.perf_counter_ns()
+        for enqueue_time in enqueue_times:
+            self.metrics.latency.record(now - enqueue_time)
+        logger.info(f"{len(enqueue_times)} packets sent from the backlog to: {self.dst_address}")
+
+    def pause_tun_reading(self) -> None:
+        """
+        Unregisters the tunnel fd from the event loop.
+        """
+        if self.tun_reading:
+            self.loop.remove_reader(self.tun_fd)
+            self.tun_reading = False
+
+    def resume_tun_reading(self) -> None:
+        """
+        Registers the tunnel fd with the event loop.
+        """
+        if not self.tun_reading:
+            self.loop.add_reader(self.tun_fd, self.handle_tun_read)
+            self.tun_reading = True
+
+    def handle_tun_read(self) -> None:
+        """
+        Reads the packets available on the tunnel and sends them to the remote endpoint.
+
+        Called by the event loop when the tunnel fd is readable. Up to `READ_BATCH` packets
+        are read, then written to the transport in a single `writelines` call. Packets read
+        while the remote endpoint is not connected are kept in `backlog` (dropped by its policy
+        once its byte budget is spent) and sent by `send_backlog` after the reconnection.
+        Packets over the MTU of the tunnel are answered with an ICMPv6 Packet Too Big.
+        """
+        buffers = []
+        read_times = []
+        for _ in range(READ_BATCH):
+            try:
+                ipv6_packet = os.read(self.tun_fd, BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self.counters.errors += 1
+                logger.error(f"Error while reading from the tunnel: {e}")
+                self.pause_tun_reading()
+                break
+            if not ipv6_packet:
+                logger.info("Tunnel closed, reader stopped.")
+                self.pause_tun_reading()
+                break
+            if self.tracer.every and self.tracer.sample():
+                self.trace("tunnel -> peer", ipv6_packet)
+            if len(ipv6_packet) > self.path_mtu.mtu:
+                self.counters.too_big += 1
+                message = self.too_big.build(ipv6_packet, self.path_mtu.mtu)
+                if message is not None:
+                    self.save_to_local_tun(message)
+                continue
+            read_times.append(time.perf_counter_ns())
+            buffers.append(self.processing.encapsulation_header(ipv6_packet))
+            buffers.append(ipv6_packet)
+        counters = self.counters
+        payload_bytes = sum(len(buffer) for buffer in buffers[1::2])
+        counters.tun_read_packets += len(read_times)
+        counters.tun_read_bytes += payload_bytes
+        if not buffers:
+            return
+        if self.peer is None:
+            for ipv6_packet in buffers[1::2]:
+                self.backlog.put(ipv6_packet)
+            return
+        self.peer.writelines(buffers)
+        counters.peer_sent_packets += len(read_times)
+        counters.peer_sent_bytes += payload_bytes
+        now = time.perf_counter_ns()
+        for read_time in read_times:
+            self.metrics.latency.record(now - read_time)
+
+    def save_to_local_tun(self, ipv6_packet: bytes) -> None:
+        """
+        Writes the IPv6 packet to the local tunnel interface.
+
+        Args:
+            ipv6_packet (bytes): The IPv6 packet to be written to the tunnel.
+        """
+        try:
+            os.write(self.tun_fd, ipv6_packet)
+            self.counters.tun_written_packets += 1
+            self.counters.tun_written_bytes += len(ipv6_packet)
+        except BlockingIOError:
+            # The tunnel queue is full: drop the packet, as the kernel would
+            self.counters.drops += 1
+        except OSError as e:
+            self.counters.errors += 1
+            logger.error(f"Failed to write data to local tunnel: {e}")
+
+    def trace(self, direction: str, packet: bytes) -> None:
+        """
+        Logs a short description of a sampled packet (see `PacketTracer`).
+
+        Args:
+            direction (str): Where the packet is going (e.g. "tunnel -> peer").
+            packet (bytes): The packet, encapsulated or not.
+        """
+        version = packet[0] >> 4 if packet else 0
+        logger.info(f"[trace] {direction}: {len(packet)} bytes, IPv{version}")
@@ -0,0 +1,6 @@
+"""
+Benchmarks for the tunnel data path.
+
+Run them from the `shared/` directory, e.g.:
+    python3 -m bench encap
+"""
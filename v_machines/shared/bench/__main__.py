@@ -0,0 +1,140 @@
+import argparse
+import json
+import sys
+
+from bench import capture, compare, compression, duplex, encap, engines, failover, latency, offload, pipeline, queues, routes, scaling, startup, striping
+from bench.generators import MIXES
+
+
+def main() -> None:
+    """
+    Parses the command line and runs the selected benchmark, printing its result as JSON.
+    """
+    parser = argparse.ArgumentParser(prog="python3 -m bench", description="Tunnel data path benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    encap_parser = commands.add_parser("encap", help="IPv4 header: per-packet build vs template")
+    encap_parser.add_argument("--count", type=int, default=200000)
+    encap_parser.add_argument("--size", type=int, default=1400)
+
+    duplex_parser = commands.add_parser("duplex", help="Tunnel write latency while the reader is idle")
+    duplex_parser.add_argument("--count", type=int, default=1000)
+    duplex_parser.add_argument("--timeout", type=float, default=1.0)
+
+    engines_parser = commands.add_parser("engines", help="Threaded vs asyncio endpoint over loopback")
+    engines_parser.add_argument("--count", type=int, default=20000)
+    engines_parser.add_argument("--size", type=int, default=1400)
+    engines_parser.add_argument("--probes", type=int, default=2000)
+
+    scaling_parser = commands.add_parser("scaling", help="Aggregated pps with 1..N TUN queues")
+    scaling_parser.add_argument("--engine", choices=sorted(engines.ENGINES), default="threads")
+    scaling_parser.add_argument("--count", type=int, default=20000)
+    scaling_parser.add_argument("--size", type=int, default=1400)
+    scaling_parser.add_argument("--max-queues", type=int, default=0, help="default: number of cores")
+
+    queues_parser = commands.add_parser("queues", help="Queueing delay and memory under overload per drop policy")
+    queues_parser.add_argument("--count", type=int, default=50000)
+    queues_parser.add_argument("--size", type=int, default=1400)
+    queues_parser.add_argument("--budget", type=int, default=1024 * 1024)
+    queues_parser.add_argument("--service-us", type=float, default=20.0)
+
+    failover_parser = commands.add_parser("failover", help="Time to deliver again after the peer restarts")
+    failover_parser.add_argument("--downtime", type=float, default=1.0)
+    failover_parser.add_argument("--interval", type=float, default=0.001)
+
+    routes_parser = commands.add_parser("routes", help="Longest-prefix match of the hub route table")
+    routes_parser.add_argument("--count", type=int, default=10000)
+    routes_parser.add_argument("--lookups", type=int, default=100000)
+    routes_parser.add_argument("--peers", type=int, default=100)
+
+    startup_parser = commands.add_parser("startup", help="Interface configuration time, netlink vs ip (root)")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--routes", type=int, default=1000)
+
+    pipeline_parser = commands.add_parser("pipeline", help="pps, Gbit/s, CPU and latency per packet size mix, no TUN needed")
+    pipeline_parser.add_argument("--engine", choices=sorted(engines.ENGINES), default="threads")
+    pipeline_parser.add_argument("--count", type=int, default=20000)
+    pipeline_parser.add_argument("--probes", type=int, default=2000)
+    pipeline_parser.add_argument("--mix", choices=sorted(MIXES), action="append", help="default: every mix")
+
+    compare_parser = commands.add_parser("compare", help="Regressions between two JSON results (exit status 1 if any)")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=5.0, help="tolerated change in percent")
+
+    offload_parser = commands.add_parser("offload", help="Bulk TCP through the tunnel with and without TUN offloads (root)")
+    offload_parser.add_argument("--megabytes", type=int, default=64)
+    offload_parser.add_argument("--mtu", type=int, default=1400)
+
+    striping_parser = commands.add_parser("striping", help="Inner throughput vs stripes over a lossy, delayed link (root)")
+    striping_parser.add_argument("--max-stripes", type=int, default=4)
+    striping_parser.add_argument("--flows", type=int, default=8)
+    striping_parser.add_argument("--seconds", type=float, default=5.0)
+    striping_parser.add_argument("--loss", type=float, default=0.01, help="packet loss probability")
+    striping_parser.add_argument("--delay-ms", type=float, default=5.0, help="one-way delay")
+    striping_parser.add_argument("--congestion", default="cubic", help="TCP congestion control of the connections")
+
+    latency_parser = commands.add_parser("latency", help="Ping latency under bulk load per egress scheduler (root)")
+    latency_parser.add_argument("--proto", choices=["tcp", "udp", "raw"], default="tcp")
+    latency_parser.add_argument("--flows", type=int, default=4)
+    latency_parser.add_argument("--seconds", type=float, default=5.0)
+    latency_parser.add_argument("--interval-ms", type=float, default=10.0)
+    latency_parser.add_argument("--size", type=int, default=64)
+    latency_parser.add_argument("--rate-mbit", type=float, default=20.0, help="rate of the carrier link")
+    latency_parser.add_argument("--delay-ms", type=float, default=5.0, help="one-way delay of the carrier link")
+    latency_parser.add_argument("--limit", type=int, default=64, help="packets held by the carrier link")
+    latency_parser.add_argument("--congestion", default="cubic", help="TCP congestion control of the connections")
+
+    compression_parser = commands.add_parser("compression", help="Bandwidth saved by the header compression on an IMIX trace")
+    compression_parser.add_argument("--count", type=int, default=100000)
+    compression_parser.add_argument("--flows", type=int, default=64)
+    compression_parser.add_argument("--contexts", type=int, default=256)
+    compression_parser.add_argument("--loss", type=float, default=0.01, help="packet loss probability of the udp carrier")
+    compression_parser.add_argument("--mix", choices=sorted(MIXES), action="append", help="default: every mix")
+
+    capture_parser = commands.add_parser("capture", help="Per-packet cost of the pcapng capture ring, off, on and filtered")
+    capture_parser.add_argument("--count", type=int, default=200000)
+    capture_parser.add_argument("--flows", type=int, default=64)
+    capture_parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="bytes of the ring file")
+    capture_parser.add_argument("--snaplen", type=int, default=128)
+
+    args = parser.parse_args()
+    if args.command == "encap":
+        result = encap.run(args.count, args.size)
+    elif args.command == "duplex":
+        result = duplex.run(args.count, args.timeout)
+    elif args.command == "engines":
+        result = engines.run(args.count, args.size, args.probes)
+    elif args.command == "scaling":
+        result = scaling.run(args.engine, args.count, args.size, args.max_queues)
+    elif args.command == "failover":
+        result = failover.run(args.downtime, args.interval)
+    elif args.command == "routes":
+        result = routes.run(args.count, args.lookups, args.peers)
+    elif args.command == "startup":
+        result = startup.run(args.runs, args.routes)
+    elif args.command == "pipeline":
+        result = pipeline.run(args.engine, args.count, args.probes, args.mix)
+    elif args.command == "compare":
+        result = compare.run(args.baseline, args.candidate, args.threshold)
+    elif args.command == "offload":
+        result = offload.run(args.megabytes, args.mtu)
+    elif args.command == "striping":
+        result = striping.run(args.max_stripes, args.flows, args.seconds, args.loss, args.delay_ms / 1e3,
+                              congestion=args.congestion)
+    elif args.command == "latency":
+        result = latency.run(args.proto, args.flows, args.seconds, args.interval_ms / 1e3, args.size,
+                             args.rate_mbit * 1e6, args.delay_ms / 1e3, args.limit, congestion=args.congestion)
+    elif args.command == "compression":
+        result = compression.run(args.count, args.flows, args.contexts, args.loss, args.mix)
+    elif args.command == "capture":
+        result = capture.run(args.count, args.flows, args.size, args.snaplen)
+    elif args.command == "queues":
+        result = queues.run(args.count, args.size, args.budget, args.service_us)
+    print(json.dumps(result, indent=2))
+    if args.command == "compare" and result["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import time
+
+from bench.compression import make_trace
+from capture import PEER_SEND, TUN_READ, PacketCapture, export
+from processing import Processing
+
+# Settings of the capture compared: capture points and filter (None: no capture at all)
+SETTINGS = {
+    "off": None,
+    "no_point": ((), None),
+    "all_points": (("tun_read", "peer_send"), None),
+    "filtered_out": (("tun_read", "peer_send"), "tcp and port 443"),
+    "filtered_in": (("tun_read", "peer_send"), "net fd00::/8"),
+}
+
+
+def measure(trace: list, capture) -> float:
+    """
+    Runs the capture points of the sending side of the data path over a trace: the packet as
+    read from the tunnel, then as sent to the peer (IPv4 header and packet, two buffers), each
+    behind the test the data path makes.
+
+    Args:
+        trace (list): The IPv6 packets.
+        capture (Optional[PacketCapture]): The capture, None when it is off.
+
+    Returns:
+        float: The CPU time per packet in nanoseconds.
+    """
+    header = Processing("172.16.2.131", "172.16.2.163").encapsulation_header
+    start = time.process_time()
+    for ipv6_packet in trace:
+        if capture is not None and capture.points & TUN_READ:
+            capture.record(TUN_READ, ipv6_packet)
+        buffers = [header(ipv6_packet), ipv6_packet]
+        if capture is not None and capture.points & PEER_SEND:
+            capture.record(PEER_SEND, buffers, ipv6_packet)
+    return (time.process_time() - start) / len(trace) * 1e9
+
+
+def run(count: int = 200000, flows: int = 64, size: int = 4 * 1024 * 1024, snaplen: int = 128) -> dict:
+    """
+    Measures the cost of the capture on the sending side of the data path for an IMIX trace:
+    off, on with no capture point, on with every packet captured, and with a filter that
+    rejects or accepts every packet. The ring is smaller than the trace, so that it wraps.
+
+    Args:
+        count (int): Number of packets of the trace.
+        flows (int): Number of inner flows of the trace.
+        size (int): Size of the ring file in bytes.
+        snaplen (int): Bytes captured of each packet.
+
+    Returns:
+        dict: For each setting, the CPU time per packet, its overhead over no capture, and the
+              packets captured, overwritten and read back from the ring.
+    """
+    trace = make_trace("imix", count, flows)
+    results = {"packets": count, "ring_bytes": size, "snaplen": snaplen, "settings": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        ring_path, pcapng_path = os.path.join(directory, "ring.pcapng"), os.path.join(directory, "out.pcapng")
+        baseline = None
+        for name, setting in SETTINGS.items():
+            capture = None if setting is None else PacketCapture(ring_path, setting[0], size, snaplen, setting[1])
+            cpu = measure(trace, capture)
+            baseline = cpu if baseline is None else baseline
+            result = {"cpu_ns_per_packet": round(cpu), "overhead_ns_per_packet": round(cpu - baseline)}
+            if capture is not None:
+                capture.close()
+                result.update(captured=capture.captured, overwritten=capture.overwritten,
+                              exported=export(ring_path, pcapng_path))
+            results["settings"][name] = result
+    return results
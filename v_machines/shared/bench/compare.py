@@ -0,0 +1,86 @@
+import json
+
+# Direction of the metrics, recognized by their name
+HIGHER_IS_BETTER = ("pps", "gbit_s", "speedup")
+LOWER_IS_BETTER = ("_us", "_ns", "_ms", "lost", "cpu_")
+
+
+def direction(name: str) -> int:
+    """
+    Tells whether a metric should go up or down.
+
+    Args:
+        name (str): The name of the metric.
+
+    Returns:
+        int: 1 if higher is better, -1 if lower is better, 0 if it is not a performance metric.
+    """
+    if any(marker in name for marker in LOWER_IS_BETTER):
+        return -1
+    if any(marker in name for marker in HIGHER_IS_BETTER):
+        return 1
+    return 0
+
+
+def flatten(result: dict, prefix: str = "") -> dict:
+    """
+    Flattens the numeric values of a benchmark result.
+
+    Args:
+        result (dict): The JSON result of a benchmark.
+        prefix (str): Path of `result` in the whole result.
+
+    Returns:
+        dict: "path/of/the/metric" -> value.
+    """
+    values = {}
+    for name, value in result.items():
+        path = f"{prefix}/{name}" if prefix else name
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def run(baseline: str, candidate: str, threshold: float = 5.0) -> dict:
+    """
+    Compares two JSON results of the same benchmark (e.g. `python3 -m bench pipeline` on two
+    versions): every performance metric worse by more than `threshold` percent is reported as
+    a regression.
+
+    Args:
+        baseline (str): Path of the result of the reference version.
+        candidate (str): Path of the result of the version under test.
+        threshold (float): Tolerated change in percent (run-to-run noise).
+
+    Returns:
+        dict: The revisions, the relative change of each metric (in %, None from a zero) and
+              the regressions.
+    """
+    with open(baseline) as baseline_file, open(candidate) as candidate_file:
+        old, new = json.load(baseline_file), json.load(candidate_file)
+    old_values, new_values = flatten(old), flatten(new)
+    changes, regressions = {}, []
+    for path, old_value in old_values.items():
+        sign = direction(path.rsplit("/", 1)[-1])
+        if not sign or path not in new_values:
+            continue
+        new_value = new_values[path]
+        if old_value == 0:
+            # No relative change from zero (e.g. no loss before): any degradation counts
+            changes[path] = 0.0 if new_value == 0 else None
+            worse = (new_value - old_value) * sign < 0
+        else:
+            change = (new_value - old_value) / abs(old_value) * 100
+            changes[path] = round(change, 1)
+            worse = change * sign < -threshold
+        if worse:
+            regressions.append(path)
+    return {
+        "baseline": old.get("revision", baseline),
+        "candidate": new.get("revision", candidate),
+        "threshold_percent": threshold,
+        "changes_percent": changes,
+        "regressions": regressions,
+    }
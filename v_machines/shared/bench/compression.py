@@ -0,0 +1,119 @@
+import random
+import time
+
+from bench.generators import MIXES, make_packet, mean_size, mix_sizes
+from compression import HeaderDecompressor
+from metrics import Counters
+from pmtu import CARRIER_OVERHEAD
+from processing import Processing
+
+
+def make_trace(mix: str, count: int, flows: int, seed: int = 1) -> list:
+    """
+    Builds a trace of packets of a size mix spread over inner flows, a few flows carrying most
+    of the packets (Zipf weights), as on a real link.
+
+    Args:
+        mix (str): Name of the packet size mix.
+        count (int): Number of packets.
+        flows (int): Number of inner flows (source addresses).
+        seed (int): Seed of the flow of each packet (every run sends the same trace).
+
+    Returns:
+        list: The IPv6 packets.
+    """
+    chooser = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(flows)]
+    flow_ids = chooser.choices(range(flows), weights, k=count)
+    trace = []
+    for seq, (size, flow) in enumerate(zip(mix_sizes(mix, count), flow_ids)):
+        packet = bytearray(make_packet(seq, size))
+        packet[8:24] = b"\xfd" + bytes(13) + flow.to_bytes(2, "big")
+        trace.append(bytes(packet))
+    return trace
+
+
+def measure(trace: list, proto: str, contexts: int, loss: float, seed: int = 1) -> dict:
+    """
+    Sends a trace through the encapsulation with and without header compression, losing
+    packets at random as a datagram carrier would, and checks every packet expanded.
+
+    Args:
+        trace (list): The IPv6 packets.
+        proto (str): The carrier, 'tcp' (contexts sent once) or 'udp' (contexts refreshed).
+        contexts (int): Flow contexts of the compressor.
+        loss (float): Probability that a packet is lost ('udp' only).
+        seed (int): Seed of the losses.
+
+    Returns:
+        dict: Bytes with and without compression, the savings, the compressed share of the
+              packets, the packets lost to a missing context and the CPU time per packet
+              (encapsulation and decapsulation) with and without compression.
+    """
+    counters = Counters()
+    refresh = proto == "udp"
+    processing = Processing("172.16.2.131", "172.16.2.163", compression=contexts, refresh=refresh)
+    compressor = processing.compressor(counters)
+    decompressor = HeaderDecompressor(counters)
+    loser = random.Random(seed)
+    # Headers of the carrier in front of each encapsulated packet (one segment or datagram per packet)
+    carrier = CARRIER_OVERHEAD[proto] - 20
+    plain = compressed = delivered = corrupted = 0
+    start = time.process_time()
+    for ipv6_packet in trace:
+        buffers = processing.compressed_buffers(ipv6_packet, compressor)
+        if buffers is None:
+            buffers = [processing.encapsulation_header(ipv6_packet), ipv6_packet]
+        encapsulated = b"".join(buffers)
+        compressed += carrier + len(encapsulated)
+        plain += carrier + 20 + len(ipv6_packet)
+        if refresh and loser.random() < loss:
+            continue
+        restored = processing.decapsulate(encapsulated, decompressor)
+        if restored is not None:
+            delivered += 1
+            corrupted += bytes(restored) != ipv6_packet
+    cpu = time.process_time() - start
+    encapsulate, decapsulate = processing.encapsulate, processing.decapsulate
+    start = time.process_time()
+    for ipv6_packet in trace:
+        decapsulate(encapsulate(ipv6_packet))
+    plain_cpu = time.process_time() - start
+    return {
+        "plain_bytes": plain,
+        "compressed_bytes": compressed,
+        "savings_percent": round((plain - compressed) / plain * 100, 2),
+        "compressed_share": round(counters.compressed_packets / len(trace), 3),
+        "decompression_drops": counters.decompression_drops,
+        "delivered": delivered,
+        "corrupted": corrupted,
+        "evicted_contexts": compressor.evicted_contexts,
+        "cpu_ns_per_packet": round(cpu / len(trace) * 1e9),
+        "plain_cpu_ns_per_packet": round(plain_cpu / len(trace) * 1e9),
+    }
+
+
+def run(count: int = 100000, flows: int = 64, contexts: int = 256, loss: float = 0.01, mixes: list = None) -> dict:
+    """
+    Measures the bandwidth saved by the header compression on the tcp and udp carriers, for
+    each packet size mix (the IMIX trace first of all), counting the carrier headers.
+
+    Args:
+        count (int): Number of packets of each trace.
+        flows (int): Number of inner flows of the traces.
+        contexts (int): Flow contexts of the compressor.
+        loss (float): Packet loss probability of the udp carrier.
+        mixes (list): Names of the mixes (all of `MIXES` by default).
+
+    Returns:
+        dict: The results of each mix and carrier.
+    """
+    results = {"flows": flows, "contexts": contexts, "udp_loss": loss, "mixes": {}}
+    for mix in mixes or MIXES:
+        trace = make_trace(mix, count, flows)
+        results["mixes"][mix] = {
+            "mean_size": round(mean_size(mix), 1),
+            "tcp": measure(trace, "tcp", contexts, 0.0),
+            "udp": measure(trace, "udp", contexts, loss),
+        }
+    return results
@@ -0,0 +1,53 @@
+import logging
+import socket
+import time
+
+from extremity import Extremity
+
+
+def run(count: int = 1000, timeout: float = 1.0) -> dict:
+    """
+    Measures the latency of the return path (peer -> tunnel) while nothing is read from
+    the tunnel, which used to block forever when the reader held the tunnel lock.
+
+    A SOCK_SEQPACKET socketpair stands in for the TUN device: like a TUN fd it keeps
+    packet boundaries. The reader thread of the endpoint blocks on it (no inbound traffic)
+    while packets are pushed into `tun_write_queue` and timed until they come out.
+
+    Args:
+        count (int): Number of packets written to the tunnel.
+        timeout (float): Seconds to wait for a packet before declaring the path blocked.
+
+    Returns:
+        dict: Latency percentiles in microseconds, or `blocked` set to True.
+    """
+    logging.getLogger("extremity").setLevel(logging.WARNING)
+    tun_side, kernel_side = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    kernel_side.settimeout(timeout)
+    endpoint = Extremity("fc00::1/64", tun_side.fileno(), "127.0.0.1", "127.0.0.1", 0, 0)
+    endpoint.executor.submit(endpoint.handle_tun_read)
+    endpoint.executor.submit(endpoint.handle_tun_write)
+
+    ipv6_packet = bytes([0x60]) + bytes(99)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        endpoint.tun_write_queue.put(ipv6_packet)
+        try:
+            kernel_side.recv(len(ipv6_packet))
+        except socket.timeout:
+            return {"blocked": True, "timeout_s": timeout}
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    latencies.sort()
+    # Stop the worker threads: EOF for the reader, sentinel for the writer
+    kernel_side.close()
+    endpoint.tun_write_queue.put(None)
+    endpoint.executor.shutdown()
+    tun_side.close()
+    return {
+        "blocked": False,
+        "packets": count,
+        "p50_us": round(latencies[len(latencies) // 2], 1),
+        "p99_us": round(latencies[int(len(latencies) * 0.99)], 1),
+    }
@@ -0,0 +1,160 @@
+import logging
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+
+from async_extremity import AsyncExtremity
+from bench.generators import make_packet
+from extremity import Extremity
+
+ENGINES = {"threads": Extremity, "asyncio": AsyncExtremity}
+
+
+def free_port() -> int:
+    """
+    Returns a TCP port that is currently free on the loopback interface.
+
+    Returns:
+        int: The port number.
+    """
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as probe:
+        probe.bind(("", 0))
+        return probe.getsockname()[1]
+
+
+def _serve(engine: str, tun_fd: int, src_port: int, dst_port: int) -> None:
+    """
+    Runs one endpoint on loopback (target of the benchmark child processes).
+
+    Args:
+        engine (str): Name of the engine in `ENGINES`.
+        tun_fd (int): The fd standing in for the TUN device.
+        src_port (int): The port the endpoint listens on.
+        dst_port (int): The port of the other endpoint.
+    """
+    for name in ("extremity", "async_extremity", "session"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    ENGINES[engine]("fc00::1/64", tun_fd, "127.0.0.1", "127.0.0.1", src_port, dst_port).start()
+
+
+def start_pair(engine: str) -> tuple:
+    """
+    Starts a sender and a receiver endpoint connected over loopback, each in its own process,
+    with SOCK_SEQPACKET socketpairs in place of their TUN devices.
+
+    Only the sender -> receiver direction is measured (nothing is written to the receiver TUN).
+
+    Args:
+        engine (str): Name of the engine in `ENGINES`.
+
+    Returns:
+        tuple: The processes, the "kernel" side of the sender TUN and of the receiver TUN.
+    """
+    sender_tun, sender_kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    receiver_tun, receiver_kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    # A TUN write never blocks: give the stand-in room, so the receiver does not drop
+    receiver_tun.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+    sender_port, receiver_port = free_port(), free_port()
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_serve, args=(engine, receiver_tun.fileno(), receiver_port, sender_port), daemon=True),
+        context.Process(target=_serve, args=(engine, sender_tun.fileno(), sender_port, receiver_port), daemon=True),
+    ]
+    for process in processes:
+        process.start()
+        time.sleep(0.3)
+
+    # Wait until a packet goes through the whole tunnel
+    receiver_kernel.settimeout(0.2)
+    for attempt in range(50):
+        sender_kernel.send(make_packet(attempt, 64))
+        try:
+            receiver_kernel.recv(65535)
+            break
+        except socket.timeout:
+            continue
+    else:
+        raise RuntimeError(f"The {engine} endpoints could not connect")
+
+    # Drain the remaining warm-up packets
+    receiver_kernel.settimeout(0.5)
+    try:
+        while True:
+            receiver_kernel.recv(65535)
+    except socket.timeout:
+        receiver_kernel.settimeout(5)
+    return processes, sender_kernel, receiver_kernel
+
+
+def measure_throughput(sender_kernel: socket.socket, receiver_kernel: socket.socket, count: int, size: int) -> tuple:
+    """
+    Floods the sender TUN stand-in and counts the packets coming out of the receiver one.
+
+    The receiver is read in a thread while the calling thread sends. The measure stops at
+    the last received packet (lost packets are detected by the receive timeout).
+
+    Args:
+        sender_kernel (socket.socket): The "kernel" side of the sender TUN.
+        receiver_kernel (socket.socket): The "kernel" side of the receiver TUN.
+        count (int): Number of packets to send.
+        size (int): Size of the IPv6 packets.
+
+    Returns:
+        tuple: The number of received packets and the elapsed time in seconds.
+    """
+    received = [0, 0.0]
+
+    def receive() -> None:
+        try:
+            while received[0] < count:
+                receiver_kernel.recv(65535)
+                received[0] += 1
+                received[1] = time.perf_counter()
+        except socket.timeout:
+            pass
+
+    receiver = threading.Thread(target=receive)
+    start = received[1] = time.perf_counter()
+    receiver.start()
+    for seq in range(count):
+        sender_kernel.send(make_packet(seq, size))
+    receiver.join()
+    return received[0], received[1] - start
+
+
+def run(count: int = 20000, size: int = 1400, probes: int = 2000) -> dict:
+    """
+    Compares the engines over loopback: packets per second under flood, and one-way latency
+    (p50/p99) of packets sent one at a time.
+
+    Args:
+        count (int): Number of packets of the throughput run.
+        size (int): Size of the IPv6 packets of the throughput run.
+        probes (int): Number of packets of the latency run.
+
+    Returns:
+        dict: The results of each engine.
+    """
+    results = {}
+    for engine in ENGINES:
+        processes, sender_kernel, receiver_kernel = start_pair(engine)
+        latencies = []
+        for seq in range(probes):
+            sender_kernel.send(make_packet(seq, 64))
+            packet = receiver_kernel.recv(65535)
+            latencies.append(time.perf_counter() - struct.unpack_from("!Qd", packet, 40)[1])
+        latencies.sort()
+
+        received, elapsed = measure_throughput(sender_kernel, receiver_kernel, count, size)
+
+        for process in processes:
+            process.terminate()
+        results[engine] = {
+            "pps": round(received / elapsed) if received else 0,
+            "lost": count - received,
+            "p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+            "p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+        }
+    return results
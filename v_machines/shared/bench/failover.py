@@ -0,0 +1,110 @@
+import multiprocessing
+import socket
+import struct
+import threading
+import time
+
+from bench.engines import ENGINES, _serve, free_port, make_packet
+
+
+def measure_failover(engine: str, downtime: float, interval: float) -> dict:
+    """
+    Sends a steady packet stream through a tunnel, kills the receiving endpoint, restarts it
+    after `downtime` and measures how long the sender takes to deliver packets again.
+
+    The receiver runs in a child process that is terminated then started again on the same
+    port and the same TUN stand-in; the sender is never restarted, its session reconnects.
+
+    Args:
+        engine (str): Name of the engine in `ENGINES`.
+        downtime (float): Seconds during which the receiver is down.
+        interval (float): Seconds between two sent packets.
+
+    Returns:
+        dict: Failover time (receiver back -> first delivered packet), outage seen by the
+              traffic, and packets lost.
+    """
+    sender_tun, sender_kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    receiver_tun, receiver_kernel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    # A TUN write never blocks: give the stand-in room for the packets sent after the reconnection
+    receiver_tun.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+    sender_port, receiver_port = free_port(), free_port()
+    context = multiprocessing.get_context("fork")
+
+    def start_receiver() -> multiprocessing.Process:
+        process = context.Process(target=_serve, args=(engine, receiver_tun.fileno(), receiver_port, sender_port), daemon=True)
+        process.start()
+        return process
+
+    receiver = start_receiver()
+    sender = context.Process(target=_serve, args=(engine, sender_tun.fileno(), sender_port, receiver_port), daemon=True)
+    sender.start()
+
+    arrivals = []
+    running = threading.Event()
+    running.set()
+
+    def receive() -> None:
+        receiver_kernel.settimeout(0.2)
+        while running.is_set():
+            try:
+                packet = receiver_kernel.recv(65535)
+            except socket.timeout:
+                continue
+            arrivals.append((time.perf_counter(), struct.unpack_from("!Q", packet, 40)[0]))
+
+    def send() -> None:
+        seq = 0
+        while running.is_set():
+            sender_kernel.send(make_packet(seq, 100))
+            seq += 1
+            time.sleep(interval)
+        sent[0] = seq
+
+    sent = [0]
+    threads = [threading.Thread(target=receive), threading.Thread(target=send)]
+    for thread in threads:
+        thread.start()
+
+    # Steady state, then the receiver goes away
+    time.sleep(1.5)
+    killed_at = time.perf_counter()
+    receiver.terminate()
+    receiver.join()
+    time.sleep(downtime)
+    restarted_at = time.perf_counter()
+    receiver = start_receiver()
+    time.sleep(3.0)
+
+    running.clear()
+    for thread in threads:
+        thread.join()
+    receiver.terminate()
+    sender.terminate()
+
+    before = [arrival for arrival, _ in arrivals if arrival < killed_at]
+    after = [arrival for arrival, _ in arrivals if arrival > restarted_at]
+    delivered = len({seq for _, seq in arrivals})
+    if not after:
+        return {"recovered": False, "sent": sent[0], "delivered": delivered}
+    return {
+        "recovered": True,
+        "failover_ms": round((after[0] - restarted_at) * 1e3, 1),
+        "outage_ms": round((after[0] - before[-1]) * 1e3, 1) if before else None,
+        "sent": sent[0],
+        "lost": sent[0] - delivered,
+    }
+
+
+def run(downtime: float = 1.0, interval: float = 0.001) -> dict:
+    """
+    Measures the failover of each engine when the remote endpoint restarts.
+
+    Args:
+        downtime (float): Seconds during which the remote endpoint is down.
+        interval (float): Seconds between two sent packets.
+
+    Returns:
+        dict: The results of each engine.
+    """
+    return {engine: measure_failover(engine, downtime, interval) for engine in ENGINES}
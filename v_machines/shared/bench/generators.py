@@ -0,0 +1,73 @@
+import struct
+import time
+from typing import List
+
+# Packet size mixes: (IPv6 packet size, weight). "imix" is the classic 7:4:1 Internet mix,
+# its 40-byte packets raised to 64 bytes (smallest packet carrying a sequence and a timestamp).
+MIXES = {
+    "64": [(64, 1)],
+    "imix": [(64, 7), (576, 4), (1400, 1)],
+    "1400": [(1400, 1)],
+}
+PROBE = struct.Struct("!Qd")  # sequence number and send time, right after the IPv6 header
+
+
+def make_packet(seq: int, size: int) -> bytes:
+    """
+    Builds a synthetic IPv6 packet carrying a sequence number and a send timestamp.
+
+    Args:
+        seq (int): Sequence number of the packet.
+        size (int): Total size of the packet (at least 56 bytes).
+
+    Returns:
+        bytes: The IPv6 packet (next header 59, "no next header").
+    """
+    header = struct.pack("!IHBB16s16s", 0x60000000, size - 40, 59, 64, bytes(16), bytes(16))
+    return header + PROBE.pack(seq, time.perf_counter()) + bytes(size - 56)
+
+
+def read_probe(packet: bytes) -> tuple:
+    """
+    Reads the sequence number and the send time of a packet built by `make_packet`.
+
+    Args:
+        packet (bytes): The packet.
+
+    Returns:
+        tuple: The sequence number and the send time (`time.perf_counter` of the sender).
+    """
+    return PROBE.unpack_from(packet, 40)
+
+
+def mix_sizes(mix: str, count: int) -> List[int]:
+    """
+    Returns the sizes of `count` packets following a mix, the sizes interleaved as evenly as
+    the weights allow (deterministic: every run sends the same sequence).
+
+    Args:
+        mix (str): Name of the mix in `MIXES`.
+        count (int): Number of packets.
+
+    Returns:
+        List[int]: The size of each packet.
+    """
+    cycle = []
+    weights = MIXES[mix]
+    for round_index in range(max(weight for _, weight in weights)):
+        cycle.extend(size for size, weight in weights if round_index < weight)
+    return [cycle[index % len(cycle)] for index in range(count)]
+
+
+def mean_size(mix: str) -> float:
+    """
+    Returns the mean packet size of a mix.
+
+    Args:
+        mix (str): Name of the mix in `MIXES`.
+
+    Returns:
+        float: The mean size in bytes.
+    """
+    weights = MIXES[mix]
+    return sum(size * weight for size, weight in weights) / sum(weight for _, weight in weights)
@@ -0,0 +1,211 @@
+import os
+import subprocess
+import sys
+import time
+
+from bench.offload import NAMESPACES, read_metrics
+from bench.striping import LossyLink
+
+# One endpoint in a namespace: TUN device, Extremity, metrics on a Unix socket. The carrier
+# connections use the congestion control under test (a namespace cannot change its default).
+ENDPOINT = """
+import logging, socket, subprocess
+logging.disable(logging.CRITICAL)
+from iftun import Interface
+from extremity import Extremity
+from metrics import MetricsServer
+from session import PeerSession
+connect = PeerSession.connect
+def connect_with_congestion(session):
+    client = connect(session)
+    if client is not None:
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, b"{congestion}")
+    return client
+PeerSession.connect = connect_with_congestion
+tun_fd, _ = Interface("tun64").tun_alloc()
+subprocess.run("ip address add {address}/64 dev tun64 nodad && ip link set tun64 mtu {mtu} up", shell=True, check=True)
+endpoint = Extremity("{address}/64", tun_fd, "{local}", "{remote}", 6464, 6464, proto="{proto}", mtu={mtu}, scheduler="{scheduler}")
+MetricsServer(endpoint.metrics, path="{metrics}").start()
+endpoint.start()
+"""
+
+# Behind the second endpoint: a bulk TCP sink and a UDP echo server
+RECEIVER = """
+import socket, threading
+def sink(connection):
+    while connection.recv(1 << 20):
+        pass
+server = socket.socket(socket.AF_INET6)
+server.bind(("fd00:64::2", 5001))
+server.listen()
+def accept():
+    while True:
+        threading.Thread(target=sink, args=(server.accept()[0],), daemon=True).start()
+threading.Thread(target=accept, daemon=True).start()
+echo = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+echo.bind(("fd00:64::2", 5002))
+while True:
+    data, address = echo.recvfrom(2048)
+    echo.sendto(data, address)
+"""
+
+# Behind the first endpoint: `flows` bulk TCP connections (if any) while a UDP ping of
+# `size` bytes is sent every `interval`, for `seconds` (answers are awaited 2 s more). Prints
+# the round trip times in microseconds (-1 for a lost ping), the bulk bytes sent and the time.
+SENDER = """
+import socket, struct, threading, time
+data = bytes(1 << 16)
+sent = [0]
+running = [True]
+def bulk():
+    connection = socket.socket(socket.AF_INET6)
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, b"{congestion}")
+    connection.connect(("fd00:64::2", 5001))
+    while running[0]:
+        connection.sendall(data)
+        sent[0] += len(data)
+    connection.close()
+threads = [threading.Thread(target=bulk) for _ in range({flows})]
+for thread in threads:
+    thread.start()
+time.sleep({warmup})
+ping = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+ping.connect(("fd00:64::2", 5002))
+ping.settimeout(0.1)
+count = int({seconds} / {interval})
+rtts = [-1] * count
+def answers():
+    while running[0]:
+        try:
+            number, sent_at = struct.unpack_from("!Id", ping.recv(2048))
+        except socket.timeout:
+            continue
+        rtts[number] = round((time.perf_counter() - sent_at) * 1e6)
+receiver = threading.Thread(target=answers)
+receiver.start()
+start_bytes = sent[0]
+start = time.perf_counter()
+for number in range(count):
+    sent_at = time.perf_counter()
+    ping.send(struct.pack("!Id", number, sent_at).ljust({size}, b"\\0"))
+    time.sleep(max(0.0, sent_at + {interval} - time.perf_counter()))
+elapsed = time.perf_counter() - start
+bulk_bytes = sent[0] - start_bytes
+time.sleep(2)
+running[0] = False
+receiver.join()
+for thread in threads:
+    thread.join()
+print(" ".join(map(str, rtts)), bulk_bytes, elapsed)
+"""
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Returns a percentile of a sorted list (nearest rank).
+
+    Args:
+        values (list): The sorted values.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        float: The value (0 for an empty list).
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(scheduler: str, proto: str, flows: int, seconds: float, interval: float, size: int, rate: float, delay: float, limit: int, mtu: int, congestion: str) -> dict:
+    """
+    Measures the round trip time of a small-packet ping through a tunnel between two
+    namespaces while `flows` bulk TCP connections saturate it. The carrier link is the
+    bottleneck (a `LossyLink` without loss): the backlog builds up in the tunnel endpoint,
+    where the scheduler decides what leaves first, instead of being spread over the
+    kernel buffers of a CPU-bound endpoint.
+
+    Args:
+        scheduler (str): Scheduler of both endpoints ('fifo', 'drr' or 'fq_codel').
+        proto (str): Transport between the endpoints.
+        flows (int): Bulk TCP connections (0: idle tunnel).
+        seconds (float): Duration of the ping.
+        interval (float): Seconds between two pings.
+        size (int): Payload bytes of a ping.
+        rate (float): Bits per second of the carrier link.
+        delay (float): One-way delay of the carrier link in seconds.
+        limit (int): Packets the carrier link holds at most in each direction.
+        mtu (int): MTU of both TUN devices.
+        congestion (str): TCP congestion control of the carrier and bulk connections.
+
+    Returns:
+        dict: Round trip time percentiles (ms), lost pings, bulk throughput and queue drops
+              of the sending endpoint.
+    """
+    for namespace in NAMESPACES:
+        subprocess.run(["ip", "netns", "add", namespace], check=True)
+    processes, link = [], None
+    try:
+        link = LossyLink(0.0, delay, rate, limit)
+        for index, namespace in reversed(list(enumerate(NAMESPACES, 1))):
+            script = ENDPOINT.format(address=f"fd00:64::{index}", mtu=mtu, local=f"10.64.0.{index}",
+                                     remote=f"10.64.0.{3 - index}", proto=proto, scheduler=scheduler,
+                                     metrics=f"/tmp/{namespace}.sock", congestion=congestion)
+            processes.append(subprocess.Popen(["ip", "netns", "exec", namespace, sys.executable, "-c", script], cwd=os.getcwd()))
+            time.sleep(1)
+        processes.append(subprocess.Popen(["ip", "netns", "exec", "tun64b", sys.executable, "-c", RECEIVER]))
+        time.sleep(1)
+        script = SENDER.format(flows=flows, warmup=1.0 if flows else 0.0, seconds=seconds, interval=interval, size=size,
+                               congestion=congestion)
+        result = subprocess.run(["ip", "netns", "exec", "tun64a", sys.executable, "-c", script],
+                                check=True, capture_output=True, text=True, timeout=seconds + 60)
+        *rtts, bulk_bytes, elapsed = result.stdout.split()
+        rtts = [int(rtt) for rtt in rtts]
+        answered = sorted(rtt / 1e3 for rtt in rtts if rtt >= 0)
+        metrics = read_metrics("/tmp/tun64a.sock")
+        return {
+            "rtt_p50_ms": round(percentile(answered, 0.5), 2),
+            "rtt_p99_ms": round(percentile(answered, 0.99), 2),
+            "rtt_max_ms": round(answered[-1] if answered else 0, 2),
+            "lost_pings": len(rtts) - len(answered),
+            "bulk_mbit_s": round(int(bulk_bytes) * 8 / float(elapsed) / 1e6, 1),
+            "queue_dropped_packets": int(metrics["tun_read_queue_dropped_packets_total"]),
+        }
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+        if link is not None:
+            link.close()
+        for namespace in NAMESPACES:
+            subprocess.run(["ip", "netns", "del", namespace])
+            if os.path.exists(f"/tmp/{namespace}.sock"):
+                os.unlink(f"/tmp/{namespace}.sock")
+
+
+def run(proto: str = "tcp", flows: int = 4, seconds: float = 5.0, interval: float = 0.01, size: int = 64, rate: float = 20e6, delay: float = 0.005, limit: int = 64, mtu: int = 1400, congestion: str = "cubic") -> dict:
+    """
+    Compares the latency of a ping flow under load for each egress scheduler, with the ping
+    alone as the reference (needs root). The default congestion control is the loss-based
+    one of Linux, which fills the queues (BBR keeps them short by itself).
+
+    Args:
+        proto (str): Transport between the endpoints.
+        flows (int): Bulk TCP connections saturating the tunnel.
+        seconds (float): Duration of each measure.
+        interval (float): Seconds between two pings.
+        size (int): Payload bytes of a ping.
+        rate (float): Bits per second of the carrier link.
+        delay (float): One-way delay of the carrier link in seconds.
+        limit (int): Packets the carrier link holds at most in each direction.
+        mtu (int): MTU of the TUN devices.
+        congestion (str): TCP congestion control of the carrier and bulk connections.
+
+    Returns:
+        dict: The link parameters, the idle reference, then the result of each scheduler under load.
+    """
+    link = (rate, delay, limit, mtu, congestion)
+    results = {"proto": proto, "flows": flows, "rate_mbit_s": rate / 1e6, "delay_ms": delay * 1e3, "limit": limit, "congestion": congestion,
+               "idle": measure("fifo", proto, 0, seconds, interval, size, *link)}
+    for scheduler in ("fifo", "drr", "fq_codel"):
+        results[scheduler] = measure(scheduler, proto, flows, seconds, interval, size, *link)
+    return results
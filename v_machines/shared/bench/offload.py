@@ -0,0 +1,140 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+NAMESPACES = ("tun64a", "tun64b")
+
+# One endpoint in a namespace: TUN device, Extremity, metrics on a Unix socket
+ENDPOINT = """
+import logging, subprocess
+logging.disable(logging.CRITICAL)
+from iftun import Interface
+from extremity import Extremity
+from metrics import MetricsServer
+tun_fd, _ = Interface("tun64", offload={offload}).tun_alloc()
+subprocess.run("ip address add {address}/64 dev tun64 nodad && ip link set tun64 mtu {mtu} up", shell=True, check=True)
+endpoint = Extremity("{address}/64", tun_fd, "{local}", "{remote}", 6464, 6464, proto="{proto}", offload={offload})
+MetricsServer(endpoint.metrics, path="{metrics}").start()
+endpoint.start()
+"""
+
+# Bulk TCP receiver behind the second endpoint
+RECEIVER = """
+import socket
+server = socket.socket(socket.AF_INET6)
+server.bind(("fd00:64::2", 5001))
+server.listen()
+connection, _ = server.accept()
+while connection.recv(1 << 20):
+    pass
+connection.sendall(b"done")
+"""
+
+# Bulk TCP sender behind the first endpoint: prints the elapsed time
+SENDER = """
+import socket, time
+data = bytes(1 << 20)
+connection = socket.create_connection(("fd00:64::2", 5001))
+start = time.perf_counter()
+for _ in range({megabytes}):
+    connection.sendall(data)
+connection.shutdown(socket.SHUT_WR)
+connection.recv(16)
+print(time.perf_counter() - start)
+"""
+
+
+def read_metrics(path: str) -> dict:
+    """
+    Reads the metrics served by an endpoint on a Unix socket.
+
+    Args:
+        path (str): The path of the socket.
+
+    Returns:
+        dict: Metric name (without the prefix) -> value.
+    """
+    client = socket.socket(socket.AF_UNIX)
+    client.connect(path)
+    text = b""
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        text += chunk
+    client.close()
+    values = {}
+    for line in text.decode().splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.split()
+            values[name.split("_", 1)[1]] = float(value)
+    return values
+
+
+def transfer(proto: str, offload: bool, megabytes: int, mtu: int) -> dict:
+    """
+    Sends `megabytes` MB of TCP through a tunnel between two network namespaces.
+
+    Args:
+        proto (str): Transport between the endpoints.
+        offload (bool): Open both TUN devices with `IFF_VNET_HDR`.
+        megabytes (int): Size of the transfer.
+        mtu (int): MTU of both TUN devices.
+
+    Returns:
+        dict: Throughput, and reads from the TUN device of the sending side.
+    """
+    for namespace in NAMESPACES:
+        subprocess.run(["ip", "netns", "add", namespace], check=True)
+    processes = []
+    try:
+        subprocess.run(["ip", "link", "add", "veth64a", "netns", "tun64a", "type", "veth",
+                        "peer", "name", "veth64b", "netns", "tun64b"], check=True)
+        for index, namespace in enumerate(NAMESPACES, 1):
+            for command in (["address", "add", f"10.64.0.{index}/24", "dev", f"veth64{namespace[-1]}"],
+                            ["link", "set", "lo", "up"],
+                            ["link", "set", f"veth64{namespace[-1]}", "up"]):
+                subprocess.run(["ip", "-n", namespace, *command], check=True)
+        for index, namespace in reversed(list(enumerate(NAMESPACES, 1))):
+            script = ENDPOINT.format(offload=offload, address=f"fd00:64::{index}", mtu=mtu,
+                                     local=f"10.64.0.{index}", remote=f"10.64.0.{3 - index}",
+                                     proto=proto, metrics=f"/tmp/{namespace}.sock")
+            processes.append(subprocess.Popen(["ip", "netns", "exec", namespace, sys.executable, "-c", script], cwd=os.getcwd()))
+            time.sleep(1)
+        processes.append(subprocess.Popen(["ip", "netns", "exec", "tun64b", sys.executable, "-c", RECEIVER]))
+        time.sleep(1)
+        result = subprocess.run(["ip", "netns", "exec", "tun64a", sys.executable, "-c", SENDER.format(megabytes=megabytes)],
+                                check=True, capture_output=True, text=True, timeout=300)
+        elapsed = float(result.stdout)
+        metrics = read_metrics("/tmp/tun64a.sock")
+        return {
+            "gbit_s": round(megabytes * 8 * (1 << 20) / elapsed / 1e9, 2),
+            "tun_reads": int(metrics["tun_read_packets_total"]),
+            "bytes_per_read": round(metrics["tun_read_bytes_total"] / max(1, metrics["tun_read_packets_total"])),
+        }
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+        for namespace in NAMESPACES:
+            subprocess.run(["ip", "netns", "del", namespace])
+            if os.path.exists(f"/tmp/{namespace}.sock"):
+                os.unlink(f"/tmp/{namespace}.sock")
+
+
+def run(megabytes: int = 64, mtu: int = 1400) -> dict:
+    """
+    Compares a bulk TCP transfer through the tunnel with and without the TUN offloads, for each
+    transport (needs root).
+
+    Args:
+        megabytes (int): Size of each transfer.
+        mtu (int): MTU of the TUN devices (below the path MTU, so that no packet is too big).
+
+    Returns:
+        dict: For each transport, the result of each mode.
+    """
+    return {proto: {mode: transfer(proto, mode == "offload", megabytes, mtu) for mode in ("packets", "offload")}
+            for proto in ("tcp", "udp", "raw")}
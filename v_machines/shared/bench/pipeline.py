@@ -0,0 +1,175 @@
+import os
+import platform
+import subprocess
+import threading
+import time
+
+from bench.engines import start_pair
+from bench.generators import MIXES, make_packet, mean_size, mix_sizes, read_probe
+from processing import Processing
+
+
+def cpu_seconds(pids: list) -> float:
+    """
+    Returns the CPU time consumed so far by the threads of processes, read from the scheduler
+    statistics of each thread (nanoseconds, where /proc/<pid>/stat counts clock ticks).
+
+    Args:
+        pids (list): The process ids.
+
+    Returns:
+        float: The CPU time in seconds.
+    """
+    total = 0
+    for pid in pids:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            try:
+                with open(f"/proc/{pid}/task/{task}/schedstat") as schedstat:
+                    total += int(schedstat.read().split()[0])
+            except FileNotFoundError:
+                # The thread ended between the listing and the read
+                continue
+    return total / 1e9
+
+
+def revision() -> str:
+    """
+    Returns the git revision of the tree being measured, to label the results.
+
+    Returns:
+        str: The abbreviated commit hash ("+" appended if the tree is modified), or "unknown".
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("+" if dirty else "")
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Returns a percentile of sorted values.
+
+    Args:
+        values (list): The values, sorted.
+        fraction (float): The percentile, between 0 and 1.
+
+    Returns:
+        float: The value below which `fraction` of the values lie (0 if there is none).
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure_processing(mix: str, count: int) -> dict:
+    """
+    Measures the per-packet cost of the encapsulation and decapsulation of `Processing` alone.
+
+    Args:
+        mix (str): Name of the packet size mix.
+        count (int): Number of packets.
+
+    Returns:
+        dict: Packets per second and CPU time per packet.
+    """
+    processing = Processing("172.16.2.131", "172.16.2.163")
+    packets = [make_packet(seq, size) for seq, size in enumerate(mix_sizes(mix, count))]
+    encapsulate, decapsulate = processing.encapsulate, processing.decapsulate
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for packet in packets:
+        decapsulate(encapsulate(packet))
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    return {"pps": round(count / elapsed), "cpu_ns_per_packet": round(cpu / count * 1e9)}
+
+
+def measure_pipeline(engine: str, mix: str, count: int, probes: int) -> dict:
+    """
+    Measures a whole tunnel: two endpoints over loopback, socketpairs in place of the TUN
+    devices (see `bench.engines.start_pair`). The sender stand-in is flooded with the packets
+    of the mix; CPU time is that of both endpoint processes. The latency is measured on
+    `probes` packets of the mix sent one at a time.
+
+    Args:
+        engine (str): Name of the engine (see `bench.engines.ENGINES`).
+        mix (str): Name of the packet size mix.
+        count (int): Number of packets of the flood.
+        probes (int): Number of packets of the latency run.
+
+    Returns:
+        dict: pps, Gbit/s (IPv6 packets), loss, CPU per packet and one-way latency percentiles.
+    """
+    processes, sender_kernel, receiver_kernel = start_pair(engine)
+    pids = [process.pid for process in processes]
+    try:
+        latencies = []
+        for seq, size in enumerate(mix_sizes(mix, probes)):
+            sender_kernel.send(make_packet(seq, size))
+            packet = receiver_kernel.recv(65535)
+            latencies.append(time.perf_counter() - read_probe(packet)[1])
+        latencies.sort()
+
+        packets = [make_packet(seq, size) for seq, size in enumerate(mix_sizes(mix, count))]
+        received = [0, 0, 0.0]
+
+        def receive() -> None:
+            try:
+                while received[0] < count:
+                    received[1] += len(receiver_kernel.recv(65535))
+                    received[0] += 1
+                    received[2] = time.perf_counter()
+            except OSError:
+                pass
+
+        receiver = threading.Thread(target=receive)
+        cpu_start = cpu_seconds(pids)
+        start = received[2] = time.perf_counter()
+        receiver.start()
+        for packet in packets:
+            sender_kernel.send(packet)
+        receiver.join()
+        elapsed = received[2] - start
+        cpu = cpu_seconds(pids) - cpu_start
+    finally:
+        for process in processes:
+            process.terminate()
+    return {
+        "pps": round(received[0] / elapsed) if received[0] else 0,
+        "gbit_s": round(received[1] * 8 / elapsed / 1e9, 3) if received[0] else 0,
+        "lost": count - received[0],
+        "cpu_us_per_packet": round(cpu / max(1, received[0]) * 1e6, 2),
+        "p50_us": round(percentile(latencies, 0.5) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 0.99) * 1e6, 1),
+    }
+
+
+def run(engine: str = "threads", count: int = 20000, probes: int = 2000, mixes: list = None) -> dict:
+    """
+    Runs the processing and the pipeline measures for each packet size mix, without any TUN
+    device nor privilege. The result is labelled with the git revision, so that the JSON of
+    two versions can be compared (`python3 -m bench compare`).
+
+    Args:
+        engine (str): Name of the engine of the pipeline.
+        count (int): Number of packets of each measure.
+        probes (int): Number of packets of each latency run.
+        mixes (list): Names of the mixes (all of `MIXES` by default).
+
+    Returns:
+        dict: The context of the run and the results of each mix.
+    """
+    results = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "engine": engine,
+        "mixes": {},
+    }
+    for mix in mixes or MIXES:
+        results["mixes"][mix] = {
+            "mean_size": round(mean_size(mix), 1),
+            "processing": measure_processing(mix, count * 10),
+            "pipeline": measure_pipeline(engine, mix, count, probes),
+        }
+    return results
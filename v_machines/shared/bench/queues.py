@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+
+from packet_queue import DROP_POLICIES, PacketQueue
+
+
+def _spin(duration_ns: int) -> None:
+    """
+    Busy-waits (a sleep is far less precise than a few microseconds).
+
+    Args:
+        duration_ns (int): The duration in nanoseconds.
+    """
+    end = time.perf_counter_ns() + duration_ns
+    while time.perf_counter_ns() < end:
+        pass
+
+
+def overload(packet_queue, count: int, size: int, service_ns: int, arrival_ns: int) -> dict:
+    """
+    Offers packets to a queue twice as fast as they are served, as a tunnel reader does when
+    the peer is slower than the tunnel, and measures the queueing delay and memory.
+
+    Args:
+        packet_queue: A `PacketQueue`, or a `queue.Queue` of (enqueue time, packet) items.
+        count (int): Number of offered packets.
+        size (int): Size of the packets.
+        service_ns (int): Time the consumer spends on each packet.
+        arrival_ns (int): Time between two offered packets.
+
+    Returns:
+        dict: Sojourn time percentiles, peak queued bytes and drops.
+    """
+    packet = bytes(size)
+    sojourns = []
+    done = threading.Event()
+
+    def consume() -> None:
+        while True:
+            try:
+                enqueued, item = packet_queue.get(timeout=0.2) if isinstance(packet_queue, queue.Queue) else packet_queue.get()
+            except queue.Empty:
+                if done.is_set():
+                    return
+                continue
+            if item is None:
+                return
+            sojourns.append(time.perf_counter_ns() - enqueued)
+            _spin(service_ns)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    peak = 0
+    legacy = isinstance(packet_queue, queue.Queue)
+    for _ in range(count):
+        if legacy:
+            packet_queue.put((time.perf_counter_ns(), packet))
+            peak = max(peak, packet_queue.qsize() * size)
+        else:
+            packet_queue.put(packet)
+            peak = max(peak, packet_queue.bytes)
+        _spin(arrival_ns)
+    done.set()
+    packet_queue.put((0, None) if legacy else None)
+    consumer.join()
+
+    sojourns.sort()
+    return {
+        "delivered": len(sojourns),
+        "dropped": count - len(sojourns),
+        "peak_kib": round(peak / 1024),
+        "p50_ms": round(sojourns[len(sojourns) // 2] / 1e6, 2),
+        "p99_ms": round(sojourns[int(len(sojourns) * 0.99)] / 1e6, 2),
+    }
+
+
+def run(count: int = 50000, size: int = 1400, budget: int = 1024 * 1024, service_us: float = 20.0) -> dict:
+    """
+    Compares the unbounded `queue.Queue` with the drop policies of `PacketQueue` under a
+    2x overload: the consumer takes `service_us` per packet, packets arrive twice as often.
+
+    Args:
+        count (int): Number of offered packets.
+        size (int): Size of the packets.
+        budget (int): Byte budget of the bounded queues.
+        service_us (float): Service time of a packet, in microseconds.
+
+    Returns:
+        dict: The results of each queue.
+    """
+    service_ns = int(service_us * 1000)
+    results = {"unbounded": overload(queue.Queue(), count, size, service_ns, service_ns // 2)}
+    for policy in DROP_POLICIES:
+        results[policy] = overload(PacketQueue(budget, policy), count, size, service_ns, service_ns // 2)
+    return results
@@ -0,0 +1,103 @@
+import ipaddress
+import random
+import time
+
+from routes import RouteTable
+
+
+def random_routes(count: int, peers: int, seed: int) -> list:
+    """
+    Builds random (prefix, peer) routes, with prefix lengths spread from /16 to /64 as in a
+    real table of islands, plus a few host routes.
+
+    Args:
+        count (int): Number of routes.
+        peers (int): Number of distinct peers.
+        seed (int): Seed of the generator (reproducible tables).
+
+    Returns:
+        list: The (prefix, peer) pairs.
+    """
+    generator = random.Random(seed)
+    routes = {}
+    while len(routes) < count:
+        length = 128 if generator.random() < 0.01 else generator.randint(16, 64)
+        address = (0xFC << 120) | generator.getrandbits(120)
+        network = ipaddress.IPv6Network((address >> (128 - length) << (128 - length), length))
+        routes[str(network)] = f"10.{generator.randrange(peers) // 256}.{generator.randrange(peers) % 256}.1"
+    return list(routes.items())
+
+
+def linear_lookup(entries: list, address: int):
+    """
+    Reference lookup: scans every route, longest prefix first.
+
+    Args:
+        entries (list): (length, masked prefix, peer) tuples sorted by decreasing length.
+        address (int): The IPv6 address, as an integer.
+
+    Returns:
+        The peer of the longest matching prefix, or None.
+    """
+    for length, masked, peer in entries:
+        if address >> (128 - length) == masked:
+            return peer
+    return None
+
+
+def run(count: int = 10000, lookups: int = 100000, peers: int = 100, seed: int = 64) -> dict:
+    """
+    Times the longest-prefix match of `RouteTable` against a linear scan, on destinations
+    taken half inside the routed prefixes and half at random.
+
+    Args:
+        count (int): Number of routes.
+        lookups (int): Number of timed lookups.
+        peers (int): Number of distinct peers.
+        seed (int): Seed of the generator.
+
+    Returns:
+        dict: Build time, number of distinct prefix lengths and the cost per lookup.
+    """
+    routes = random_routes(count, peers, seed)
+    start = time.perf_counter()
+    table = RouteTable(routes)
+    table.compile()
+    build = time.perf_counter() - start
+
+    generator = random.Random(seed + 1)
+    addresses = []
+    for index in range(lookups):
+        if index % 2:
+            addresses.append(generator.getrandbits(128))
+        else:
+            network = ipaddress.IPv6Network(routes[generator.randrange(count)][0])
+            addresses.append(int(network.network_address) | generator.getrandbits(128 - network.prefixlen))
+    packets = [bytes(24) + address.to_bytes(16, "big") for address in addresses]
+
+    start = time.perf_counter()
+    results = [table.lookup(address) for address in addresses]
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for packet in packets:
+        table.lookup_packet(packet)
+    per_packet = time.perf_counter() - start
+
+    entries = sorted(((network.prefixlen, int(network.network_address) >> (128 - network.prefixlen), peer)
+                      for network, peer in ((ipaddress.IPv6Network(prefix), peer) for prefix, peer in routes)),
+                     key=lambda entry: -entry[0])
+    sample = addresses[:max(1, lookups // 100)]
+    start = time.perf_counter()
+    expected = [linear_lookup(entries, address) for address in sample]
+    linear = (time.perf_counter() - start) / len(sample) * lookups
+
+    return {
+        "routes": len(table),
+        "prefix_lengths": len(table.lengths),
+        "build_ms": round(build * 1e3, 1),
+        "matches_linear_scan": expected == results[:len(sample)],
+        "lookup_ns": round(indexed / lookups * 1e9),
+        "lookup_packet_ns": round(per_packet / lookups * 1e9),
+        "linear_scan_ns": round(linear / lookups * 1e9),
+    }
@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+
+from bench.engines import measure_throughput, start_pair
+
+
+def _drive(sender_kernel, receiver_kernel, count: int, size: int, results: multiprocessing.Queue) -> None:
+    """
+    Floods one queue and reports its result (target of the driver processes).
+
+    Args:
+        sender_kernel (socket.socket): The "kernel" side of the sender TUN of the queue.
+        receiver_kernel (socket.socket): The "kernel" side of the receiver TUN of the queue.
+        count (int): Number of packets to send.
+        size (int): Size of the IPv6 packets.
+        results (multiprocessing.Queue): Where the (received, elapsed) result is put.
+    """
+    results.put(measure_throughput(sender_kernel, receiver_kernel, count, size))
+
+
+def run(engine: str = "threads", count: int = 20000, size: int = 1400, max_queues: int = 0) -> dict:
+    """
+    Measures the aggregated packets per second as the number of queues grows from 1 to the
+    number of cores.
+
+    Each queue is served like with `--queues N`: one worker process per endpoint, each with its
+    own connection to the peer and its own TUN stand-in, and one driver process per queue
+    generating and counting the traffic.
+
+    Args:
+        engine (str): Name of the engine (see `bench.engines.ENGINES`).
+        count (int): Number of packets sent on each queue.
+        size (int): Size of the IPv6 packets.
+        max_queues (int): Highest number of queues (0 for the number of cores).
+
+    Returns:
+        dict: The aggregated pps for each number of queues.
+    """
+    context = multiprocessing.get_context("fork")
+    results = {"engine": engine, "cores": os.cpu_count(), "pps": {}}
+    for queues in range(1, (max_queues or os.cpu_count()) + 1):
+        pairs = [start_pair(engine) for _ in range(queues)]
+        outcomes = context.Queue()
+        drivers = [context.Process(target=_drive, args=(sender, receiver, count, size, outcomes))
+                   for _, sender, receiver in pairs]
+        for driver in drivers:
+            driver.start()
+        measures = [outcomes.get() for _ in drivers]
+        for driver in drivers:
+            driver.join()
+        for processes, _, _ in pairs:
+            for process in processes:
+                process.terminate()
+        received = sum(measure[0] for measure in measures)
+        elapsed = max(measure[1] for measure in measures)
+        results["pps"][queues] = round(received / elapsed) if received else 0
+    return results
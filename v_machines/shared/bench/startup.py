@@ -0,0 +1,68 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+NAMESPACE = "tun64bench"
+
+# Configures a tunnel as tuninit.py does, inside the namespace, and prints the elapsed time
+CONFIGURE = """
+import json, logging, time
+logging.disable(logging.CRITICAL)
+from iftun import Iftun
+start = time.perf_counter()
+iftun = Iftun(backend="{backend}")
+iftun.create_vnet_device("tun64")
+iftun.set_mtu(1480)
+iftun.set_address("fc00:1234:ffff::1/64", "10.0.1.5", "10.0.0.254", "fc00:1234:ffff::2", "fc00:1234:4::/64")
+configured = time.perf_counter()
+iftun.add_routes([f"fc00:64:{{index:x}}::/48" for index in range({routes})])
+done = time.perf_counter()
+print(json.dumps({{"configure_ms": (configured - start) * 1e3, "routes_ms": (done - configured) * 1e3}}))
+"""
+
+
+def configure_once(backend: str, routes: int) -> dict:
+    """
+    Configures one tunnel in a fresh network namespace (with a veth "eth1" uplink).
+
+    Args:
+        backend (str): "netlink" or "ip".
+        routes (int): Number of hub routes added after the configuration.
+
+    Returns:
+        dict: Time of the configuration and of the routes, in ms.
+    """
+    subprocess.run(["ip", "netns", "add", NAMESPACE], check=True)
+    try:
+        for command in (["link", "add", "eth1", "type", "veth", "peer", "name", "eth1peer"],
+                        ["address", "add", "10.0.0.1/24", "dev", "eth1"],
+                        ["link", "set", "eth1peer", "up"],
+                        ["link", "set", "eth1", "up"]):
+            subprocess.run(["ip", "-n", NAMESPACE, *command], check=True)
+        result = subprocess.run(["ip", "netns", "exec", NAMESPACE, sys.executable, "-c",
+                                 CONFIGURE.format(backend=backend, routes=routes)],
+                                check=True, capture_output=True, text=True, cwd=os.getcwd())
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        subprocess.run(["ip", "netns", "del", NAMESPACE], check=True)
+
+
+def run(runs: int = 5, routes: int = 1000) -> dict:
+    """
+    Compares the startup time of the netlink and ip configuration backends (needs root).
+
+    Args:
+        runs (int): Number of configurations per backend (the median is reported).
+        routes (int): Number of hub routes added after the configuration.
+
+    Returns:
+        dict: Median times of each backend, in ms.
+    """
+    results = {}
+    for backend in ("netlink", "ip"):
+        samples = [configure_once(backend, routes) for _ in range(runs)]
+        results[backend] = {name: round(statistics.median(sample[name] for sample in samples), 1)
+                            for name in ("configure_ms", "routes_ms")}
+    return results
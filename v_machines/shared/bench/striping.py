@@ -0,0 +1,265 @@
+import os
+import random
+import select
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from bench.offload import NAMESPACES, read_metrics
+from iftun import Interface
+
+# One endpoint in a namespace: TUN device, Extremity, metrics on a Unix socket. The carrier
+# connections use the congestion control under test (a namespace cannot change its default).
+ENDPOINT = """
+import logging, socket, subprocess
+logging.disable(logging.CRITICAL)
+from iftun import Interface
+from extremity import Extremity
+from metrics import MetricsServer
+from session import PeerSession
+connect = PeerSession.connect
+def connect_with_congestion(session):
+    client = connect(session)
+    if client is not None:
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, b"{congestion}")
+    return client
+PeerSession.connect = connect_with_congestion
+tun_fd, _ = Interface("tun64").tun_alloc()
+subprocess.run("ip address add {address}/64 dev tun64 nodad && ip link set tun64 mtu {mtu} up", shell=True, check=True)
+endpoint = Extremity("{address}/64", tun_fd, "{local}", "{remote}", 6464, 6464, mtu={mtu}, stripes={stripes}, stripe_mode="{mode}")
+MetricsServer(endpoint.metrics, path="{metrics}").start()
+endpoint.start()
+"""
+
+# Inner TCP receiver behind the second endpoint: prints the bytes and the time between the
+# first and the last one
+RECEIVER = """
+import socket, threading, time
+server = socket.socket(socket.AF_INET6)
+server.bind(("fd00:64::2", 5001))
+server.listen()
+total, times = [0], []
+def receive(connection):
+    while True:
+        data = connection.recv(1 << 20)
+        if not data:
+            break
+        now = time.perf_counter()
+        if not times:
+            times.append(now)
+        total[0] += len(data)
+        times[1:] = [now]
+threads = []
+for _ in range({flows}):
+    connection, _ = server.accept()
+    threads.append(threading.Thread(target=receive, args=(connection,)))
+    threads[-1].start()
+for thread in threads:
+    thread.join()
+print(total[0], times[-1] - times[0])
+"""
+
+# Inner TCP senders behind the first endpoint: `flows` connections sending for `seconds`
+SENDER = """
+import socket, threading, time
+data = bytes(1 << 16)
+def send():
+    connection = socket.socket(socket.AF_INET6)
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_CONGESTION, b"{congestion}")
+    connection.connect(("fd00:64::2", 5001))
+    end = time.perf_counter() + {seconds}
+    while time.perf_counter() < end:
+        connection.sendall(data)
+    connection.close()
+threads = [threading.Thread(target=send) for _ in range({flows})]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+"""
+
+
+class LossyLink:
+    """
+    A point-to-point IPv4 link between two network namespaces, made of one TUN device in each
+    and relayed by this process, which drops a fraction of the packets and delays the others
+    (the kernel of the test machines has no netem). The carrier connections of the tunnel
+    run over it.
+
+    With a `rate`, each direction is a bottleneck: packets leave one after the other at that
+    rate, and those arriving while `limit` packets are waiting are dropped (a router buffer).
+
+    Attributes:
+        loss (float): Probability that a packet is dropped.
+        delay (float): One-way delay in seconds.
+        rate (Optional[float]): Bits per second of each direction (None: unlimited).
+        limit (Optional[int]): Packets waiting at most in each direction (None: unlimited).
+        fds (list): The fd of the TUN device of each side.
+        dropped (int): Packets dropped so far (loss and full buffer).
+    """
+
+    def __init__(self, loss: float, delay: float, rate: Optional[float] = None, limit: Optional[int] = None) -> None:
+        """
+        Creates the TUN devices and moves each into its namespace ("wan64a" into the first one,
+        10.64.0.1/24, "wan64b" into the second, 10.64.0.2/24).
+
+        Args:
+            loss (float): Probability that a packet is dropped.
+            delay (float): One-way delay in seconds.
+            rate (Optional[float]): Bits per second of each direction (None: unlimited).
+            limit (Optional[int]): Packets waiting at most in each direction (None: unlimited).
+        """
+        self.loss = loss
+        self.delay = delay
+        self.rate = rate
+        self.limit = limit
+        self.fds = []
+        self.dropped = 0
+        self.running = True
+        for index, namespace in enumerate(NAMESPACES, 1):
+            name = f"wan64{namespace[-1]}"
+            fd, _ = Interface(name).tun_alloc()
+            self.fds.append(fd)
+            subprocess.run(["ip", "link", "set", name, "netns", namespace], check=True)
+            for command in (["address", "add", f"10.64.0.{index}/24", "dev", name],
+                            ["link", "set", "lo", "up"],
+                            ["link", "set", name, "up"]):
+                subprocess.run(["ip", "-n", namespace, *command], check=True)
+        self.threads = []
+        for source, destination in ((self.fds[0], self.fds[1]), (self.fds[1], self.fds[0])):
+            pending = deque()
+            self.threads.append(threading.Thread(target=self.receive, args=(source, pending), daemon=True))
+            self.threads.append(threading.Thread(target=self.transmit, args=(destination, pending), daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def receive(self, fd: int, pending: deque) -> None:
+        """
+        Reads the packets of one side, dropping some, and schedules the others.
+
+        Args:
+            fd (int): The TUN device of the sending side.
+            pending (deque): The (due time, packet) of the packets in flight.
+        """
+        while self.running:
+            if not select.select([fd], [], [], 0.1)[0]:
+                continue
+            packet = os.read(fd, 65535)
+            if random.random() < self.loss or (self.limit is not None and len(pending) >= self.limit):
+                self.dropped += 1
+                continue
+            pending.append((time.perf_counter() + self.delay, packet))
+
+    def transmit(self, fd: int, pending: deque) -> None:
+        """
+        Writes the scheduled packets to the other side when they are due (in order: the
+        delay is the same for every packet) and, with a rate, once the previous one has left.
+
+        Args:
+            fd (int): The TUN device of the receiving side.
+            pending (deque): The (due time, packet) of the packets in flight.
+        """
+        free_at = 0.0
+        while self.running:
+            if not pending:
+                time.sleep(0.0002)
+                continue
+            wait = max(pending[0][0], free_at) - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            packet = pending.popleft()[1]
+            os.write(fd, packet)
+            if self.rate:
+                free_at = max(free_at, time.perf_counter()) + len(packet) * 8 / self.rate
+
+    def close(self) -> None:
+        """
+        Stops the relay and closes the devices.
+        """
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        for fd in self.fds:
+            os.close(fd)
+
+
+def transfer(stripes: int, mode: str, flows: int, seconds: float, loss: float, delay: float, mtu: int, congestion: str) -> dict:
+    """
+    Sends inner TCP traffic through a tunnel whose carrier connections cross a lossy link.
+
+    Args:
+        stripes (int): Connections between the endpoints.
+        mode (str): Stripe mode of both endpoints ('flow' or 'packet').
+        flows (int): Parallel inner TCP connections.
+        seconds (float): Duration of the transfer.
+        loss (float): Packet loss probability of the link.
+        delay (float): One-way delay of the link in seconds.
+        mtu (int): MTU of both TUN devices of the tunnel.
+        congestion (str): TCP congestion control of the carrier and inner connections.
+
+    Returns:
+        dict: Inner throughput, and reordering counters of the receiving endpoint.
+    """
+    for namespace in NAMESPACES:
+        subprocess.run(["ip", "netns", "add", namespace], check=True)
+    processes, link = [], None
+    try:
+        link = LossyLink(loss, delay)
+        for index, namespace in reversed(list(enumerate(NAMESPACES, 1))):
+            script = ENDPOINT.format(address=f"fd00:64::{index}", mtu=mtu, local=f"10.64.0.{index}",
+                                     remote=f"10.64.0.{3 - index}", stripes=stripes, mode=mode,
+                                     metrics=f"/tmp/{namespace}.sock", congestion=congestion)
+            processes.append(subprocess.Popen(["ip", "netns", "exec", namespace, sys.executable, "-c", script], cwd=os.getcwd()))
+            time.sleep(1)
+        receiver = subprocess.Popen(["ip", "netns", "exec", "tun64b", sys.executable, "-c", RECEIVER.format(flows=flows)],
+                                    stdout=subprocess.PIPE, text=True)
+        processes.append(receiver)
+        time.sleep(1)
+        subprocess.run(["ip", "netns", "exec", "tun64a", sys.executable, "-c", SENDER.format(flows=flows, seconds=seconds, congestion=congestion)],
+                       check=True, timeout=seconds + 120)
+        received, elapsed = receiver.communicate(timeout=120)[0].split()
+        metrics = read_metrics("/tmp/tun64b.sock")
+        return {
+            "mbit_s": round(int(received) * 8 / float(elapsed) / 1e6, 1),
+            "link_dropped": link.dropped,
+            "reorder_late_packets": int(metrics["reorder_late_packets_total"]),
+            "reorder_skipped_packets": int(metrics["reorder_skipped_packets_total"]),
+        }
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+        if link is not None:
+            link.close()
+        for namespace in NAMESPACES:
+            subprocess.run(["ip", "netns", "del", namespace])
+            if os.path.exists(f"/tmp/{namespace}.sock"):
+                os.unlink(f"/tmp/{namespace}.sock")
+
+
+def run(max_stripes: int = 4, flows: int = 8, seconds: float = 5.0, loss: float = 0.01, delay: float = 0.005, mtu: int = 1400, congestion: str = "cubic") -> dict:
+    """
+    Measures how the inner throughput scales with the number of stripes, per flow and per
+    packet, over a link with loss and delay (needs root). The default congestion control is
+    the loss-based one of Linux: with BBR a random loss barely slows a connection down.
+
+    Args:
+        max_stripes (int): Largest number of stripes (1, 2, 4... up to it).
+        flows (int): Parallel inner TCP connections.
+        seconds (float): Duration of each transfer.
+        loss (float): Packet loss probability of the link.
+        delay (float): One-way delay of the link in seconds.
+        mtu (int): MTU of the TUN devices.
+        congestion (str): TCP congestion control.
+
+    Returns:
+        dict: The link parameters, and for each mode the result of each number of stripes.
+    """
+    counts = [1 << shift for shift in range(max_stripes.bit_length()) if 1 << shift <= max_stripes]
+    results = {"loss": loss, "delay_ms": delay * 1e3, "flows": flows, "congestion": congestion}
+    for mode in ("flow", "packet"):
+        results[mode] = {stripes: transfer(stripes, mode, flows, seconds, loss, delay, mtu, congestion) for stripes in counts}
+    return results
@@ -0,0 +1,127 @@
+import os
+from typing import Optional, Union
+
+from offload import VNET_HDR_LEN
+
+POOL_BUFFERS = 0  # default number of slabs: none, see `BufferPool`
+SLAB_SIZE = 2048  # packet bytes of a slab: a packet of a 1500-byte path fits with its virtio-net header
+HEADROOM = 20  # room left in front of the packet for the IPv4 header of the tunnel
+READ_SIZE = 65535 + VNET_HDR_LEN  # largest read from the TUN device (packet and virtio-net header)
+
+
+class BufferPool:
+    """
+    A fixed set of preallocated packet buffers (slabs), so that reading a packet from the
+    tunnel allocates no `bytes` object: the packet is read with `os.readv` into a free slab
+    and handed over as a `memoryview` of it, until `release` gives the slab back.
+
+    Every slab keeps `HEADROOM` bytes in front of the packet: the IPv4 header of the tunnel is
+    written there (see `IPv4HeaderTemplate.build_into`), and header and packet leave in a
+    single contiguous buffer (see `frame`).
+
+    A read longer than a slab (a TCP super-packet in offload mode) overflows into a scratch
+    buffer and is returned as `bytes`, as is every read while all the slabs are in use: the
+    pool never grows, a burst only costs allocations again (counted in `misses`).
+
+    The pool is off by default: under CPython the slab bookkeeping (memoryview slices, which
+    unlike `bytes` are tracked by the garbage collector, and the release calls) costs more than
+    the allocations of `os.read` it saves (`python3 -m bench pipeline`: about 8% fewer packets
+    per second with 1024 slabs). What it does give is a memory footprint fixed at start.
+
+    `read` and `release` rely on `list.pop`/`list.append` being atomic: the reader takes
+    slabs while the senders (and the queues dropping packets) give them back.
+
+    Attributes:
+        count (int): Number of slabs.
+        size (int): Packet bytes of each slab (after the headroom).
+        free (list): Indexes of the free slabs.
+        misses (int): Reads that could not use a slab (pool empty or packet too long).
+    """
+
+    def __init__(self, count: int = POOL_BUFFERS, size: int = SLAB_SIZE) -> None:
+        """
+        Allocates the slabs.
+
+        Args:
+            count (int): Number of slabs (0: no pool, every read allocates).
+            size (int): Packet bytes of each slab.
+        """
+        self.count = count
+        self.size = size
+        self.slabs = [bytearray(HEADROOM + size) for _ in range(count)]
+        # Views are built once: slicing them is the only per-packet work
+        self.views = [memoryview(slab) for slab in self.slabs]
+        self.index = {id(slab): index for index, slab in enumerate(self.slabs)}
+        self.overflow = bytearray(READ_SIZE - size)
+        self.iovecs = [[view[HEADROOM:], self.overflow] for view in self.views]
+        self.free = list(range(count))
+        self.misses = 0
+
+    def read(self, fd: int) -> Union[bytes, memoryview]:
+        """
+        Reads one packet from a file descriptor (one packet per read, as the TUN device).
+        Only one thread may read through a pool (the overflow buffer is shared).
+
+        Args:
+            fd (int): The file descriptor.
+
+        Returns:
+            Union[bytes, memoryview]: The packet, a view of a slab to `release` once sent
+                                      (empty at the end of the file).
+        """
+        if not self.free:
+            if self.count:
+                self.misses += 1
+            return os.read(fd, READ_SIZE)
+        index = self.free.pop()
+        try:
+            nbytes = os.readv(fd, self.iovecs[index])
+        except BaseException:
+            self.free.append(index)
+            raise
+        if nbytes <= self.size:
+            return self.views[index][HEADROOM:HEADROOM + nbytes]
+        self.misses += 1
+        packet = bytes(self.iovecs[index][0]) + self.overflow[:nbytes - self.size]
+        self.free.append(index)
+        return packet
+
+    def frame(self, packet: Union[bytes, memoryview]) -> Optional[memoryview]:
+        """
+        Returns the headroom and the packet of a slab as one writable view.
+
+        Args:
+            packet (Union[bytes, memoryview]): A packet returned by `read`.
+
+        Returns:
+            Optional[memoryview]: `HEADROOM` bytes followed by the packet, or None if the
+                                  packet is not held by a slab.
+        """
+        if type(packet) is not memoryview:
+            return None
+        index = self.index.get(id(packet.obj))
+        if index is None:
+            return None
+        return self.views[index][:HEADROOM + len(packet)]
+
+    def release(self, packet: Union[bytes, memoryview, None]) -> None:
+        """
+        Gives the slab of a packet back to the pool (no-op for a packet not held by a slab).
+        The packet must not be used afterwards, and must be released only once.
+
+        Args:
+            packet (Union[bytes, memoryview, None]): A packet returned by `read`.
+        """
+        if type(packet) is memoryview:
+            index = self.index.get(id(packet.obj))
+            if index is not None:
+                self.free.append(index)
+
+    def available(self) -> int:
+        """
+        Returns the number of free slabs.
+
+        Returns:
+            int: The number of slabs not holding a packet.
+        """
+        return len(self.free)
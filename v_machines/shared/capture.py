@@ -0,0 +1,475 @@
+import ipaddress
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Union
+
+# Points of the data path where packets can be captured, each an interface of the capture file
+CAPTURE_POINTS = ("tun_read", "peer_send", "peer_receive", "tun_write")
+# The bit of each capture point in `PacketCapture.points`
+TUN_READ, PEER_SEND, PEER_RECEIVE, TUN_WRITE = (1 << index for index in range(len(CAPTURE_POINTS)))
+CAPTURE_SIZE = 16 * 1024 * 1024  # bytes of the ring file
+SNAPLEN = 128  # bytes kept of each packet: the headers and the start of the payload
+
+LINKTYPE_RAW = 101  # raw IPv4 or IPv6 packets, no link-layer header
+SECTION_HEADER = 0x0A0D0D0A
+INTERFACE_DESCRIPTION = 1
+ENHANCED_PACKET = 6
+FILLER = 0x80000001  # local block type (high bit): the free part of the ring, skipped by readers
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+OPTION_IF_NAME = 2
+BLOCK_MIN = 12  # type, length, length
+
+NEXT_HEADERS = {"icmp6": 58, "tcp": 6, "udp": 17}
+
+_block_header = struct.Struct("<II")
+_length = struct.Struct("<I")
+_trailers = [struct.Struct(f"<{padding}xI") for padding in range(4)]  # zero padding, then the block length
+_enhanced_packet = struct.Struct("<IIIIIII")  # type, length, interface, timestamp high/low, captured and original lengths
+
+
+def _padded(length: int) -> int:
+    """
+    Rounds a length up to a multiple of 4 (pcapng blocks and fields are 32-bit aligned).
+
+    Args:
+        length (int): The length.
+
+    Returns:
+        int: The padded length.
+    """
+    return (length + 3) & ~3
+
+
+def _block(block_type: int, body: bytes) -> bytes:
+    """
+    Builds a pcapng block around its body.
+
+    Args:
+        block_type (int): The block type.
+        body (bytes): The body, padded to 32 bits.
+
+    Returns:
+        bytes: The block.
+    """
+    length = BLOCK_MIN + len(body)
+    return _block_header.pack(block_type, length) + body + _length.pack(length)
+
+
+class CaptureFilter:
+    """
+    A filter on the inner IPv6 header of the captured packets, in the syntax of the pcap
+    filters (a subset of it):
+
+        [src|dst] host ADDRESS       [src|dst] net PREFIX       [src|dst] port PORT
+        proto NAME|NUMBER            tcp  udp  icmp6            len >|>=|<|<=|= LENGTH
+        not, and, or (!, &&, ||) and parentheses
+
+    e.g. "tcp and dst port 443 and not net fd00:1::/64". The protocol is the next header of
+    the IPv6 header (extension headers are not walked), the ports those of a TCP or UDP
+    packet, the length the one given by the IPv6 header (40 + payload length). Packets that are
+    not IPv6 never match.
+
+    Attributes:
+        expression (str): The filter.
+        match (Callable[[bytes], bool]): Tells whether an IPv6 packet passes the filter.
+    """
+
+    _token = re.compile(r"\s*(&&|\|\||>=|<=|[()!<>=]|[^\s()!<>=&|]+)")
+
+    def __init__(self, expression: str) -> None:
+        """
+        Compiles the filter.
+
+        Args:
+            expression (str): The filter.
+
+        Raises:
+            ValueError: If the filter is invalid.
+        """
+        self.expression = expression
+        self.tokens = self._token.findall(expression)
+        if "".join(self.tokens) != re.sub(r"\s+", "", expression):
+            raise ValueError(f"Invalid capture filter: {expression}")
+        self.position = 0
+        match = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Invalid capture filter: unexpected '{self.tokens[self.position]}'")
+        self.match = lambda packet: len(packet) >= 40 and packet[0] >> 4 == 6 and match(packet)
+
+    def _peek(self) -> Optional[str]:
+        """
+        Returns the next token (None at the end of the filter).
+        """
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self) -> str:
+        """
+        Consumes the next token.
+
+        Raises:
+            ValueError: At the end of the filter.
+        """
+        token = self._peek()
+        if token is None:
+            raise ValueError(f"Invalid capture filter: {self.expression} (incomplete)")
+        self.position += 1
+        return token
+
+    def _or(self) -> Callable[[bytes], bool]:
+        """
+        Compiles alternatives: term ('or' term)*.
+        """
+        expression = self._and()
+        while self._peek() in ("or", "||"):
+            self._next()
+            # Nested closures: no generator per packet
+            expression = (lambda left, right: lambda packet: left(packet) or right(packet))(expression, self._and())
+        return expression
+
+    def _and(self) -> Callable[[bytes], bool]:
+        """
+        Compiles conjunctions: factor ('and' factor)*.
+        """
+        expression = self._not()
+        while self._peek() in ("and", "&&"):
+            self._next()
+            expression = (lambda left, right: lambda packet: left(packet) and right(packet))(expression, self._not())
+        return expression
+
+    def _not(self) -> Callable[[bytes], bool]:
+        """
+        Compiles a negation, a parenthesized expression or a primitive.
+        """
+        if self._peek() in ("not", "!"):
+            self._next()
+            factor = self._not()
+            return lambda packet: not factor(packet)
+        if self._peek() == "(":
+            self._next()
+            expression = self._or()
+            if self._next() != ")":
+                raise ValueError(f"Invalid capture filter: {self.expression} (unbalanced parentheses)")
+            return expression
+        return self._primitive()
+
+    def _primitive(self) -> Callable[[bytes], bool]:
+        """
+        Compiles a primitive (protocol, length, host, net or port).
+        """
+        token = self._next()
+        if token in NEXT_HEADERS:
+            next_header = NEXT_HEADERS[token]
+            return lambda packet: packet[6] == next_header
+        if token == "proto":
+            name = self._next()
+            next_header = NEXT_HEADERS.get(name)
+            if next_header is None:
+                if not name.isdigit() or int(name) > 255:
+                    raise ValueError(f"Invalid capture filter: unknown protocol '{name}'")
+                next_header = int(name)
+            return lambda packet: packet[6] == next_header
+        if token == "len":
+            operator, length = self._next(), self._number(self._next(), 65535 + 40)
+            compare = {">": int.__gt__, ">=": int.__ge__, "<": int.__lt__, "<=": int.__le__, "=": int.__eq__}.get(operator)
+            if compare is None:
+                raise ValueError(f"Invalid capture filter: unknown comparison '{operator}'")
+            # The length of the header: the filter may only be given the headers of a packet
+            return lambda packet: compare(40 + ((packet[4] << 8) | packet[5]), length)
+        directions = ("src", "dst")
+        if token in directions:
+            directions = (token,)
+            token = self._next()
+        if token == "port":
+            port = self._number(self._next(), 65535).to_bytes(2, "big")
+            if len(directions) == 1:
+                offset = 40 if directions[0] == "src" else 42
+                return lambda packet: packet[6] in (6, 17) and len(packet) >= 44 and packet[offset:offset + 2] == port
+            return lambda packet: packet[6] in (6, 17) and len(packet) >= 44 and (packet[40:42] == port or packet[42:44] == port)
+        if token in ("host", "net"):
+            try:
+                network = ipaddress.IPv6Network(self._next(), strict=False)
+            except ValueError as e:
+                raise ValueError(f"Invalid capture filter: {e}") from None
+            if token == "host" and network.prefixlen != 128:
+                raise ValueError(f"Invalid capture filter: '{network}' is not a host")
+            prefix, mask = int(network.network_address), int(network.netmask)
+            if len(directions) == 1:
+                offset = 8 if directions[0] == "src" else 24
+                return lambda packet: int.from_bytes(packet[offset:offset + 16], "big") & mask == prefix
+            return lambda packet: (int.from_bytes(packet[8:24], "big") & mask == prefix
+                                   or int.from_bytes(packet[24:40], "big") & mask == prefix)
+        raise ValueError(f"Invalid capture filter: unknown primitive '{token}'")
+
+    def _number(self, token: str, maximum: int) -> int:
+        """
+        Reads a number of the filter.
+
+        Raises:
+            ValueError: If the token is not a number up to `maximum`.
+        """
+        if not token.isdigit() or int(token) > maximum:
+            raise ValueError(f"Invalid capture filter: '{token}' is not a number up to {maximum}")
+        return int(token)
+
+
+class PacketCapture:
+    """
+    Mirrors packets of the data path into a pcapng file of fixed size used as a ring, mapped in
+    memory (`mmap`): a captured packet costs a copy of its first `snaplen` bytes into the map,
+    no system call. The kernel writes the pages back to the file; readers (tcpdump, Wireshark)
+    can open it while the endpoint runs, or after it stopped.
+
+    Each capture point is an interface of the file (named after the point), of link type
+    LINKTYPE_RAW: `tun_read` and `tun_write` hold the IPv6 packets read from and written to the
+    TUN device, `peer_send` and `peer_receive` the packets as sent to and received from the
+    peer (with their IPv4 header, compressed or not).
+
+    When the ring is full, the oldest packets are overwritten. The file is always a valid
+    pcapng file: the free space is a filler block (a local block type readers skip) between
+    the newest packet and the oldest one left. In the file, the packets of the current lap
+    thus come before the older ones; `export` writes them in order.
+
+    Data path callers check `points` first, so a point that is not captured costs an attribute
+    test (and nothing at all when the endpoint has no capture):
+
+        if capture is not None and capture.points & TUN_READ:
+            capture.record(TUN_READ, packet)
+
+    Attributes:
+        path (str): The ring file.
+        points (int): Bit mask of the captured points (bit N: `CAPTURE_POINTS[N]`).
+        snaplen (int): Bytes kept of each packet (at most what a block in the ring can hold).
+        filter (Optional[CaptureFilter]): Packets captured, on their inner IPv6 header.
+        captured (int): Packets captured so far.
+        overwritten (int): Packets overwritten by newer ones.
+        errors (int): Packets that could not be captured (the data path goes on).
+    """
+
+    def __init__(self, path: str, points: Iterable[str] = CAPTURE_POINTS, size: int = CAPTURE_SIZE,
+                 snaplen: int = SNAPLEN, capture_filter: Optional[str] = None) -> None:
+        """
+        Creates (or replaces) the ring file and maps it.
+
+        Args:
+            path (str): The ring file.
+            points (Iterable[str]): The captured points (see `CAPTURE_POINTS`).
+            size (int): Size of the file in bytes.
+            snaplen (int): Bytes kept of each packet (0: whole packets), lowered to what
+                           the ring can hold.
+            capture_filter (Optional[str]): Filter on the inner IPv6 header (see `CaptureFilter`).
+
+        Raises:
+            ValueError: If a point is unknown, the filter invalid, the snap length negative or the
+                        size too small.
+            OSError: If the file cannot be created.
+        """
+        self.points = 0
+        for point in points:
+            if point not in CAPTURE_POINTS:
+                raise ValueError(f"Unknown capture point: {point} (one of {', '.join(CAPTURE_POINTS)})")
+            self.points |= 1 << CAPTURE_POINTS.index(point)
+        if snaplen < 0:
+            raise ValueError(f"Invalid snap length: {snaplen}")
+        self.snaplen = snaplen or 0x40000
+        self.filter = CaptureFilter(capture_filter) if capture_filter else None
+        self.path = path
+        self.captured = 0
+        self.overwritten = 0
+        self.errors = 0
+
+        self.start = len(self._header())
+        size &= ~3
+        if size < self.start + 4096:
+            raise ValueError(f"Capture file too small: {size} bytes (at least {self.start + 4096})")
+        self.end = size
+        # The largest block, and the filler after it, must fit the ring
+        self.snaplen = min(self.snaplen, (self.end - self.start - BLOCK_MIN - 32) & ~3)
+        header = self._header()
+
+        # A new file replaces the previous one: a process still writing to it (handover) keeps
+        # its own copy instead of seeing it truncated under its map
+        temporary = f"{path}.{os.getpid()}"
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+            os.replace(temporary, path)
+        except OSError:
+            os.unlink(temporary)
+            raise
+        finally:
+            os.close(fd)
+        self.map[:self.start] = header
+        # Newest packet ends at `head`, the oldest one left starts at `tail`: a filler in between
+        self.head = self.start
+        self.tail = self.end
+        self._fill(self.head, self.tail)
+        self.lock = threading.Lock()
+
+    def _header(self) -> bytes:
+        """
+        Builds the blocks at the start of the file: the section header, then one interface
+        description per capture point.
+
+        Returns:
+            bytes: The blocks.
+        """
+        header = _block(SECTION_HEADER, struct.pack("<IHHq", BYTE_ORDER_MAGIC, 1, 0, -1))
+        for point in CAPTURE_POINTS:
+            name = point.encode()
+            options = struct.pack("<HH", OPTION_IF_NAME, len(name)) + name.ljust(_padded(len(name)), b"\0") + bytes(4)
+            header += _block(INTERFACE_DESCRIPTION, struct.pack("<HHI", LINKTYPE_RAW, 0, self.snaplen) + options)
+        return header
+
+    def _fill(self, head: int, tail: int) -> None:
+        """
+        Writes the filler block covering the free space between `head` and `tail`, if any.
+        """
+        if tail > head:
+            _block_header.pack_into(self.map, head, FILLER, tail - head)
+            _length.pack_into(self.map, tail - 4, tail - head)
+
+    def record(self, point: int, data: Union[bytes, memoryview, List[bytes]], inner: Union[bytes, memoryview, None] = None) -> None:
+        """
+        Captures a packet, if it passes the filter. Never raises: a packet that cannot be
+        captured is only counted in `errors`.
+
+        Args:
+            point (int): The bit of the capture point (e.g. `TUN_READ`).
+            data (Union[bytes, memoryview, List[bytes]]): The packet, or the buffers it is
+                                                          sent as (joined if captured).
+            inner (Union[bytes, memoryview, None]): The IPv6 packet the filter applies to
+                                                    (`data` by default).
+        """
+        try:
+            self._record(point, data, inner)
+        except (ValueError, IndexError, struct.error):
+            self.errors += 1
+
+    def _record(self, point: int, data: Union[bytes, memoryview, List[bytes]], inner: Union[bytes, memoryview, None] = None) -> None:
+        """
+        Captures a packet, if it passes the filter (see `record`).
+        """
+        if self.filter is not None and not self.filter.match(data if inner is None else inner):
+            return
+        snaplen = self.snaplen
+        if data.__class__ is list:
+            length = 0
+            for buffer in data:
+                length += len(buffer)
+            data = b"".join([buffer[:snaplen] for buffer in data])
+        else:
+            length = len(data)
+        captured = length if length < snaplen else snaplen
+        padding = -captured & 3
+        block_length = 32 + captured + padding
+        timestamp = time.time_ns() // 1000
+        with self.lock:
+            if not self.points:
+                # Closed meanwhile
+                return
+            offset = self._reserve(block_length)
+            memory = self.map
+            _enhanced_packet.pack_into(memory, offset, ENHANCED_PACKET, block_length, point.bit_length() - 1,
+                                       timestamp >> 32, timestamp & 0xFFFFFFFF, captured, length)
+            offset += 28
+            memory[offset:offset + captured] = data[:captured]
+            # Zero padding and trailing length in one write
+            _trailers[padding].pack_into(memory, offset + captured, block_length)
+            self.captured += 1
+
+    def _reserve(self, length: int) -> int:
+        """
+        Makes room for a block at `head`, overwriting the oldest blocks if needed (the lock is held).
+
+        Args:
+            length (int): The length of the block.
+
+        Returns:
+            int: Where the block goes.
+        """
+        head, tail, end = self.head, self.tail, self.end
+        limit = head + length
+        # What is left after the block must hold a filler: no gap of 4 or 8 bytes
+        if limit > end or 0 < end - limit < BLOCK_MIN:
+            # Next lap: the end of the file becomes a filler (dropping the oldest blocks, that
+            # would come after the newest ones), the oldest blocks left are at the start
+            while tail < end:
+                block_type, block_length = _block_header.unpack_from(self.map, tail)
+                if block_type == ENHANCED_PACKET:
+                    self.overwritten += 1
+                tail += block_length
+            self._fill(head, end)
+            head = tail = self.start
+            limit = head + length
+        # A filler always separates the newest block from the oldest one: `export` finds the order with it
+        while tail < end and tail - limit < BLOCK_MIN:
+            block_type, block_length = _block_header.unpack_from(self.map, tail)
+            if block_type == ENHANCED_PACKET:
+                self.overwritten += 1
+            tail += block_length
+        self.head, self.tail = limit, tail
+        self._fill(limit, tail)
+        return head
+
+    def close(self) -> None:
+        """
+        Writes the ring back to the file and unmaps it.
+        """
+        with self.lock:
+            self.points = 0
+            self.map.flush()
+            self.map.close()
+
+
+def export(ring_path: str, path: str) -> int:
+    """
+    Copies the packets of a ring file into a plain pcapng file, oldest first.
+
+    Args:
+        ring_path (str): The ring file written by `PacketCapture`.
+        path (str): The pcapng file to write.
+
+    Returns:
+        int: The number of packets copied.
+
+    Raises:
+        ValueError: If the ring file is not a pcapng file.
+    """
+    with open(ring_path, "rb") as ring:
+        data = ring.read()
+    if len(data) < 28 or _block_header.unpack_from(data)[0] != SECTION_HEADER:
+        raise ValueError(f"{ring_path} is not a pcapng file")
+    header, newer, older = [], [], None
+    offset = 0
+    while offset + BLOCK_MIN <= len(data):
+        block_type, length = _block_header.unpack_from(data, offset)
+        if length < BLOCK_MIN or length % 4 or offset + length > len(data):
+            break
+        block = data[offset:offset + length]
+        if block_type in (SECTION_HEADER, INTERFACE_DESCRIPTION):
+            header.append(block)
+        elif block_type == FILLER:
+            # The free space: what follows it is older than what precedes it
+            if older is None:
+                older = []
+        elif block_type == ENHANCED_PACKET:
+            (newer if older is None else older).append(block)
+        offset += length
+    packets = (older or []) + newer
+    with open(path, "wb") as output:
+        output.write(b"".join(header + packets))
+    return len(packets)
+
+
+if __name__ == "__main__":
+    # Usage: python3 capture.py <ring file> <pcapng file>
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} <ring file> <pcapng file>")
+        sys.exit(1)
+    print(f"{export(sys.argv[1], sys.argv[2])} packets written to {sys.argv[2]}")
@@ -0,0 +1,239 @@
+import random
+import time
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+COMPRESSED_PROTOCOL = 253  # IPv4 protocol of the packets with a compressed header (RFC 3692, experimentation)
+MAX_CONTEXTS = 256  # the context identifier is one byte
+FULL_HEADER = 0x80  # first byte of a packet carrying its whole IPv6 header (context installed)
+GENERATION_MASK = 0x3F  # the generation is the 6 low bits of the first byte
+COMPRESSION_OVERHEAD = 2  # bytes in front of the IPv6 header of a packet installing a context
+IPV6_HEADER_LEN = 40
+REFRESH_PERIOD = 256  # packets of a flow between two full headers at most (RFC 2507, F_MAX_PERIOD)
+REFRESH_TIME = 5.0  # seconds between two full headers of a flow at most (RFC 2507, F_MAX_TIME)
+
+
+class CompressionContext:
+    """
+    What the compressor knows of a flow: its context identifier and when to send its whole
+    header again.
+
+    Attributes:
+        cid (int): Context identifier, from 0 to 255.
+        full_prefix (bytes): Bytes in front of a packet carrying its whole header.
+        prefix (bytes): Bytes replacing the header of the other packets.
+        sent (int): Packets of the flow compressed so far.
+        next_full (int): Value of `sent` at which the next full header is due.
+        interval (int): Packets between the next two full headers.
+        refreshed_at (float): Time of the last full header.
+    """
+    __slots__ = ("cid", "full_prefix", "prefix", "sent", "next_full", "interval", "refreshed_at")
+
+    def __init__(self, cid: int, generation: int) -> None:
+        """
+        Initializes a context whose first packet carries the whole header.
+
+        Args:
+            cid (int): Context identifier.
+            generation (int): Generation of the identifier (changed each time it is reused).
+        """
+        self.cid = cid
+        self.full_prefix = bytes((FULL_HEADER | generation, cid))
+        self.prefix = bytes((generation, cid))
+        self.sent = 0
+        self.next_full = 0
+        self.interval = 1
+        self.refreshed_at = 0.0
+
+
+class HeaderCompressor:
+    """
+    Replaces the IPv6 header of the packets sent to the peer by a 2-byte context reference,
+    in the manner of RFC 2507 (IP header compression).
+
+    Within a flow, every field of the header but the traffic class and the payload length
+    is the same in each packet: the first packet of a flow carries its whole header behind a
+    context identifier (CID) and a generation, and the next ones only those two bytes. The
+    traffic class is restored from the TOS of the IPv4 header, which is a copy of it, and the
+    payload length from the length of the packet: nothing else changes, so nothing else is sent.
+
+        full header:        | 1 | 0 | generation (6) |  CID  | IPv6 header | payload |
+        compressed header:  | 0 | 0 | generation (6) |  CID  | payload |
+
+    The table holds `contexts` flows at most: the least recently used one is evicted and its
+    CID given to the new flow with the next generation, so that a packet still referring to the
+    evicted flow is dropped by the decompressor instead of being given the wrong header.
+
+    On a reliable, ordered carrier (a tcp connection, with one compressor per connection) a
+    flow sends its whole header once. On a datagram carrier a lost full header would leave the
+    decompressor without the context: with `refresh`, the whole header is sent again at
+    exponentially growing intervals after a context is installed (packets 0, 1, 3, 7...), then
+    every `REFRESH_PERIOD` packets or `REFRESH_TIME` seconds ("compressed slow start", RFC 2507,
+    section 7.1), so that the flow gets through again soon after a loss.
+
+    Attributes:
+        contexts (int): Largest number of flows in the table.
+        refresh (bool): Send the whole headers again (datagram carriers).
+        counters (Optional[Counters]): Counts the compressed packets and the full headers.
+        table (OrderedDict): Flow key -> `CompressionContext`, least recently used first.
+        generations (List[int]): Generation of each CID.
+        evicted_contexts (int): Flows evicted to make room in the table.
+    """
+
+    def __init__(self, contexts: int = MAX_CONTEXTS, refresh: bool = False, counters=None) -> None:
+        """
+        Initializes an empty context table.
+
+        Args:
+            contexts (int): Largest number of flows in the table (1 to 256).
+            refresh (bool): Send the whole headers again (datagram carriers).
+            counters (Optional[Counters]): Counters of the endpoint.
+
+        Raises:
+            ValueError: If the number of contexts is out of range.
+        """
+        if not 0 < contexts <= MAX_CONTEXTS:
+            raise ValueError(f"Invalid number of compression contexts: {contexts} (1 to {MAX_CONTEXTS})")
+        self.contexts = contexts
+        self.refresh = refresh
+        self.counters = counters
+        self.table = OrderedDict()
+        # A new compressor (restart, handover) starts from random generations: the decompressor
+        # is unlikely to take a packet of a new flow for one of a previous compressor
+        self.generations = [random.randrange(GENERATION_MASK + 1) for _ in range(contexts)]
+        self.evicted_contexts = 0
+
+    def compress(self, ipv6_packet: Union[bytes, memoryview]) -> Optional[bytes]:
+        """
+        Returns what goes in front of a packet instead of its header (see `Processing.compressed_buffers`).
+
+        Args:
+            ipv6_packet (Union[bytes, memoryview]): The IPv6 packet.
+
+        Returns:
+            Optional[bytes]: The full or compressed prefix (a full one is followed by the whole
+                             packet, a compressed one by its payload), or None if the packet is
+                             not compressed (too short, or a payload length that does not match
+                             its size, e.g. a jumbogram).
+        """
+        if len(ipv6_packet) < IPV6_HEADER_LEN or ipv6_packet[0] >> 4 != 6 \
+                or (ipv6_packet[4] << 8) | ipv6_packet[5] != len(ipv6_packet) - IPV6_HEADER_LEN:
+            return None
+        # Flow label, next header, hop limit and addresses
+        key = ((ipv6_packet[1] & 0x0F) << 16) | (ipv6_packet[2] << 8) | ipv6_packet[3], bytes(ipv6_packet[6:IPV6_HEADER_LEN])
+        context = self.table.get(key)
+        if context is None:
+            context = self.install(key)
+        else:
+            self.table.move_to_end(key)
+        sent = context.sent
+        context.sent = sent + 1
+        if sent == context.next_full or self.refresh and time.monotonic() - context.refreshed_at >= REFRESH_TIME:
+            if self.refresh:
+                context.next_full = sent + context.interval
+                context.interval = min(context.interval * 2, REFRESH_PERIOD)
+                context.refreshed_at = time.monotonic()
+            if self.counters is not None:
+                self.counters.full_headers += 1
+            return context.full_prefix
+        if self.counters is not None:
+            self.counters.compressed_packets += 1
+        return context.prefix
+
+    def install(self, key: tuple) -> CompressionContext:
+        """
+        Gives a CID to a new flow, evicting the least recently used one if the table is full.
+
+        Args:
+            key (tuple): The flow key.
+
+        Returns:
+            CompressionContext: The context of the flow.
+        """
+        if len(self.table) < self.contexts:
+            cid = len(self.table)
+        else:
+            _, evicted = self.table.popitem(last=False)
+            cid = evicted.cid
+            self.evicted_contexts += 1
+        generation = self.generations[cid] = (self.generations[cid] + 1) & GENERATION_MASK
+        context = self.table[key] = CompressionContext(cid, generation)
+        return context
+
+
+class HeaderDecompressor:
+    """
+    Restores the IPv6 headers compressed by the `HeaderCompressor` of the peer.
+
+    A full header installs (or replaces) the context of its CID; a compressed header is
+    expanded from it, unless the context is unknown or of another generation (its full header
+    was lost, or the CID was given to another flow): the packet is then dropped.
+
+    Attributes:
+        contexts (list): For each CID, None or its generation and its header.
+        counters (Optional[Counters]): Counts the packets dropped.
+    """
+
+    def __init__(self, counters=None) -> None:
+        """
+        Initializes a decompressor without any context.
+
+        Args:
+            counters (Optional[Counters]): Counters of the endpoint.
+        """
+        self.contexts = [None] * MAX_CONTEXTS
+        self.counters = counters
+
+    def decompress(self, data: Union[bytes, memoryview], tos: int) -> Optional[Union[bytearray, memoryview]]:
+        """
+        Restores a packet received with a full or compressed header.
+
+        Args:
+            data (Union[bytes, memoryview]): What follows the IPv4 header.
+            tos (int): The TOS of the IPv4 header, the traffic class of the packet.
+
+        Returns:
+            Optional[Union[bytearray, memoryview]]: The IPv6 packet (a view of `data` for a full
+                                                    header, a new buffer otherwise), or None if
+                                                    it cannot be restored.
+        """
+        if len(data) >= COMPRESSION_OVERHEAD:
+            kind, cid = data[0], data[1]
+            if kind & FULL_HEADER:
+                ipv6_packet = data[COMPRESSION_OVERHEAD:]
+                if len(ipv6_packet) >= IPV6_HEADER_LEN:
+                    self.contexts[cid] = (kind & GENERATION_MASK, bytearray(ipv6_packet[:IPV6_HEADER_LEN]))
+                    return ipv6_packet
+            else:
+                context = self.contexts[cid]
+                # A set reserved bit never matches a generation
+                if context is not None and context[0] == kind:
+                    ipv6_packet = context[1] + data[COMPRESSION_OVERHEAD:]
+                    ipv6_packet[0] = 0x60 | tos >> 4
+                    ipv6_packet[1] = (tos & 0x0F) << 4 | (ipv6_packet[1] & 0x0F)
+                    length = len(ipv6_packet) - IPV6_HEADER_LEN
+                    ipv6_packet[4] = length >> 8
+                    ipv6_packet[5] = length & 0xFF
+                    return ipv6_packet
+        if self.counters is not None:
+            self.counters.decompression_drops += 1
+        return None
+
+    def export(self) -> List[list]:
+        """
+        Describes the contexts (e.g. to hand the connection over to another process).
+
+        Returns:
+            List[list]: The CID, generation and header (hex) of each context.
+        """
+        return [[cid, context[0], context[1].hex()] for cid, context in enumerate(self.contexts) if context is not None]
+
+    def load(self, contexts: List[list]) -> None:
+        """
+        Installs the contexts described by `export`.
+
+        Args:
+            contexts (List[list]): The CID, generation and header (hex) of each context.
+        """
+        for cid, generation, header in contexts:
+            self.contexts[cid] = (generation, bytearray.fromhex(header))
@@ -1,16 +1,42 @@
+import errno
 import socket
-from threading import Thread, Lock
+import struct
+from threading import Lock, Thread
 import os
+import time
 from concurrent.futures import ThreadPoolExecutor
 import logging
+from typing import Dict, List, Tuple
 from processing import Processing
+from compression import COMPRESSION_OVERHEAD, COMPRESSED_PROTOCOL, HeaderCompressor, HeaderDecompressor
+from capture import PacketCapture, TUN_READ, PEER_SEND, PEER_RECEIVE, TUN_WRITE
+from framing import PacketFramer, FramingError, DatagramBatch, send_buffers
+from metrics import Counters, PacketTracer, Metrics
 
-from queue import Queue
+from packet_queue import PacketQueue, QUEUE_BYTES
+from scheduler import egress_queue
+from qos import decapsulate_ecn, traffic_class
+from buffers import BufferPool, POOL_BUFFERS, READ_SIZE
+from session import PeerSession
+from striping import ReorderBuffer, REORDER_TIMEOUT, SEQUENCE_MASK, STRIPE_MODES, flow_hash
+from offload import VNET_HDR_LEN, VNET_NONE, FRAME_MAX, wire_size, segment
+from pmtu import PathMTU, PacketTooBig, IP_MTU_DISCOVER, IP_PMTUDISC_DO, PMTU_INTERVAL, set_device_mtu
+from supervisor import Pause, HANDOVER_POLL, PAUSE_TIMEOUT
+from queue import Empty
 # Logs configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-BUFFER_SIZE = 4096  # fixed value of bueffer size
+SEND_BATCH = 64  # maximum number of packets sent with a single sendmsg
+RAW_PROTOCOL = 41  # IPv6 encapsulated in IPv4 (6in4), used by the "raw" transport
+RAW_BUFFER_SIZE = 65535  # a raw socket returns one whole IPv4 datagram per recv
+UDP_BATCH = 64  # maximum number of datagrams received per wakeup
+TCP_NOTSENT_LOWAT = 25  # socket option of linux/tcp.h, not exported by the socket module
+NOTSENT_LOWAT = 16384  # unsent bytes a carrier connection holds at most with a flow scheduler
+# Ancillary data of a datagram sent with a given TOS (none for 0, the TOS of the socket)
+TOS_ANCILLARY = [[(socket.IPPROTO_IP, socket.IP_TOS, tos.to_bytes(4, "little"))] if tos else [] for tos in range(256)]
+# Receive timeout of the stream sockets: a blocked reader checks for a handover this often
+HANDOVER_RCVTIMEO = struct.pack("ll", int(HANDOVER_POLL), int(HANDOVER_POLL % 1 * 1e6))
 
 class Extremity:
     """
@@ -20,19 +46,63 @@ class Extremity:
     Attributes:
         src_port (int): Source port for the local system.
         dst_port (int): Destination port for the remote system.
-        proto (str): Protocol to use ('tcp' or 'udp').
+        proto (str): Protocol to use ('tcp', 'udp' or 'raw' for native IP protocol 41).
+        reuse_port (bool): Whether the listening socket shares its port with other workers.
         tun_fd (int): File descriptor for the tunnel interface.
         dst_address (str): Destination address (IPv6).
         src_address (str): Source address (IPv6).
         threads (list): List of active threads for concurrent operations.
         tun_address (str): The tunnel's IP address.
         connected_client (dict): Dictionary of connected clients.
-        connected_client_lock (Lock): Lock for managing thread-safe access to connected clients.
         encapsulate (Encapsulate): Encapsulation handler for IPv6 within IPv4.
         decapsulate (Decapsulate): Decapsulation handler for extracting IPv6 from IPv4.
+        counters (Counters): Packet counters of the data path.
+        tracer (PacketTracer): Selects the packets traced in the logs (1 in N).
+        metrics (Metrics): Counters, queue depth gauges and send latency histogram.
+        session (PeerSession): The outbound connection to the remote endpoint ('tcp' mode),
+                               the first of `sessions`.
+        sessions (List[PeerSession]): One outbound connection per stripe.
+        stripe_mode (str): How packets are spread over the stripes ('flow' or 'packet').
+        scheduler (str): Order of the packets read from the tunnel ('fifo', 'drr' or 'fq_codel').
+        priority (bool): The packets read from the tunnel go through strict-priority bands by DSCP.
+        stripe_queues (list): The queue of each stripe (`tun_read_queue` first; in 'packet' mode
+                              every stripe shares it), a `PacketQueue` or a `FlowScheduler`.
+        pending_batches (list): For each stripe, the packets whose send failed (and the
+                                sequence number of the first one), sent first on the next connection.
+        reorders (Dict[str, ReorderBuffer]): In 'packet' mode, puts back in order the packets
+                                             received from each peer.
+        path_mtu (PathMTU): Largest packet sent to the peer (path MTU minus the carrier overhead).
+        too_big (PacketTooBig): Builds the ICMPv6 answers to the packets over `path_mtu`.
+        offload (bool): The TUN device was opened with `IFF_VNET_HDR`: every packet read or
+                        written is preceded by a virtio-net header.
+        pool (BufferPool): Buffers the packets are read from the tunnel into, given back once sent.
+        transport (Optional[socket.socket]): The listening socket ('tcp') or the datagram
+                                             socket ('udp', 'raw'), once open or handed over.
+        streams (Dict[socket.socket, str]): The inbound connections being read, and what they
+                                            carry ('peer': encapsulated packets, 'client': IPv6).
+        pause (Pause): Stops the data path at a safe point for a handover (see `suspend`).
+        handover (bool): A `HandoverServer` may take the data path over: the accept loop and
+                         the readers of the inbound connections time out to check for it.
+        compression (int): Flow contexts of the header compressor of each connection ('tcp')
+                           or of the datagram socket ('udp'), 0 when the headers sent are not
+                           compressed. Compressed headers are received whatever the setting.
+        capture (Optional[PacketCapture]): Mirrors the packets of the chosen points of the data
+                                           path into a pcapng ring file (None: no capture).
     """
     
-    def __init__(self,tun_address:str, tun_fd: int, src_address: str, dst_address: str, src_port: int, dst_port: int, proto: str="tcp") -> None:
+    # Human-readable names of the IPv4 protocol numbers (used by the packet trace)
+    PROTOCOL_NAMES = {
+        0x01: "ICMP",
+        0x02: "IGMP",
+        0x06: "TCP",
+        0x11: "UDP",
+        0x29: "ENCAP",
+        0x59: "OSPF",
+        0x84: "SCTP",
+        COMPRESSED_PROTOCOL: "ENCAP (compressed)",
+    }
+    
+    def __init__(self,tun_address:str, tun_fd: int, src_address: str, dst_address: str, src_port: int, dst_port: int, proto: str="tcp", reuse_port: bool=False, trace_every: int=0, queue_bytes: int=QUEUE_BYTES, drop_policy: str="tail", mtu: int=None, offload: bool=False, pool_buffers: int=POOL_BUFFERS, stripes: int=1, stripe_mode: str="flow", scheduler: str="fifo", priority: bool=False, compression: int=0, capture: PacketCapture=None) -> None:
         """
         Initializes the Extremity object with necessary parameters for communication and tunnel handling.
 
@@ -43,27 +113,139 @@ class Extremity:
             dst_address (str): Destination address (IPv6).
             src_port (int): Source port for local system communication.
             dst_port (int): Destination port for remote communication.
-            proto (str): Protocol to be used ('tcp' or 'udp').
+            proto (str): Protocol to be used ('tcp', 'udp' or 'raw').
+            reuse_port (bool): Listen with `SO_REUSEPORT`, so that several worker processes
+                               (one per TUN queue) can share the source port.
+            trace_every (int): Log a trace of 1 packet out of `trace_every` (0: no packet trace).
+            queue_bytes (int): Byte budget of each tunnel queue.
+            drop_policy (str): What to drop when a queue is full ('tail', 'head' or 'codel').
+            mtu (int): Fixed MTU of the tunnel (None: follow the path MTU to the peer).
+            offload (bool): The TUN device hands over TCP super-packets with virtio-net headers
+                            (see `Interface.set_offload`). With the 'tcp' transport the frames
+                            are sent whole, so the remote endpoint must use offload too; the
+                            datagram transports segment them and stay compatible.
+            pool_buffers (int): Number of preallocated buffers of the packets read from the
+                                tunnel (0: a new `bytes` object per packet).
+            stripes (int): Number of connections to the peer ('tcp' mode), each with its own
+                           congestion window, so that a loss only stalls its own stripe.
+            stripe_mode (str): 'flow' (each inner flow on one connection, chosen by the hash of
+                               its 5-tuple: no reordering) or 'packet' (each batch of packets on
+                               the first free connection, numbered and put back in order by the
+                               receiver: both endpoints must use it).
+            scheduler (str): Order in which the packets read from the tunnel are sent: 'fifo'
+                             (arrival order), 'drr' or 'fq_codel' (round robin between the
+                             inner flows, see `FlowScheduler`).
+            priority (bool): Serve the packets read from the tunnel by strict priority of their
+                             DSCP class, each band ordered by `scheduler` (see `PriorityQueues`).
+            compression (int): Compress the IPv6 header of the packets sent, with up to this
+                               many flow contexts per connection (see `HeaderCompressor`; 0: off).
+                               Over udp, the whole headers are sent again now and then, so that
+                               a lost one is made up for.
+            capture (PacketCapture): Where the packets of the capture points go (None: no
+                                     capture). With offload over tcp the carrier packets hold
+                                     virtio-net headers: only `tun_read` and `tun_write` make sense.
+
+        Raises:
+            ValueError: If the stripe mode or the scheduler is unknown, or there is no stripe,
+                        or header compression is asked for with the 'raw' transport or offload.
         """
+        if stripe_mode not in STRIPE_MODES or stripes < 1:
+            raise ValueError(f"Invalid striping: {stripes} stripes, {stripe_mode} mode")
+        if compression and (proto.lower() == "raw" or offload):
+            # A raw socket only carries protocol 41, and a super-packet is not a single header
+            raise ValueError("Header compression requires the tcp or udp transport, without offload")
         self.src_port = src_port
         self.dst_port = dst_port
         self.proto = proto.lower()
+        self.reuse_port = reuse_port
         self.tun_fd = tun_fd
         self.dst_address = dst_address
         self.src_address = src_address
         self.threads = []
         self.tun_address = tun_address
         self.connected_client = {}
+        self.offload = offload
+        
+        # Raw datagrams are sent with DF: routers report a narrower path instead of fragmenting
+        self.compression = compression
+        self.processing = Processing(self.src_address, self.dst_address, dont_fragment=self.proto == "raw",
+                                     offset=VNET_HDR_LEN if offload else 0, compression=compression,
+                                     refresh=self.proto == "udp")
         
-        self.processing = Processing(self.src_address, self.dst_address)
+        # Per-packet statistics and sampled packet trace (no per-packet log records)
+        self.counters = Counters()
+        self.tracer = PacketTracer(trace_every)
+        self.metrics = Metrics(self.counters)
+        # Each capture point costs an attribute test per packet when it is not captured
+        self.capture = capture
+        if capture is not None:
+            self.metrics.counter("capture_packets", lambda: capture.captured)
+            self.metrics.counter("capture_overwritten", lambda: capture.overwritten)
+            self.metrics.counter("capture_errors", lambda: capture.errors)
         
-        # Thread pool for handling multiple concurrent connections
-        self.executor = ThreadPoolExecutor(max_workers=10)
+        # Thread pool for handling multiple concurrent connections (outbound and inbound stripes)
+        self.executor = ThreadPoolExecutor(max_workers=10 + 2 * stripes)
         
+        # Packets are read into preallocated buffers, released once sent or dropped
+        self.pool = BufferPool(pool_buffers)
+        self.metrics.gauge("pool_free_buffers", self.pool.available)
+        self.metrics.counter("pool_misses", lambda: self.pool.misses)
+
         # Synchronization
-        self.tun_lock = Lock()  # To control access to the tunnel
-        self.tun_read_queue = Queue()  # Queue for sequential reading
-        self.tun_write_queue = Queue()  # Queue for sequential writing
+        # No lock on the tunnel: the reader and the writers use it concurrently (full-duplex),
+        # the kernel reads or writes one whole packet per system call.
+        # Both queues are bounded: when the peer is slow or away, packets are dropped
+        # (and counted) instead of piling up in memory with an ever-growing delay.
+        # Packets read from the tunnel are served in arrival order or fairly between the inner flows
+        self.scheduler = scheduler
+        self.priority = priority
+        offset = VNET_HDR_LEN if offload else 0
+        self.tun_read_queue = egress_queue(scheduler, queue_bytes, drop_policy, self.counters, self.release_packet, offset, priority)  # Queue for sequential reading: (read time in ns, packet)
+        self.tun_write_queue = PacketQueue(queue_bytes, drop_policy, self.counters)  # Queue for sequential writing
+        # Per flow, each stripe has its own queue: a stalled connection only holds its own flows
+        self.stripe_mode = stripe_mode
+        self.stripe_queues = [self.tun_read_queue]
+        if stripe_mode == "flow":
+            self.stripe_queues += [egress_queue(scheduler, queue_bytes, drop_policy, self.counters, self.release_packet, offset, priority)
+                                   for _ in range(stripes - 1)]
+        for name, queues in (("tun_read_queue", self.stripe_queues), ("tun_write_queue", [self.tun_write_queue])):
+            self.metrics.gauge(f"{name}_depth", lambda queues=queues: sum(packet_queue.qsize() for packet_queue in queues))
+            self.metrics.gauge(f"{name}_bytes", lambda queues=queues: sum(packet_queue.bytes for packet_queue in queues))
+            self.metrics.counter(f"{name}_dropped_packets", lambda queues=queues: sum(packet_queue.dropped_packets for packet_queue in queues))
+            self.metrics.counter(f"{name}_dropped_bytes", lambda queues=queues: sum(packet_queue.dropped_bytes for packet_queue in queues))
+        if scheduler != "fifo":
+            self.metrics.gauge("scheduler_flows", lambda: sum(len(packet_queue.flows) for packet_queue in self.stripe_queues))
+            self.metrics.counter("scheduler_evicted_flows", lambda: sum(packet_queue.evicted_flows for packet_queue in self.stripe_queues))
+
+        # One outbound connection and one egress writer per stripe, reconnected with backoff ('tcp' mode)
+        self.sessions = [PeerSession(self.dst_address, self.dst_port, lambda client, stripe=stripe: self.ext_in(client, stripe))
+                         for stripe in range(stripes)]
+        self.session = self.sessions[0]
+        self.pending_batches = [([], None) for _ in range(stripes)]
+        self.metrics.gauge("peer_connected", lambda: sum(session.connection is not None for session in self.sessions))
+        self.metrics.counter("peer_connects", lambda: sum(session.connects for session in self.sessions))
+
+        # Per packet, the writers number the packets and the receiver puts them back in order
+        self.sequence = 0
+        self.sequence_lock = Lock()
+        self.reorders = {}
+        if stripe_mode == "packet":
+            self.reorders[self.dst_address] = ReorderBuffer(self.deliver_reordered)
+        self.metrics.gauge("reorder_held_packets", lambda: sum(len(reorder.held) for reorder in self.reorders.values()))
+        self.metrics.counter("reorder_late_packets", lambda: sum(reorder.late for reorder in self.reorders.values()))
+        self.metrics.counter("reorder_skipped_packets", lambda: sum(reorder.skipped for reorder in self.reorders.values()))
+
+        # Packets over the MTU of the tunnel are answered with an ICMPv6 Packet Too Big
+        self.path_mtu = PathMTU(self.dst_address, self.proto, mtu, COMPRESSION_OVERHEAD if compression else 0)
+        self.too_big = PacketTooBig(tun_address)
+        self.metrics.gauge("path_mtu", lambda: self.path_mtu.mtu)
+
+        # The sockets a successor process can take over (see `suspend` and `adopt`)
+        self.transport = None
+        self.streams = {}
+        self.streams_lock = Lock()
+        self.pause = Pause()
+        self.handover = False
 
     def start(self) -> None:
         """
@@ -82,6 +264,10 @@ class Extremity:
         """
         self.executor.submit(self.handle_tun_read)
         self.executor.submit(self.handle_tun_write)
+        if not self.path_mtu.fixed:
+            self.executor.submit(self.watch_mtu)
+        if self.reorders:
+            self.executor.submit(self.watch_reorders)
         self.ext_out()
         self.join_threads()
     
@@ -90,27 +276,39 @@ class Extremity:
         """
             Continuously reads data from the tunnel and processes it in a thread-safe manner.
 
-            This method reads IPv6 packets from the tunnel's file descriptor using a lock to ensure
-            thread safety. Each packet is added to a queue for subsequent handling or forwarding.
+            This method reads IPv6 packets from the tunnel's file descriptor into the buffers of
+            `pool`. Each packet is added to a queue for subsequent handling or forwarding. No lock
+            is held while blocking in `os.readv`, so writes to the tunnel are never delayed by the reader.
 
             Behavior:
-                - Acquires a lock to safely access the tunnel file descriptor.
-                - Adds each packet read to the `tun_read_queue` for further processing.
-                - Logs successful reads and any errors encountered.
+                - Adds each packet read to the `tun_read_queue` for further processing
+                  (the queue drops it if its byte budget is exhausted).
+                - Counts successful reads (sampled trace) and logs any errors encountered.
 
             Raises:
                 Logs any exception encountered during the read operation.
         """
+        pool = self.pool if self.pool.count else None
+        capture = self.capture
         while True:
-            with self.tun_lock:
-                try:
-                    ipv6_packet = os.read(self.tun_fd, BUFFER_SIZE)
-                    if ipv6_packet:
-                        self.tun_read_queue.put(ipv6_packet)
-                        logger.info("Read a packet from the tunnel.")
-                except Exception as e:
-                    logger.error(f"Error while reading from the tunnel: {e}")
+            try:
+                ipv6_packet = pool.read(self.tun_fd) if pool else os.read(self.tun_fd, READ_SIZE)
+                if not ipv6_packet:
+                    logger.info("Tunnel closed, reader stopped.")
                     break
+                self.counters.tun_read_packets += 1
+                self.counters.tun_read_bytes += len(ipv6_packet)
+                if self.tracer.every and self.tracer.sample():
+                    self.trace("tunnel -> peer", ipv6_packet[VNET_HDR_LEN:] if self.offload else ipv6_packet)
+                if capture is not None and capture.points & TUN_READ:
+                    capture.record(TUN_READ, memoryview(ipv6_packet)[VNET_HDR_LEN:] if self.offload else ipv6_packet)
+                # The queue records the read time: time spent in the endpoint until the send.
+                # Once queued, the buffer belongs to the sender, which releases it.
+                self.enqueue(ipv6_packet)
+            except Exception as e:
+                self.counters.errors += 1
+                logger.error(f"Error while reading from the tunnel: {e}")
+                break
 
 
     def handle_tun_write(self) -> None:
@@ -118,48 +316,143 @@ class Extremity:
             Continuously writes data to the tunnel from a thread-safe queue.
 
             This method retrieves IPv6 packets from the `tun_write_queue` and writes them to the
-            tunnel's file descriptor using a lock to ensure thread safety.
+            tunnel's file descriptor, concurrently with `handle_tun_read`.
 
             Behavior:
                 - Retrieves packets from the `tun_write_queue`.
-                - Acquires a lock to safely write packets to the tunnel.
-                - Logs successful writes and any errors encountered.
+                - Writes each packet with a single `os.write` (one packet per system call).
+                - Stops when it retrieves `None` from the queue.
+                - Counts successful writes and logs any errors encountered.
 
             Raises:
                 Logs any exception encountered during the write operation.
         """
         while True:
             try:
-                ipv6_packet = self.tun_write_queue.get()
-                with self.tun_lock:
+                _, ipv6_packet = self.tun_write_queue.get()
+                if ipv6_packet is None:
+                    # Sentinel used to stop the writer
+                    break
+                if self.offload:
+                    os.writev(self.tun_fd, (VNET_NONE, ipv6_packet))
+                else:
                     os.write(self.tun_fd, ipv6_packet)
-                    logger.info("Wrote a packet to the tunnel.")
+                self.counters.tun_written_packets += 1
+                self.counters.tun_written_bytes += len(ipv6_packet)
+                capture = self.capture
+                if capture is not None and capture.points & TUN_WRITE:
+                    capture.record(TUN_WRITE, ipv6_packet)
             except Exception as e:
+                self.counters.errors += 1
                 logger.error(f"Error while writing to the tunnel: {e}")
                 break
             
             
-    def ext_in(self, client: socket.socket) -> None:
+    def ext_in(self, client: socket.socket, stripe: int = 0) -> None:
         """
-            Handles incoming connections and sends data from the local tunnel to the remote endpoint.
+        Sends the packets of the local tunnel to the remote endpoint until the connection fails.
 
-            Args:
-                client (socket.socket): The client connection to the remote endpoint.
+        This is the egress writer of a stripe (see `sessions`): only one runs at a time per
+        stripe. The batch whose send failed is kept in `pending_batches` and sent again, whole
+        and with the same sequence numbers, on the next connection of the stripe (a packet cut
+        by the failure is never delivered from the old stream). A stop sentinel in the queue
+        parks the writer between two batches (see `suspend`), or ends it if the session was stopped.
+        The header compressor lives as long as the connection: the decompressor of the peer
+        reads the same stream.
+
+        Args:
+            client (socket.socket): The client connection to the remote endpoint.
+            stripe (int): The stripe the connection belongs to.
         """
         logger.info("Ipv6 writer Thread launched...")
+        if self.scheduler != "fifo" or self.priority:
+            # The backlog must wait in the scheduler, not in the send buffer where it leaves
+            # in arrival order: the send blocks as soon as a few packets are not sent yet
+            client.setsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, NOTSENT_LOWAT)
+        packet_queue = self.stripe_queues[stripe] if self.stripe_mode == "flow" else self.tun_read_queue
+        batch, sequence = self.pending_batches[stripe]
+        self.pending_batches[stripe] = ([], None)
+        compressor = self.processing.compressor(self.counters)
         
         while True:
+            stop = False
+            if not batch:
+                if self.stripe_mode == "flow":
+                    batch, stop = self.take_batch(packet_queue)
+                else:
+                    # Whoever holds the lock waits for the next batch: the stripes take turns
+                    # as they become free, and the numbering follows the queue order
+                    with self.sequence_lock:
+                        batch, stop = self.take_batch(packet_queue)
+                        sequence = self.sequence
+                        self.sequence = (sequence + len(batch)) & SEQUENCE_MASK
+
+            # The packets are never copied: a pooled packet goes with its header in its headroom
+            buffers = []
+            packet_id = sequence
+            capture = self.capture
+            # The buffers of each packet, captured once sent
+            captured = [] if capture is not None and capture.points & PEER_SEND else None
+            if self.pool.count or compressor is not None or captured is not None:
+                for _, ipv6_packet in batch:
+                    packet_buffers = self.encapsulated(ipv6_packet, packet_id, compressor)
+                    buffers.extend(packet_buffers)
+                    if captured is not None:
+                        captured.append((packet_buffers, ipv6_packet))
+                    if packet_id is not None:
+                        packet_id = (packet_id + 1) & SEQUENCE_MASK
+            else:
+                header = self.processing.encapsulation_header
+                for _, ipv6_packet in batch:
+                    buffers.append(header(ipv6_packet, packet_id))
+                    buffers.append(ipv6_packet)
+                    if packet_id is not None:
+                        packet_id = (packet_id + 1) & SEQUENCE_MASK
             try:
-                ipv6_packet = self.tun_read_queue.get()
-                if ipv6_packet:
-                    encapsulated_packet = self.processing.encapsulate(ipv6_packet)
-                    client.sendall(encapsulated_packet)
-                    logger.info(f"Data sent from local tunnel to {self.dst_address}")
-                    
-            except Exception as e:
+                send_buffers(client, buffers)
+            except OSError as e:
+                self.pending_batches[stripe] = (batch, sequence)
+                self.counters.errors += 1
                 logger.error(f"Failed to send data to {self.dst_address}: {e}")
-                break
-        client.close()
+                return
+            self.sent(batch)
+            if captured:
+                for packet_buffers, ipv6_packet in captured:
+                    capture.record(PEER_SEND, packet_buffers, ipv6_packet)
+            if self.pool.count:
+                for _, ipv6_packet in batch:
+                    self.pool.release(ipv6_packet)
+            batch = None
+            if stop:
+                # Nothing of a packet is left half-sent: the connection can change hands
+                self.pause.park(client)
+                if self.sessions[stripe].stopped.is_set():
+                    return
+
+
+    def take_batch(self, packet_queue: PacketQueue) -> Tuple[list, bool]:
+        """
+        Waits for one packet, then takes the backlog (up to `SEND_BATCH` packets), so that
+        everything is sent in one system call. The batch ends at a stop sentinel (`None`).
+
+        Args:
+            packet_queue (PacketQueue): The queue of the stripe.
+
+        Returns:
+            Tuple[list, bool]: The (read time in ns, packet) items, and whether the sentinel
+                               was taken.
+        """
+        batch = []
+        item = packet_queue.get()
+        try:
+            while item[1] is not None:
+                batch.append(item)
+                if len(batch) == SEND_BATCH:
+                    return batch, False
+                item = packet_queue.get_nowait()
+        except Empty:
+            return batch, False
+        return batch, True
     
         
    
@@ -167,6 +460,7 @@ class Extremity:
         """
             Initializes the server socket (TCP/UDP) and starts listening for incoming connections 
             and handles protocol-specific logic for either TCP or UDP communication.
+            In "raw" and "udp" modes there is no server socket: `raw` or `udp` is called instead.
 
             This method is responsible for delegating the appropriate handling 
             mechanism based on the protocol specified for the connection (TCP or UDP).
@@ -179,26 +473,43 @@ class Extremity:
                                     the tcp or udp method for further processing.
         """
         
+        if self.proto == "raw":
+            # No port and no connection: packets are exchanged directly as IP protocol 41
+            self.raw()
+            return
+        if self.proto == "udp":
+            # A single connected datagram socket carries both directions
+            self.udp()
+            return
+        
+        server = self.transport
         try:
-            server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM if self.proto == "tcp" else socket.SOCK_DGRAM)
-            # server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            server.bind(("", self.src_port))
+            if server is None:
+                server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+                # A restarted endpoint must be able to listen again while old connections linger
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                
+                server.bind(("", self.src_port))
+                self.transport = server
             
-            self.tcp(server) if self.proto == "tcp" else self.udp(server)
+            self.tcp(server)
         
         except socket.error as e:
             logger.error(f"Cannot connect to port: {self.src_port} - {e}")
             
         finally:
-            server.close()
+            if server is not None:
+                server.close()
              
 
 
     def tcp(self, server: socket.socket) -> None:
         """
-            Handles TCP connections, establishes connections with remote server, and manages multiple threads for
-            reading and writing data.
+            Handles TCP connections: the session with the remote endpoint runs in its own thread
+            (`PeerSession`, reconnected with backoff), while this loop accepts the inbound
+            connections and starts a reader for each of them.
 
             Args:
                 server (socket.socket): The server socket for handling incoming TCP connections.
@@ -206,21 +517,24 @@ class Extremity:
         
         logger.info(f"TCP connection mode started on {self.src_port}")
         
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # The outbound connection lives on its own: accepting never waits for the peer
+        self.connect_peers()
+        
+        server.listen()
+        if self.handover:
+            # The accepted connections inherit the receive timeout: no reader blocks for good
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, HANDOVER_RCVTIMEO)
         while True:
-            
+            if self.pause.requested:
+                self.pause.park(server)
             try:
-                client.connect((self.dst_address, self.dst_port))
-                logger.info(f"Connexion established with: {self.dst_address}")                
-                self.executor.submit(self.ext_in, client)
-            except Exception as e:
-                pass
-            
-            server.listen()
-            connexion, conn_address = server.accept()
+                connexion, conn_address = server.accept()
+            except BlockingIOError:
+                # Receive timeout: time to check for a handover
+                continue
             logger.info(f"Connected with: {conn_address}")
             
-            if conn_address[0].split(":")[-1] != self.dst_address:
+            if not self.is_peer(conn_address[0].split(":")[-1]):
                 # Launch a thread to handle receiving data and sending data over the IPv6 interface
                 self.executor.submit(self.receive_from_ipv6, connexion)
                 
@@ -229,11 +543,361 @@ class Extremity:
                 # If the client's address matches the destination address, it is assumed to be an IPv4 connection
                 # and requires a different treatment (such as conversion to a tunnel).
                 self.executor.submit(self.from_ipv4_to_tun, connexion)
-                
-            self.executor.submit(self.ext_in, client)
             
             
-    def receive_from_ipv6(self, connexion: socket.socket) -> None:
+    def connect_peers(self) -> None:
+        """
+        Starts the session of each stripe with the remote endpoint in a worker thread.
+        """
+        for session in self.sessions:
+            self.executor.submit(session.run)
+
+
+    def is_peer(self, address: str) -> bool:
+        """
+        Tells whether an inbound connection comes from the remote endpoint (encapsulated
+        packets) rather than from a local IPv6 client (raw IPv6 packets).
+
+        Args:
+            address (str): The IPv4 address of the connecting host.
+
+        Returns:
+            bool: True if it is the remote endpoint.
+        """
+        return address == self.dst_address
+
+
+    def peer_endpoints(self) -> Dict[str, "Extremity"]:
+        """
+        Returns the endpoint sending to each peer (this one; a `Hub` has one per peer).
+
+        Returns:
+            Dict[str, Extremity]: IPv4 address of the peer -> its endpoint.
+        """
+        return {self.dst_address: self}
+
+
+    def set_queue_bytes(self, max_bytes: int) -> None:
+        """
+        Changes the byte budget of the tunnel queues (configuration reload): a queue over the
+        new budget drops the next packets as usual.
+
+        Args:
+            max_bytes (int): The byte budget of each queue.
+        """
+        for peer in self.peer_endpoints().values():
+            for packet_queue in peer.stripe_queues:
+                packet_queue.max_bytes = max_bytes
+        self.tun_write_queue.max_bytes = max_bytes
+
+
+    def track_stream(self, connexion: socket.socket, kind: str) -> None:
+        """
+        Records an inbound connection being read, so that a handover can take it over.
+
+        Args:
+            connexion (socket.socket): The connection.
+            kind (str): 'peer' (encapsulated packets) or 'client' (IPv6 packets).
+        """
+        with self.streams_lock:
+            self.streams[connexion] = kind
+
+
+    def untrack_stream(self, connexion: socket.socket) -> None:
+        """
+        Forgets an inbound connection that is no longer read.
+
+        Args:
+            connexion (socket.socket): The connection.
+        """
+        with self.streams_lock:
+            self.streams.pop(connexion, None)
+
+
+    def suspend(self, timeout: float = PAUSE_TIMEOUT) -> Tuple[dict, List[int], List[bytes]]:
+        """
+        Pauses the data path and describes it for a successor process (see `HandoverServer`).
+
+        The writers of the 'tcp' sessions park between two batches (a stop sentinel in their
+        queue), the readers of the inbound connections between two receives (with the bytes
+        of the packet they were receiving) and the accept loop between two connections; the
+        packets still queued for the peers, or pending after a failed send, are taken out as
+        copies (their buffers go back to the pool, whether `resume` follows or not). The
+        datagram transports need no pause: either process reads or sends a datagram whole.
+        A thread that does not park in time (e.g. stuck sending to a stalled peer) keeps its
+        connection, which the successor replaces with a new one.
+
+        Args:
+            timeout (float): Seconds the threads have to park.
+
+        Returns:
+            Tuple[dict, List[int], List[bytes]]: What each descriptor is, the descriptors (the
+                                                 TUN device first) and the queued packets.
+        """
+        self.pause.request()
+        peers = self.peer_endpoints()
+        keys = [self.transport] if self.proto == "tcp" and self.transport is not None else []
+        for peer in peers.values():
+            for stripe, session in enumerate(peer.sessions):
+                connection = session.connection
+                if connection is not None:
+                    keys.append(connection)
+                    (peer.stripe_queues[stripe] if peer.stripe_mode == "flow" else peer.tun_read_queue).put(None)
+        with self.streams_lock:
+            keys.extend(self.streams)
+        parked = self.pause.wait(keys, timeout)
+
+        fds = [self.tun_fd]
+        state = {"proto": self.proto, "tun": 0, "transport": None, "sequences": {}, "sessions": [], "streams": []}
+        if self.transport is not None:
+            state["transport"] = len(fds)
+            fds.append(self.transport.fileno())
+        backlog = []
+        for address, peer in peers.items():
+            state["sequences"][address] = peer.sequence
+            for stripe, session in enumerate(peer.sessions):
+                if session.connection in parked:
+                    state["sessions"].append({"peer": address, "stripe": stripe, "fd": len(fds)})
+                    fds.append(session.connection.fileno())
+            if self.proto != "tcp":
+                # The datagram senders keep sending until the process exits
+                continue
+            for stripe, (batch, _) in enumerate(peer.pending_batches):
+                for _, ipv6_packet in batch:
+                    backlog.append(bytes(ipv6_packet))
+                    self.pool.release(ipv6_packet)
+                peer.pending_batches[stripe] = ([], None)
+            for packet_queue in peer.stripe_queues:
+                try:
+                    while True:
+                        _, ipv6_packet = packet_queue.get_nowait()
+                        if ipv6_packet is not None:
+                            backlog.append(bytes(ipv6_packet))
+                            self.pool.release(ipv6_packet)
+                except Empty:
+                    pass
+        with self.streams_lock:
+            for connexion, kind in self.streams.items():
+                if connexion in parked:
+                    pending, contexts = parked[connexion]
+                    state["streams"].append({"kind": kind, "fd": len(fds), "pending": pending.hex(), "contexts": contexts})
+                    fds.append(connexion.fileno())
+        state["backlog"] = len(backlog)
+        return state, fds, backlog
+
+
+    def resume(self, backlog: List[bytes]) -> None:
+        """
+        Lets the data path go on after a handover that did not happen.
+
+        Args:
+            backlog (List[bytes]): The packets taken out of the queues by `suspend`.
+        """
+        for ipv6_packet in backlog:
+            self.enqueue(ipv6_packet)
+        self.pause.resume()
+
+
+    def adopt(self, state: dict, fds: List[int], backlog: List[bytes]) -> None:
+        """
+        Takes over the data path of a previous process (see `suspend`), before `start`: its
+        transport socket, its connections to the peers (each session starts with its own
+        instead of connecting), the readers of its inbound connections and its queued
+        packets. The TUN device is the `tun_fd` of this endpoint.
+
+        Args:
+            state (dict): What each descriptor is.
+            fds (List[int]): The received descriptors.
+            backlog (List[bytes]): The packets queued for the peers.
+
+        Raises:
+            ValueError: If the previous process used another transport.
+        """
+        if state["proto"] != self.proto:
+            raise ValueError(f"Cannot take over a {state['proto']} endpoint with the {self.proto} transport")
+        if state["transport"] is not None:
+            self.transport = socket.socket(fileno=fds[state["transport"]])
+        peers = self.peer_endpoints()
+        for address, sequence in state["sequences"].items():
+            if address in peers:
+                peers[address].sequence = sequence
+        for entry in state["sessions"]:
+            connection = socket.socket(fileno=fds[entry["fd"]])
+            peer = peers.get(entry["peer"])
+            if peer is None or entry["stripe"] >= len(peer.sessions):
+                # No longer configured: closed with the previous process
+                connection.close()
+                continue
+            peer.sessions[entry["stripe"]].adopt(connection)
+        for entry in state["streams"]:
+            connexion, pending = socket.socket(fileno=fds[entry["fd"]]), bytes.fromhex(entry["pending"])
+            if entry["kind"] == "peer":
+                self.executor.submit(self.from_ipv4_to_tun, connexion, pending, entry.get("contexts", []))
+            else:
+                self.executor.submit(self.receive_from_ipv6, connexion, pending)
+        for ipv6_packet in backlog:
+            self.enqueue(ipv6_packet)
+
+
+    def enqueue(self, ipv6_packet: bytes) -> None:
+        """
+        Queues a packet read from the tunnel for the remote endpoint (answered with a Packet
+        Too Big if it does not fit the tunnel).
+
+        Args:
+            ipv6_packet (bytes): The IPv6 packet.
+        """
+        if self.fits(ipv6_packet, self.path_mtu.mtu):
+            self.stripe_queue(ipv6_packet).put(ipv6_packet)
+        else:
+            self.pool.release(ipv6_packet)
+
+
+    def stripe_queue(self, ipv6_packet: bytes) -> PacketQueue:
+        """
+        Returns the queue a packet read from the tunnel goes to: per flow, that of the stripe
+        of its 5-tuple (the same for every packet of an inner flow).
+
+        Args:
+            ipv6_packet (bytes): The packet.
+
+        Returns:
+            PacketQueue: The queue of its stripe.
+        """
+        if len(self.stripe_queues) == 1:
+            return self.tun_read_queue
+        index = flow_hash(ipv6_packet, VNET_HDR_LEN if self.offload else 0) % len(self.stripe_queues)
+        return self.stripe_queues[index]
+
+
+    def release_packet(self, ipv6_packet: bytes) -> None:
+        """
+        Gives the buffer of a packet read from the tunnel back to `pool` (called by
+        `tun_read_queue` for the packets it drops).
+
+        Args:
+            ipv6_packet (bytes): The packet, pooled or not.
+        """
+        self.pool.release(ipv6_packet)
+
+
+    def encapsulated(self, ipv6_packet: bytes, packet_id: int = None, compressor: HeaderCompressor = None) -> list:
+        """
+        Returns the buffers of an encapsulated packet: the packet and its IPv4 header in one
+        buffer when the header could be written in the headroom of its pooled buffer, else the
+        header and the packet as separate buffers. Either way the packet is not copied.
+        With a compressor, its IPv6 header is compressed if possible (see
+        `Processing.compressed_buffers`).
+
+        Args:
+            ipv6_packet (bytes): The IPv6 packet (or frame in offload mode).
+            packet_id (int): The identification field of the header (the default one if None).
+            compressor (HeaderCompressor): The header compressor of the connection, if any.
+
+        Returns:
+            list: The buffers to send.
+        """
+        if compressor is not None:
+            buffers = self.processing.compressed_buffers(ipv6_packet, compressor, packet_id)
+            if buffers is not None:
+                return buffers
+        frame = self.pool.frame(ipv6_packet) if self.pool.count else None
+        if frame is None:
+            return [self.processing.encapsulation_header(ipv6_packet, packet_id), ipv6_packet]
+        self.processing.header.build_into(frame, 0, len(frame), packet_id, traffic_class(ipv6_packet, self.processing.offset))
+        return [frame]
+
+
+    def fits(self, ipv6_packet: bytes, mtu: int) -> bool:
+        """
+        Tells whether a packet read from the tunnel fits a tunnel of MTU `mtu`; if not, it is
+        dropped and answered with a Packet Too Big. In offload mode, the packets that must fit
+        are the segments of a TCP super-packet (see `offload.wire_size`).
+
+        Args:
+            ipv6_packet (bytes): The packet read from the tunnel.
+            mtu (int): The MTU of the tunnel.
+
+        Returns:
+            bool: True if the packet can be sent.
+        """
+        if not self.offload:
+            size = len(ipv6_packet)
+        elif len(ipv6_packet) > FRAME_MAX:
+            # Only a gso_max_size raised over 64 KB produces them: the tcp carrier cannot frame them
+            self.counters.drops += 1
+            return False
+        else:
+            size = wire_size(ipv6_packet)
+        if size <= mtu:
+            return True
+        self.reject_too_big(ipv6_packet, mtu)
+        return False
+
+
+    def reject_too_big(self, ipv6_packet: bytes, mtu: int) -> None:
+        """
+        Drops a packet too big for the tunnel and writes an ICMPv6 Packet Too Big back into
+        the tunnel for its sender (rate-limited, see `PacketTooBig`).
+
+        Args:
+            ipv6_packet (bytes): The packet that does not fit, as read from the tunnel.
+            mtu (int): The MTU of the tunnel.
+        """
+        self.counters.too_big += 1
+        if self.offload:
+            ipv6_packet = memoryview(ipv6_packet)[VNET_HDR_LEN:]
+        message = self.too_big.build(ipv6_packet, mtu)
+        if message is not None:
+            self.save_to_local_tun(message)
+
+
+    def watch_mtu(self) -> None:
+        """
+        Probes the path MTU to the peer every `PMTU_INTERVAL` seconds (see `refresh_mtu`).
+        """
+        while True:
+            time.sleep(PMTU_INTERVAL)
+            self.refresh_mtu()
+
+
+    def refresh_mtu(self) -> None:
+        """
+        Probes the path MTU to the peer. When the MTU of the tunnel changes, the MTU of the TUN
+        device follows, so that the kernel sizes the local packets (and answers the forwarded
+        ones) itself.
+        """
+        if not self.path_mtu.refresh():
+            return
+        logger.info(f"Path MTU to {self.dst_address} is {self.path_mtu.link_mtu}: tunnel MTU {self.path_mtu.mtu}")
+        try:
+            set_device_mtu(self.tun_fd, self.path_mtu.mtu)
+        except OSError as e:
+            logger.error(f"Failed to set the MTU of the tunnel: {e}")
+
+
+    def watch_reorders(self) -> None:
+        """
+        Gives up the packets missing for too long in the reorder buffers, so that the packets
+        held behind them are delivered even when the traffic stops.
+        """
+        while True:
+            time.sleep(REORDER_TIMEOUT / 2)
+            for reorder in self.reorders.values():
+                reorder.expire()
+
+
+    def deliver_reordered(self, ipv6_packet: bytes) -> None:
+        """
+        Writes a packet put back in order to the local tunnel (see `ReorderBuffer`).
+
+        Args:
+            ipv6_packet (bytes): The packet (preceded by its virtio-net header in offload mode).
+        """
+        self.save_to_local_tun(ipv6_packet, framed=self.offload)
+
+
+    def receive_from_ipv6(self, connexion: socket.socket, pending: bytes = b"") -> None:
         """
         Continuously receives IPv6 packets from an established client connection.
 
@@ -243,82 +907,382 @@ class Extremity:
 
         Args:
             connexion (socket.socket): The active socket connection from which IPv6 packets are received.
+            pending (bytes): The start of a packet received by a previous process (handover).
 
         Behavior:
             - Adds each received packet to the `tun_write_queue` for further processing.
-            - Logs successful packet reception and queuing.
+            - Counts received packets (sampled trace).
             - Closes the connection upon completion or in case of an error.
 
         Raises:
             Logs any exception encountered during packet reception.
         """
         logger.info(f"Receiving data from {connexion.getpeername()[0]}")
+        framer = PacketFramer()
+        framer.feed(pending)
+        self.track_stream(connexion, "client")
         while True:
             try:
-                ipv6_packet = connexion.recv(BUFFER_SIZE)
-                if ipv6_packet:
-                    self.tun_write_queue.put(ipv6_packet)
-                    logger.info("IPv6 packet received and added to the write queue.")
-                else:
+                if not framer.recv_from(connexion):
                     break
+                for ipv6_packet in framer.packets():
+                    # The framer reuses its buffer, the queued packet needs its own copy
+                    self.tun_write_queue.put(bytes(ipv6_packet))
+                    self.counters.peer_received_packets += 1
+                    self.counters.peer_received_bytes += len(ipv6_packet)
+                    if self.tracer.every and self.tracer.sample():
+                        self.trace("peer -> tunnel", ipv6_packet)
+                    capture = self.capture
+                    if capture is not None and capture.points & PEER_RECEIVE:
+                        capture.record(PEER_RECEIVE, ipv6_packet)
+            except BlockingIOError:
+                # Receive timeout: time to check for a handover
+                pass
             except Exception as e:
+                self.counters.errors += 1
                 logger.error(f"Error while receiving data: {e}")
                 break
+            if self.pause.requested:
+                self.pause.park(connexion, (framer.pending(), []))
+        self.untrack_stream(connexion)
         connexion.close()
        
         
-    def save_to_local_tun(self, ipv6_packet: bytes) -> None:
+    def save_to_local_tun(self, ipv6_packet: bytes, framed: bool = False) -> None:
         """
         Writes the IPv6 packet to the local tunnel interface.
 
+        Like `handle_tun_write`, it does not need any lock: each packet is written with one
+        `os.write`, which the TUN driver handles atomically. In offload mode a complete packet
+        is written behind an empty virtio-net header (one `os.writev`, no copy).
+
         Args:
-            ipv6_packet (bytes): The IPv6 packet to be written to the tunnel.
+            ipv6_packet (bytes): The IPv6 packet to be written to the tunnel (a `memoryview`
+                                 of the receive buffer is accepted as well).
+            framed (bool): The packet already starts with its virtio-net header.
         """
         try:
-            os.write(self.tun_fd, ipv6_packet)
-            logger.info("IPv6 packet written to local tunnel.")
+            if self.offload and not framed:
+                os.writev(self.tun_fd, (VNET_NONE, ipv6_packet))
+            else:
+                os.write(self.tun_fd, ipv6_packet)
+            self.counters.tun_written_packets += 1
+            self.counters.tun_written_bytes += len(ipv6_packet)
+            capture = self.capture
+            if capture is not None and capture.points & TUN_WRITE:
+                capture.record(TUN_WRITE, memoryview(ipv6_packet)[VNET_HDR_LEN:] if framed else ipv6_packet)
         except IOError as e:
+            self.counters.errors += 1
             logger.error(f"Failed to write data to local tunnel: {e}")
                    
 
-    def from_ipv4_to_tun(self, client_connexion: socket.socket) -> None:
+    def from_ipv4_to_tun(self, client_connexion: socket.socket, pending: bytes = b"", contexts: list = ()) -> None:
         """
         Receives and processes encapsulated IPv6 packets from IPv4 and saves them to the local tunnel.
 
+        The compressed headers are expanded with the contexts installed on this connection
+        (`HeaderDecompressor`). Between two receives the reader parks if a handover is in
+        progress, with the bytes of the packet it was receiving and these contexts (see `suspend`).
+
         Args:
             client_connexion (socket.socket): The connection from which IPv4 encapsulated packets are received.
+            pending (bytes): The start of a packet received by a previous process (handover).
+            contexts (list): The compression contexts of the previous process (handover).
         """
-        logger.info(f"Receiving IPv4 data from {client_connexion.getpeername()[0]}")
-        
+        peer_address = client_connexion.getpeername()[0].split(":")[-1]
+        logger.info(f"Receiving IPv4 data from {peer_address}")
+        # Per packet, the stripes of the peer meet in its reorder buffer
+        reorder = self.reorders.get(peer_address)
+        if reorder is not None:
+            reorder.attach()
+        framer = PacketFramer()
+        framer.feed(pending)
+        decompressor = HeaderDecompressor(self.counters)
+        decompressor.load(contexts)
+        self.track_stream(client_connexion, "peer")
         while True:
             try:
-                encapsulated_packet = client_connexion.recv(BUFFER_SIZE)  
-                if encapsulated_packet:
-                    logger.info(self.identify_tunnel_packet(encapsulated_packet))
+                # One recv may carry several packets (or only a part of one)
+                if not framer.recv_from(client_connexion):
+                    break
+                for encapsulated_packet in framer.packets():
+                    self.counters.peer_received_packets += 1
+                    self.counters.peer_received_bytes += len(encapsulated_packet)
+                    # Classifying a packet is only worth it when it is traced
+                    if self.tracer.every and self.tracer.sample():
+                        self.trace("peer -> tunnel", encapsulated_packet, encapsulated=True)
                     
-                    decapsulated_packet = self.processing.decapsulate(encapsulated_packet)
+                    decapsulated_packet = self.processing.decapsulate(encapsulated_packet, decompressor)
+                    capture = self.capture
+                    if capture is not None and capture.points & PEER_RECEIVE:
+                        # Filtered on the restored packet: one that cannot be restored is only captured without a filter
+                        capture.record(PEER_RECEIVE, encapsulated_packet, decapsulated_packet)
+                    if decapsulated_packet is None:
+                        continue
                     
                     # self.tun_write_queue.put(decapsulated_packet)
-                    self.save_to_local_tun(decapsulated_packet)
-                    
-                else: 
-                    break
+                    if reorder is not None:
+                        # The sequence number is the identification field of the header
+                        reorder.push((encapsulated_packet[4] << 8) | encapsulated_packet[5], decapsulated_packet)
+                        continue
+                    # In offload mode the remote endpoint sent the virtio-net header along
+                    self.save_to_local_tun(decapsulated_packet, framed=self.offload)
                 
-            except socket.error as e:
-                logger.error(f"Failed to read data from {client_connexion.getpeername()[0]}: {e}")
+            except BlockingIOError:
+                # Receive timeout: time to check for a handover
+                pass
+            except (socket.error, FramingError) as e:
+                self.counters.errors += 1
+                logger.error(f"Failed to read data from {peer_address}: {e}")
                 break
+            if self.pause.requested:
+                self.pause.park(client_connexion, (framer.pending(), decompressor.export()))
+        if reorder is not None:
+            reorder.detach()
+        self.untrack_stream(client_connexion)
         client_connexion.close()
        
         
-    def udp(self, connexion: socket.socket) -> None:  
+    def raw(self) -> None:
+        """
+        Handles the native 6in4 transport: encapsulated packets are sent and received on a raw
+        IPv4 socket of protocol 41, so the header built by `Processing` goes straight onto the
+        wire (`IP_HDRINCL`), without any TCP/UDP carrier in between.
+
+        Sending runs in a worker thread (`raw_out`), receiving in the calling thread (`raw_in`).
         """
-        Handles UDP communication and receives data from the IPv6 client.
+        logger.info("Raw IP (protocol 41) mode.")
+        connexion = self.transport
+        if connexion is None:
+            connexion = socket.socket(socket.AF_INET, socket.SOCK_RAW, RAW_PROTOCOL)
+            connexion.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
+            self.transport = connexion
+        self.executor.submit(self.raw_out, connexion)
+        try:
+            self.raw_in(connexion)
+        finally:
+            connexion.close()
+
+
+    def raw_out(self, connexion: socket.socket) -> None:
+        """
+        Sends the packets read from the tunnel as IPv4 protocol 41 datagrams to the remote endpoint.
+
+        One `sendmsg` per datagram, of the buffers of `encapsulated` (no copy).
 
         Args:
-            connexion (socket.socket): The client connection for UDP communication.
+            connexion (socket.socket): The raw socket (with `IP_HDRINCL`).
         """
-        logger.info("UDP connection mode.")
-        self.receive_from_ipv6(connexion)
+        destination = (self.dst_address, 0)
+        while True:
+            item = self.tun_read_queue.get()
+            ipv6_packet = item[1]
+            try:
+                capture = self.capture
+                if capture is not None and not capture.points & PEER_SEND:
+                    capture = None
+                if self.offload:
+                    for buffers in self.datagrams(ipv6_packet):
+                        connexion.sendmsg(buffers, (), 0, destination)
+                        if capture is not None:
+                            capture.record(PEER_SEND, buffers, buffers[1])
+                else:
+                    buffers = self.encapsulated(ipv6_packet)
+                    connexion.sendmsg(buffers, (), 0, destination)
+                    if capture is not None:
+                        capture.record(PEER_SEND, buffers, ipv6_packet)
+                self.sent((item,))
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:
+                    # Narrower than the MTU of the tunnel: the path changed
+                    self.refresh_mtu()
+                    self.reject_too_big(ipv6_packet, self.path_mtu.mtu)
+                    continue
+                self.counters.errors += 1
+                logger.error(f"Failed to send data to {self.dst_address}: {e}")
+            finally:
+                # Sent or lost, the packet no longer needs its buffer
+                self.pool.release(ipv6_packet)
+
+
+    def raw_in(self, connexion: socket.socket) -> None:
+        """
+        Receives IPv4 protocol 41 datagrams and writes the packets of the tunnel to the local tunnel.
+
+        A raw socket receives every protocol 41 packet reaching the host: datagrams are
+        demultiplexed by their IPv4 source address and only those coming from the remote
+        endpoint of this tunnel are decapsulated, combining the ECN fields (`decapsulate_ecn`).
+
+        Args:
+            connexion (socket.socket): The raw socket.
+        """
+        buffer = bytearray(RAW_BUFFER_SIZE)
+        view = memoryview(buffer)
+        tunnel_source = socket.inet_aton(self.dst_address)
+        while True:
+            try:
+                nbytes = connexion.recv_into(buffer)
+            except OSError as e:
+                logger.error(f"Failed to receive raw data: {e}")
+                break
+            if nbytes < 20 or view[12:16] != tunnel_source:
+                continue
+            self.counters.peer_received_packets += 1
+            self.counters.peer_received_bytes += nbytes
+            if self.tracer.every and self.tracer.sample():
+                self.trace("peer -> tunnel", view[:nbytes], encapsulated=True)
+            header_length = (buffer[0] & 0x0F) * 4
+            capture = self.capture
+            if capture is not None and capture.points & PEER_RECEIVE:
+                capture.record(PEER_RECEIVE, view[:nbytes], view[header_length:nbytes])
+            # Only ECT(1) and CE (low bit set) change the inner packet
+            if buffer[1] & 1 and not decapsulate_ecn(buffer[1], view[header_length:nbytes]):
+                self.counters.drops += 1
+                continue
+            self.save_to_local_tun(view[header_length:nbytes])
+
+
+    def udp(self) -> None:  
+        """
+        Handles the UDP transport: one datagram per encapsulated packet, on a socket bound to the
+        source port and connected to `dst_address:dst_port`.
+
+        Being connected, the socket only receives datagrams from the remote endpoint and sends
+        without a destination lookup. Sending runs in a worker thread (`udp_out`), receiving in
+        the calling thread (`udp_in`). Unlike TCP, a lost datagram never delays the next ones.
+        """
+        logger.info(f"UDP connection mode started on {self.src_port}")
+        # A socket handed over by a previous process is already bound and connected
+        connexion = self.transport
+        if connexion is None:
+            connexion = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                if self.reuse_port:
+                    connexion.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                # DF on every datagram: a narrower path is reported (EMSGSIZE), never fragmented
+                connexion.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+                # The TOS of each datagram received, for the ECN of the decapsulation
+                connexion.setsockopt(socket.IPPROTO_IP, socket.IP_RECVTOS, 1)
+                connexion.bind(("", self.src_port))
+                connexion.connect((self.dst_address, self.dst_port))
+            except OSError as e:
+                logger.error(f"Cannot use UDP port: {self.src_port} - {e}")
+                connexion.close()
+                return
+            self.transport = connexion
+        self.executor.submit(self.udp_out, connexion)
+        try:
+            self.udp_in(connexion)
+        finally:
+            connexion.close()
+
+
+    def udp_out(self, connexion: socket.socket) -> None:
+        """
+        Sends the packets read from the tunnel to the remote endpoint, one datagram per packet.
+
+        One `sendmsg` per datagram, of the buffers of `encapsulated` (no copy), with the TOS of
+        its IPv4 header: the DSCP and ECN of the inner packet reach the carrier header too.
+
+        Args:
+            connexion (socket.socket): The connected UDP socket.
+        """
+        compressor = self.processing.compressor(self.counters)
+        while True:
+            item = self.tun_read_queue.get()
+            ipv6_packet = item[1]
+            try:
+                capture = self.capture
+                if capture is not None and not capture.points & PEER_SEND:
+                    capture = None
+                if self.offload:
+                    ancillary = TOS_ANCILLARY[traffic_class(ipv6_packet, VNET_HDR_LEN)]
+                    for buffers in self.datagrams(ipv6_packet):
+                        connexion.sendmsg(buffers, ancillary)
+                        if capture is not None:
+                            capture.record(PEER_SEND, buffers, buffers[1])
+                else:
+                    buffers = self.encapsulated(ipv6_packet, None, compressor)
+                    connexion.sendmsg(buffers, TOS_ANCILLARY[traffic_class(ipv6_packet)])
+                    if capture is not None:
+                        capture.record(PEER_SEND, buffers, ipv6_packet)
+                self.sent((item,))
+            except ConnectionRefusedError:
+                # ICMP port unreachable from the peer (not started yet): the packet is lost
+                self.counters.errors += 1
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:
+                    # Narrower than the MTU of the tunnel: the path changed
+                    self.refresh_mtu()
+                    self.reject_too_big(ipv6_packet, self.path_mtu.mtu)
+                    continue
+                self.counters.errors += 1
+                logger.error(f"Failed to send data to {self.dst_address}: {e}")
+            finally:
+                self.pool.release(ipv6_packet)
+
+
+    def datagrams(self, frame: bytes) -> list:
+        """
+        Splits a frame read from the tunnel in offload mode into encapsulated datagrams: one per
+        segment of a TCP super-packet, with its checksum completed (see `offload.segment`).
+
+        Args:
+            frame (bytes): virtio-net header followed by the packet.
+
+        Returns:
+            list: The buffers (IPv4 header, then the packet) of each datagram.
+        """
+        segments = segment(frame)
+        if not segments:
+            self.counters.drops += 1
+        build = self.processing.header.build
+        tos = traffic_class(frame, VNET_HDR_LEN)
+        return [[build(20 + sum(len(buffer) for buffer in buffers), None, tos), *buffers] for buffers in segments]
+
+
+    def udp_in(self, connexion: socket.socket) -> None:
+        """
+        Receives encapsulated packets from the remote endpoint and writes them to the local tunnel.
+
+        Each wakeup drains all the queued datagrams (up to `UDP_BATCH`) into preallocated buffers
+        before writing them to the tunnel. The ECN field of the carrier header of each datagram
+        is combined with that of its packet (`decapsulate_ecn`). A compressed header whose full
+        header was lost cannot be expanded: the packets of its flow are dropped until the peer
+        sends it again (see `HeaderCompressor`).
+
+        Args:
+            connexion (socket.socket): The connected UDP socket (with `IP_RECVTOS`).
+        """
+        batch = DatagramBatch(UDP_BATCH, tos=True)
+        tos_values = batch.tos
+        decompressor = HeaderDecompressor(self.counters)
+        while True:
+            try:
+                datagrams = batch.recv_from(connexion)
+            except ConnectionRefusedError:
+                # ICMP port unreachable in answer to a previous datagram
+                continue
+            except OSError as e:
+                logger.error(f"Failed to receive UDP data: {e}")
+                break
+            self.counters.peer_received_packets += len(datagrams)
+            for index, encapsulated_packet in enumerate(datagrams):
+                self.counters.peer_received_bytes += len(encapsulated_packet)
+                if self.tracer.every and self.tracer.sample():
+                    self.trace("peer -> tunnel", encapsulated_packet, encapsulated=True)
+                if len(encapsulated_packet) > 20:
+                    ipv6_packet = self.processing.decapsulate(encapsulated_packet, decompressor)
+                    capture = self.capture
+                    if capture is not None and capture.points & PEER_RECEIVE:
+                        capture.record(PEER_RECEIVE, encapsulated_packet, ipv6_packet)
+                    if ipv6_packet is None:
+                        continue
+                    tos = tos_values[index]
+                    if tos & 1 and not decapsulate_ecn(tos, ipv6_packet):
+                        self.counters.drops += 1
+                        continue
+                    self.save_to_local_tun(ipv6_packet)
      
             
     def join_threads(self) -> None:
@@ -352,7 +1316,7 @@ class Extremity:
 
         This method takes a protocol byte (as an integer) and maps it to a human-readable
         protocol name using a predefined mapping. If the protocol byte is not found in the
-        mapping, it returns a string indicating that the protocol is unknown.
+        mapping (`PROTOCOL_NAMES`), it returns a string indicating that the protocol is unknown.
 
         Args:
             protocol (int): The protocol byte (integer) representing a network protocol 
@@ -366,16 +1330,7 @@ class Extremity:
             _get_protocol_name(0x06) -> "TCP"
             _get_protocol_name(0x99) -> "Unknown protocol (0x99)"
         """
-        protocol_map = {
-            0x01: "ICMP",
-            0x02: "IGMP",
-            0x06: "TCP",
-            0x11: "UDP",
-            0x29: "ENCAP",
-            0x59: "OSPF",
-            0x84: "SCTP",
-        }
-        return protocol_map.get(protocol, f"Unknown protocol (0x{protocol:02x})")
+        return self.PROTOCOL_NAMES.get(protocol, f"Unknown protocol (0x{protocol:02x})")
 
 
     def check_packet_type(self, packet: bytes) -> str:
@@ -410,9 +1365,37 @@ class Extremity:
 
         # Analyse the IPv4 protocol
         outer_protocol = self.check_packet_protocol(packet)
-        if outer_protocol == "ENCAP":
+        if outer_protocol.startswith("ENCAP"):
             inner_type = self.check_packet_type(packet)
             return f"Tunnel IPv4 -> {inner_type}"
         return f"Non-tunnelled {outer_protocol}"
-        
-             
+    
+    
+    def sent(self, batch) -> None:
+        """
+        Accounts for packets of `tun_read_queue` that have just been sent to the peer:
+        counters and time spent between the tunnel read and the send.
+
+        Args:
+            batch (Iterable[Tuple[int, bytes]]): The sent (read time in ns, packet) items.
+        """
+        now = time.perf_counter_ns()
+        counters = self.counters
+        record = self.metrics.latency.record
+        for read_time, ipv6_packet in batch:
+            counters.peer_sent_packets += 1
+            counters.peer_sent_bytes += len(ipv6_packet)
+            record(now - read_time)
+    
+    
+    def trace(self, direction: str, packet: bytes, encapsulated: bool = False) -> None:
+        """
+        Logs a description of a sampled packet (see `PacketTracer`).
+
+        Args:
+            direction (str): Where the packet is going (e.g. "tunnel -> peer").
+            packet (bytes): The packet, encapsulated or not.
+            encapsulated (bool): True if the packet starts with the IPv4 header of the tunnel.
+        """
+        description = self.identify_tunnel_packet(packet) if encapsulated else self.check_packet_type(packet)
+        logger.info(f"[trace] {direction}: {len(packet)} bytes, {description}")
@@ -0,0 +1,252 @@
+import socket
+from typing import Iterator, List
+
+
+RING_SIZE = 256 * 1024  # size of the reusable receive buffer
+IPV4_HEADER_LEN = 20
+IPV6_HEADER_LEN = 40
+IOV_MAX = 1024  # maximum number of buffers accepted by one sendmsg call on Linux
+
+
+class FramingError(ValueError):
+    """
+    Raised when the byte stream can no longer be split into packets
+    (unknown IP version or impossible length field).
+    """
+
+
+class PacketFramer:
+    """
+    Splits a TCP byte stream back into the IP packets that were written into it.
+
+    TCP does not preserve message boundaries: a single `recv` may return half a packet
+    or several merged packets. The framer receives into one preallocated buffer and uses
+    the length fields of the packets themselves to cut the stream:
+        - IPv4 (encapsulated packets): the total length field (bytes 2-3).
+        - IPv6 (raw packets): the payload length field (bytes 4-5) plus the 40-byte header.
+
+    Packets are returned as `memoryview` slices of the internal buffer, so no copy is made.
+    A view is only valid until the next call to `recv_from` (or `get_buffer`), which may
+    move pending bytes to the front of the buffer. Callers that keep a packet longer
+    (e.g. in a queue) must copy it with `bytes(packet)`.
+
+    Attributes:
+        buffer (bytearray): The preallocated receive buffer.
+        view (memoryview): A view over the whole buffer.
+        start (int): Offset of the first byte not yet returned as a packet.
+        end (int): Offset just after the last received byte.
+    """
+
+    def __init__(self, size: int = RING_SIZE) -> None:
+        """
+        Initializes the framer with a preallocated buffer.
+
+        Args:
+            size (int): Size of the receive buffer in bytes. It must hold at least one
+                        maximum-size packet (65535 bytes).
+        """
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def get_buffer(self) -> memoryview:
+        """
+        Returns the free space at the end of the buffer, moving pending bytes of an
+        incomplete packet to the front first when the tail is getting short.
+
+        Returns:
+            memoryview: A writable view where the next received bytes must be stored.
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buffer) - self.end < 65535:
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def commit(self, nbytes: int) -> None:
+        """
+        Marks `nbytes` bytes written into the view returned by `get_buffer` as received.
+
+        Args:
+            nbytes (int): Number of bytes stored in the buffer.
+        """
+        self.end += nbytes
+
+    def recv_from(self, connexion: socket.socket) -> int:
+        """
+        Receives as many bytes as available from a socket in a single system call.
+
+        Args:
+            connexion (socket.socket): The stream socket to read from.
+
+        Returns:
+            int: The number of bytes received (0 when the peer closed the connection).
+        """
+        nbytes = connexion.recv_into(self.get_buffer())
+        self.commit(nbytes)
+        return nbytes
+
+    def packets(self) -> Iterator[memoryview]:
+        """
+        Yields every complete packet currently held in the buffer.
+
+        Yields:
+            memoryview: One complete IP packet (zero-copy slice of the buffer).
+
+        Raises:
+            FramingError: If the stream is desynchronized and cannot be parsed.
+        """
+        buffer = self.buffer
+        while True:
+            available = self.end - self.start
+            if available < 4:
+                return
+            start = self.start
+            version = buffer[start] >> 4
+            if version == 4:
+                length = (buffer[start + 2] << 8) | buffer[start + 3]
+                if length < IPV4_HEADER_LEN:
+                    raise FramingError(f"Invalid IPv4 total length: {length}")
+            elif version == 6:
+                if available < 6:
+                    return
+                length = IPV6_HEADER_LEN + ((buffer[start + 4] << 8) | buffer[start + 5])
+            else:
+                raise FramingError(f"Unknown IP version in stream: {version}")
+            if available < length:
+                return
+            self.start = start + length
+            yield self.view[start:self.start]
+
+    def pending(self) -> bytes:
+        """
+        Returns the received bytes of the packet not complete yet (e.g. to hand the stream
+        over to another process).
+
+        Returns:
+            bytes: A copy of the bytes after the last packet returned.
+        """
+        return bytes(self.view[self.start:self.end])
+
+    def feed(self, data: bytes) -> None:
+        """
+        Stores bytes received by a previous reader of the stream (see `pending`), before
+        receiving from the socket.
+
+        Args:
+            data (bytes): The bytes.
+        """
+        buffer = self.get_buffer()
+        buffer[:len(data)] = data
+        self.commit(len(data))
+
+
+
+def send_buffers(connexion: socket.socket, buffers: List[bytes]) -> None:
+    """
+    Sends a list of buffers on a stream socket with as few `sendmsg` calls as possible
+    (scatter-gather I/O: the buffers are never concatenated).
+
+    Like `sendall`, it keeps sending until every byte is written, handling partial sends.
+
+    Args:
+        connexion (socket.socket): The stream socket to write to.
+        buffers (List[bytes]): The buffers to send, in order.
+    """
+    buffers = list(buffers)
+    index = 0
+    while index < len(buffers):
+        sent = connexion.sendmsg(buffers[index:index + IOV_MAX])
+        # Skip what was fully sent, then keep the unsent tail of a partially sent buffer
+        while index < len(buffers) and len(buffers[index]) <= sent:
+            sent -= len(buffers[index])
+            index += 1
+        if sent:
+            buffers[index] = memoryview(buffers[index])[sent:]
+
+
+class DatagramBatch:
+    """
+    Receives many datagrams per wakeup into preallocated buffers (a `recvmmsg`-like loop).
+
+    The first datagram is awaited with a blocking `recv_into`; the following ones are taken
+    with non-blocking `recv_into` calls until the socket queue is empty or the batch is full.
+    Each datagram lands in its own preallocated slot: nothing is allocated per packet.
+
+    Returned views are only valid until the next call to `recv_from`.
+
+    With `tos`, the datagrams are received with `recvmsg_into` and the TOS of the IPv4 header
+    of each one is kept in `tos` (the socket must have `IP_RECVTOS` set).
+
+    Attributes:
+        slots (list): The preallocated receive buffers.
+        views (list): A `memoryview` over each buffer.
+        tos (Optional[list]): The TOS of each datagram of the last batch (0 when unknown).
+    """
+
+    def __init__(self, batch: int = 64, size: int = 65535, tos: bool = False) -> None:
+        """
+        Initializes the receive slots.
+
+        Args:
+            batch (int): Maximum number of datagrams returned per call.
+            size (int): Size of each slot (largest datagram accepted).
+            tos (bool): Keep the TOS of each datagram.
+        """
+        self.slots = [bytearray(size) for _ in range(batch)]
+        self.views = [memoryview(slot) for slot in self.slots]
+        self.tos = [0] * batch if tos else None
+        self.iovecs = [[view] for view in self.views]
+        self.ancillary_size = socket.CMSG_SPACE(4)
+
+    def recv_from(self, connexion: socket.socket) -> List[memoryview]:
+        """
+        Waits for at least one datagram and returns every datagram queued on the socket
+        (up to the batch size).
+
+        Args:
+            connexion (socket.socket): The datagram socket to read from (blocking mode).
+
+        Returns:
+            List[memoryview]: One view per received datagram.
+        """
+        if self.tos is not None:
+            return self._recvmsg_from(connexion)
+        views = self.views
+        datagrams = [views[0][:connexion.recv_into(views[0])]]
+        for view in views[1:]:
+            try:
+                nbytes = connexion.recv_into(view, 0, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            datagrams.append(view[:nbytes])
+        return datagrams
+
+    def _recvmsg_from(self, connexion: socket.socket) -> List[memoryview]:
+        """
+        Same as `recv_from`, keeping the TOS of each datagram from its ancillary data.
+
+        Args:
+            connexion (socket.socket): The datagram socket to read from (blocking mode).
+
+        Returns:
+            List[memoryview]: One view per received datagram.
+        """
+        datagrams = []
+        flags = 0
+        for index, iovec in enumerate(self.iovecs):
+            try:
+                nbytes, ancillary, _, _ = connexion.recvmsg_into(iovec, self.ancillary_size, flags)
+            except BlockingIOError:
+                break
+            tos = 0
+            for level, kind, data in ancillary:
+                if level == socket.IPPROTO_IP and kind == socket.IP_TOS:
+                    tos = data[0]
+            self.tos[index] = tos
+            datagrams.append(iovec[0][:nbytes])
+            flags = socket.MSG_DONTWAIT
+        return datagrams
@@ -0,0 +1,263 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from typing import Dict
+
+from buffers import POOL_BUFFERS
+from capture import PacketCapture
+from extremity import Extremity
+from offload import VNET_HDR_LEN
+from packet_queue import QUEUE_BYTES
+from routes import RouteTable
+from striping import ReorderBuffer
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class Hub(Extremity):
+    """
+    An endpoint serving many IPv6 islands, each behind its own IPv4 peer.
+
+    Each packet read from the tunnel is routed with the longest-prefix match of its
+    destination in a `RouteTable`, then queued for its peer. Every peer is an `Extremity`
+    of its own (queue, encapsulation header, `PeerSession`), so there is exactly one outbound
+    connection per peer (one per stripe with `stripes`) and a slow or absent peer only fills
+    its own queue. The tunnel,
+    the listening socket and the inbound connections of every peer are shared.
+
+    Only the 'tcp' transport is supported. The route table can be replaced while the hub
+    runs (`set_routes`).
+
+    Attributes:
+        routes (RouteTable): IPv6 prefix -> IPv4 peer.
+        peers (Dict[str, Extremity]): IPv4 address of each peer -> its endpoint.
+        peer_args (dict): The keyword arguments of the endpoint of a peer.
+    """
+
+    def __init__(self, tun_address: str, tun_fd: int, src_address: str, routes: RouteTable, src_port: int, dst_port: int, proto: str = "tcp", reuse_port: bool = False, trace_every: int = 0, queue_bytes: int = QUEUE_BYTES, drop_policy: str = "tail", mtu: int = None, offload: bool = False, pool_buffers: int = POOL_BUFFERS, stripes: int = 1, stripe_mode: str = "flow", scheduler: str = "fifo", priority: bool = False, compression: int = 0, capture: PacketCapture = None) -> None:
+        """
+        Initializes the hub and one endpoint per peer of the route table.
+
+        Args:
+            tun_address (str): Tunnel interface address (IPv6).
+            tun_fd (int): File descriptor for the tunnel interface.
+            src_address (str): Source address (IPv4).
+            routes (RouteTable): The routes to the peers.
+            src_port (int): Source port for local system communication.
+            dst_port (int): Port of the peers.
+            proto (str): Protocol to be used (only 'tcp').
+            reuse_port (bool): Listen with `SO_REUSEPORT` (one worker process per TUN queue).
+            trace_every (int): Log a trace of 1 packet out of `trace_every` (0: no packet trace).
+            queue_bytes (int): Byte budget of the queue of each peer.
+            drop_policy (str): What to drop when a queue is full ('tail', 'head' or 'codel').
+            mtu (int): Fixed MTU of the tunnel (None: follow the path MTU to each peer).
+            offload (bool): The TUN device hands over TCP super-packets (every peer must use offload).
+            pool_buffers (int): Number of preallocated buffers of the packets read from the tunnel.
+            stripes (int): Number of connections to each peer.
+            stripe_mode (str): How packets are spread over them ('flow' or 'packet', see `Extremity`).
+            scheduler (str): Order of the packets in the queue of each peer ('fifo', 'drr' or 'fq_codel').
+            priority (bool): Serve the queue of each peer by strict priority of the DSCP classes.
+            compression (int): Flow contexts of the header compressor of each connection to a peer (0: off).
+            capture (PacketCapture): Where the packets of the capture points go, shared with the peers (None: no capture).
+
+        Raises:
+            ValueError: If the protocol is not 'tcp' or the table has no route.
+        """
+        if proto.lower() != "tcp":
+            raise ValueError(f"The hub mode does not support the protocol: {proto}")
+        if not len(routes):
+            raise ValueError("The hub mode needs at least one route")
+        # The hub itself never sends: its own destination is a placeholder
+        super().__init__(tun_address, tun_fd, src_address, "0.0.0.0", src_port, dst_port, proto, reuse_port, trace_every, queue_bytes, drop_policy, mtu, offload, pool_buffers, stripes, stripe_mode, scheduler, priority, compression, capture)
+        self.routes = routes
+        self.peer_args = dict(tun_address=tun_address, tun_fd=tun_fd, src_address=src_address, src_port=src_port,
+                              dst_port=dst_port, proto=proto, queue_bytes=queue_bytes, drop_policy=drop_policy, mtu=mtu,
+                              offload=offload, pool_buffers=0, stripes=stripes, stripe_mode=stripe_mode,
+                              scheduler=scheduler, priority=priority, compression=compression, capture=capture)
+        self.peers = {peer: self.new_peer(peer) for peer in routes.peers()}
+        # Reader, writer and the inbound connections of every stripe of every peer (the executor
+        # of `Extremity` has no thread yet: it is sized for a single peer)
+        self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.peers) * stripes + 10)
+        if self.reorders:
+            # Each peer numbers its packets: one reorder buffer per peer
+            self.reorders = {peer: ReorderBuffer(self.deliver_reordered) for peer in self.peers}
+
+        # Sending is accounted by the peers: the hub exports their sums (over the current peers)
+        for name in ("peer_sent_packets", "peer_sent_bytes", "compressed_packets", "full_headers"):
+            self.metrics.counter(name, lambda name=name: sum(getattr(peer.counters, name) for peer in list(self.peers.values())))
+        # The send failures and the drops of the peer queues add to those of the hub
+        for name in ("errors", "drops"):
+            self.metrics.counter(name, lambda name=name: getattr(self.counters, name) + sum(getattr(peer.counters, name) for peer in list(self.peers.values())))
+        self.metrics.counter("peer_queue_dropped_packets", lambda: sum(packet_queue.dropped_packets for packet_queue in self.peer_queues()))
+        self.metrics.counter("peer_connects", lambda: sum(session.connects for session in self.peer_sessions()))
+        self.metrics.gauge("peer_connected", lambda: sum(session.connection is not None for session in self.peer_sessions()))
+        self.metrics.gauge("peer_queue_bytes", lambda: sum(packet_queue.bytes for packet_queue in self.peer_queues()))
+        if scheduler != "fifo":
+            self.metrics.gauge("scheduler_flows", lambda: sum(len(packet_queue.flows) for packet_queue in self.peer_queues()))
+            self.metrics.counter("scheduler_evicted_flows", lambda: sum(packet_queue.evicted_flows for packet_queue in self.peer_queues()))
+        self.metrics.gauge("routes", lambda: len(self.routes))
+        self.metrics.gauge("path_mtu", lambda: min((peer.path_mtu.mtu for peer in list(self.peers.values())), default=0))
+
+    def new_peer(self, address: str) -> Extremity:
+        """
+        Creates the endpoint of a peer.
+
+        Args:
+            address (str): The IPv4 address of the peer.
+
+        Returns:
+            Extremity: Its endpoint, sharing the buffers, the handover pause and the send
+                       latency histogram of the hub.
+        """
+        peer = Extremity(dst_address=address, **self.peer_args)
+        # The packets are read into the buffers of the hub: the peers give them back there
+        peer.pool = self.pool
+        peer.pause = self.pause
+        # The peers send: their latency is that exported by the hub
+        peer.metrics.latency = self.metrics.latency
+        return peer
+
+    def peer_queues(self) -> list:
+        """
+        Returns the queues of every stripe of every peer.
+
+        Returns:
+            list: The queues.
+        """
+        return [packet_queue for peer in list(self.peers.values()) for packet_queue in peer.stripe_queues]
+
+    def peer_sessions(self) -> list:
+        """
+        Returns the sessions of every stripe of every peer.
+
+        Returns:
+            list: The sessions.
+        """
+        return [session for peer in list(self.peers.values()) for session in peer.sessions]
+
+    def peer_endpoints(self) -> Dict[str, Extremity]:
+        """
+        Returns the endpoint sending to each peer.
+
+        Returns:
+            Dict[str, Extremity]: IPv4 address of the peer -> its endpoint.
+        """
+        return dict(self.peers)
+
+    def set_queue_bytes(self, max_bytes: int) -> None:
+        """
+        Changes the byte budget of the queues of every peer, present and future.
+
+        Args:
+            max_bytes (int): The byte budget of each queue.
+        """
+        self.peer_args["queue_bytes"] = max_bytes
+        super().set_queue_bytes(max_bytes)
+
+    def set_routes(self, routes: RouteTable) -> None:
+        """
+        Replaces the route table (configuration reload): the new peers get an endpoint and
+        their sessions are started, the sessions of the peers no longer routed are stopped
+        (the packets still queued for them are dropped, see `release_peer`).
+
+        Args:
+            routes (RouteTable): The new routes.
+
+        Raises:
+            ValueError: If the table has no route.
+        """
+        if not len(routes):
+            raise ValueError("The hub mode needs at least one route")
+        peers = {address: self.peers.get(address) or self.new_peer(address) for address in routes.peers()}
+        removed = [peer for address, peer in self.peers.items() if address not in peers]
+        added = [peer for address, peer in peers.items() if address not in self.peers]
+        if self.reorders:
+            self.reorders = {address: self.reorders.get(address) or ReorderBuffer(self.deliver_reordered) for address in peers}
+        # The reader looks the routes up, then the peers: a packet routed to a removed peer is dropped
+        self.peers = peers
+        self.routes = routes
+        for peer in added:
+            for session in peer.sessions:
+                peer.executor.submit(session.run)
+        for peer in removed:
+            for session in peer.sessions:
+                session.stop()
+            # The writers waiting for a packet take the sentinel and end
+            for packet_queue in peer.stripe_queues:
+                for _ in peer.sessions:
+                    packet_queue.put(None)
+            self.executor.submit(self.release_peer, peer)
+        logger.info(f"Routes replaced: {len(routes)} routes to {len(peers)} peers ({len(added)} added, {len(removed)} removed)")
+
+    def release_peer(self, peer: Extremity) -> None:
+        """
+        Waits for the threads of a removed peer to end, then gives the buffers of the packets
+        still queued for it, or pending after a failed send, back to the pool of the hub.
+
+        Args:
+            peer (Extremity): The endpoint of the removed peer.
+        """
+        peer.executor.shutdown(wait=True)
+        for stripe, (batch, _) in enumerate(peer.pending_batches):
+            for _, ipv6_packet in batch:
+                self.pool.release(ipv6_packet)
+            peer.pending_batches[stripe] = ([], None)
+        for packet_queue in peer.stripe_queues:
+            try:
+                while True:
+                    _, ipv6_packet = packet_queue.get_nowait()
+                    self.pool.release(ipv6_packet)
+            except Empty:
+                pass
+
+    def enqueue(self, ipv6_packet: bytes) -> None:
+        """
+        Queues a packet read from the tunnel for the peer serving its destination
+        (dropped if no route matches, answered with a Packet Too Big if it does not fit
+        the path to that peer).
+
+        Args:
+            ipv6_packet (bytes): The IPv6 packet.
+        """
+        peer = self.peers.get(self.routes.lookup_packet(ipv6_packet, VNET_HDR_LEN if self.offload else 0))
+        if peer is None:
+            self.counters.drops += 1
+            self.pool.release(ipv6_packet)
+            return
+        if self.fits(ipv6_packet, peer.path_mtu.mtu):
+            peer.stripe_queue(ipv6_packet).put(ipv6_packet)
+        else:
+            self.pool.release(ipv6_packet)
+
+    def connect_peers(self) -> None:
+        """
+        Starts the sessions with every peer, each in a worker thread of its own endpoint.
+        """
+        for peer in self.peers.values():
+            for session in peer.sessions:
+                peer.executor.submit(session.run)
+        logger.info(f"Hub mode: {len(self.routes)} routes to {len(self.peers)} peers")
+
+    def refresh_mtu(self) -> None:
+        """
+        Probes the path MTU to every peer. The MTU of the TUN device is left as configured:
+        it cannot follow several paths, the Packet Too Big messages of `enqueue` do.
+        """
+        for address, peer in self.peers.items():
+            if peer.path_mtu.refresh():
+                logger.info(f"Path MTU to {address} is {peer.path_mtu.link_mtu}: tunnel MTU {peer.path_mtu.mtu}")
+
+    def is_peer(self, address: str) -> bool:
+        """
+        Tells whether an inbound connection comes from one of the peers.
+
+        Args:
+            address (str): The IPv4 address of the connecting host.
+
+        Returns:
+            bool: True if it is a peer of the route table.
+        """
+        return address in self.peers
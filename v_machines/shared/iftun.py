@@ -1,16 +1,22 @@
 import os
+import socket
 import subprocess
+import ipaddress
 from fcntl import ioctl
 import struct
-from typing import Union
+from typing import Callable, Optional, Union, Tuple, List
 import logging
+from netlink import Netlink
+from offload import TUN_F_CSUM, TUN_F_TSO6
 
 
 # Logs configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-BUFFER_SIZE = 4096  
+BUFFER_SIZE = 65535  # largest packet of the TUN device (a shorter read truncates it)
+# The "ip" fallback is already privileged when run as root (tunnel64d.sh runs sudo python3)
+SUDO = [] if os.geteuid() == 0 else ["sudo"]
 
 class Interface:
     """
@@ -20,22 +26,32 @@ class Interface:
     Attributes:
         tun_dev (str): The name of the virtual TUN device.
         fd (int or None): The file descriptor for the TUN device, used for read/write operations.
+        offload (bool): Whether the device hands over checksum-less packets and TCP super-packets,
+                        each preceded by a virtio-net header (`IFF_VNET_HDR`).
+        mode (int): The flags of the device.
     """
     
     TUNSETIFF = 0x400454ca # ioctl command to set interface flags
     IFF_TUN = 0x0001 # Flag indicating it's a TUN device
     IFF_NO_PI = 0x1000 # Ignore packet data added by the Linux kernel.
     TUNMODE = IFF_TUN | IFF_NO_PI # Device type: TUN device (not TAP)
+    IFF_MULTI_QUEUE = 0x0100 # One fd per queue, the kernel spreads the flows over the queues
+    IFF_VNET_HDR = 0x4000 # Each packet is preceded by a virtio-net header (offloads)
+    TUNSETOFFLOAD = 0x400454d0 # ioctl command to set the offloads the device accepts
     
-    def __init__(self, tun_dev: str) -> None:
+    def __init__(self, tun_dev: str, offload: bool = False) -> None:
         """
         Initializes the Interface class with the provided TUN device name.
 
         Args:
             tun_dev (str): The name of the virtual TUN device to create (e.g., "tun0").
+            offload (bool): Let the kernel hand over TCP super-packets of up to 64 KB and
+                            packets without their checksum (see `set_offload`).
         """
         self.tun_dev = tun_dev
         self.fd = None
+        self.offload = offload
+        self.mode = self.TUNMODE | (self.IFF_VNET_HDR if offload else 0)
 
 
     def tun_alloc(self) -> Union[int,bytes]:
@@ -67,8 +83,10 @@ class Interface:
         try:
             if self.fd is not None:
                 # Send the ioctl command to set up the device with the desired name and flags
-                ifs = ioctl(self.fd, self.TUNSETIFF, struct.pack("16sH", self.tun_dev.encode('utf-8'), self.TUNMODE))
+                ifs = ioctl(self.fd, self.TUNSETIFF, struct.pack("16sH", self.tun_dev.encode('utf-8'), self.mode))
                 # ifs = ioctl(self.fd, self.TUNSETIFF, struct.pack('16sH', self.tun_dev.encode('ascii'), self.TUNMODE))
+                if self.offload:
+                    self.set_offload(self.fd)
         except OSError as err:
             logger.error(f"Failed to configure TUN device: {os.strerror(err.errno)}")
             exit(-1)
@@ -78,6 +96,62 @@ class Interface:
         
         # Return the file descriptor and the device name
         return self.fd, ifname
+
+
+    def tun_alloc_queues(self, queues: int) -> Tuple[List[int], str]:
+        """
+        Allocates a multi-queue TUN device (`IFF_MULTI_QUEUE`) and returns one file descriptor per queue.
+
+        Each call of `TUNSETIFF` with the same device name on a new `/dev/net/tun` fd attaches one
+        more queue to the device. The kernel then spreads the flows over the queues, so that each
+        fd can be served by its own process (and core).
+
+        Args:
+            queues (int): The number of queues (file descriptors) to allocate.
+
+        Returns:
+            Tuple[List[int], str]: The file descriptors of the queues and the name of the device.
+
+        Raises:
+            IOError: If there is an issue opening the `/dev/net/tun` device.
+            OSError: If there is an issue configuring the TUN device using `ioctl`.
+        """
+        fds = []
+        ifname = self.tun_dev
+        for _ in range(queues):
+            try:
+                fd = os.open("/dev/net/tun", os.O_RDWR)
+            except IOError as err:
+                logger.error(f"Failed to allocate TUN: {os.strerror(err.errno)}")
+                exit(-1)
+            try:
+                ifs = ioctl(fd, self.TUNSETIFF, struct.pack("16sH", ifname.encode('utf-8'), self.mode | self.IFF_MULTI_QUEUE))
+                if self.offload:
+                    self.set_offload(fd)
+            except OSError as err:
+                logger.error(f"Failed to configure TUN queue: {os.strerror(err.errno)}")
+                exit(-1)
+            # The following queues must attach to the name the kernel gave to the first one
+            ifname = ifs[:16].strip(b'\x00').decode('utf-8')
+            fds.append(fd)
+        self.fd = fds[0]
+        return fds, ifname
+
+
+    def set_offload(self, fd: int) -> None:
+        """
+        Enables the offloads of the device (`TUNSETOFFLOAD`): checksum and TCP segmentation of
+        IPv6 packets. The kernel then skips the TCP checksum and hands over TCP super-packets
+        (up to 64 KB, one read instead of ~45), described by the virtio-net header of each
+        packet; the endpoint finishes them only when the transport needs it (see `offload`).
+
+        Args:
+            fd (int): A file descriptor of the device.
+
+        Raises:
+            OSError: If the kernel refuses the offloads.
+        """
+        ioctl(fd, self.TUNSETOFFLOAD, TUN_F_CSUM | TUN_F_TSO6)
     
 
 class Iftun:
@@ -88,15 +162,50 @@ class Iftun:
     Attributes:
         tun_dev (str or None): The name of the TUN device (e.g., 'tun0').
         tunfd (int or None): The file descriptor for the TUN device used for reading and writing.
+        tunfds (list): The file descriptors of every queue of the device (only `tunfd` when single-queue).
+        netlink (Optional[Netlink]): The rtnetlink backend, None when the `ip` commands are used.
     """
     
-    def __init__(self) -> 'Iftun':
+    def __init__(self, backend: str = "netlink") -> 'Iftun':
         """
         Initializes the Iftun object with no device name or file descriptor.
+
+        Args:
+            backend (str): How the device and the routes are configured: "netlink" (messages on an
+                           rtnetlink socket, no process started) or "ip" (one `ip` command per
+                           operation). The `ip` commands remain the fallback of every netlink operation.
         """
         self.tun_dev = None
         self.tunfd = None
+        self.tunfds = []
         self.ifname = None
+        self.netlink = None
+        if backend == "netlink":
+            try:
+                self.netlink = Netlink()
+            except OSError as e:
+                logger.warning(f"Netlink unavailable ({e}), using the ip commands.")
+
+
+    def with_netlink(self, operation: Callable[[Netlink], None], description: str) -> bool:
+        """
+        Runs a configuration step with the netlink backend, if it is enabled.
+
+        Args:
+            operation (Callable[[Netlink], None]): The step, given the netlink client.
+            description (str): What the step does (for the logs).
+
+        Returns:
+            bool: True if the step was done, False if the `ip` command must be used instead.
+        """
+        if self.netlink is None:
+            return False
+        try:
+            operation(self.netlink)
+            return True
+        except OSError as e:
+            logger.warning(f"Netlink failed to {description} ({e}), falling back to ip.")
+            return False
                   
             
     def up(self) -> None :
@@ -110,8 +219,11 @@ class Iftun:
         if not self.tun_dev:
             logger.error("TUN device not specified.")
             return
+        if self.with_netlink(lambda netlink: netlink.set_link(self.tun_dev, up=True), "bring the device up"):
+            logger.info(f"TUN device '{self.tun_dev}' is now up.")
+            return
         try:
-            subprocess.run(["sudo", "ip", "link", "set", self.tun_dev, "up"], check=True)
+            subprocess.run([*SUDO, "ip", "link", "set", self.tun_dev, "up"], check=True)
             logger.info(f"TUN device '{self.tun_dev}' is now up.")
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to bring TUN device up: {e}")
@@ -161,8 +273,11 @@ class Iftun:
         if not self.tun_dev:
             logger.error("TUN device not specified.")
             return
+        if self.with_netlink(lambda netlink: netlink.set_link(self.tun_dev, up=False), "bring the device down"):
+            logger.info(f"TUN device '{self.tun_dev}' is now down.")
+            return
         try:
-            subprocess.run(["sudo", "ip", "link", "set", self.tun_dev, "down"], check=True)
+            subprocess.run([*SUDO, "ip", "link", "set", self.tun_dev, "down"], check=True)
             logger.info(f"TUN device '{self.tun_dev}' is now down.")
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to bring TUN device down: {e}")
@@ -181,25 +296,51 @@ class Iftun:
         if not self.tun_dev:
             logger.error("TUN device not specified.")
             return
+        if self.with_netlink(lambda netlink: netlink.set_link(self.tun_dev, mtu=mtu), "set the MTU"):
+            logger.info(f"MTU set to {mtu} for device '{self.tun_dev}'.")
+            return
         try:
-            subprocess.run(["sudo", "ip", "link", "set", self.tun_dev, "mtu", str(mtu)], check=True)
+            subprocess.run([*SUDO, "ip", "link", "set", self.tun_dev, "mtu", str(mtu)], check=True)
             logger.info(f"MTU set to {mtu} for device '{self.tun_dev}'.")
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to set MTU: {e}")
     
             
-    def create_vnet_device(self, tun_dev: str) -> None:#Union[int, bytes]:
+    def create_vnet_device(self, tun_dev: str, queues: int = 1, offload: bool = False) -> None:#Union[int, bytes]:
         """
         Creates a virtual network device (TUN device) with the given name.
 
         This method allocates a TUN device by calling the `tun_alloc` method from the `Interface` class. 
-        The device is named according to the `tun_dev` parameter.
+        The device is named according to the `tun_dev` parameter. With more than one queue, the
+        device is allocated with `tun_alloc_queues` and `tunfds` holds the fd of each queue.
         
         Args:
             tun_dev (str): The name of the TUN device to create (e.g., 'tun0').
+            queues (int): The number of queues of the device (1 for a single-queue device).
+            offload (bool): Open the device with `IFF_VNET_HDR` and the TCP offloads.
+        """
+        self.tun_dev = tun_dev
+        if queues > 1:
+            self.tunfds, self.ifname = Interface(self.tun_dev, offload).tun_alloc_queues(queues)
+            self.tunfd = self.tunfds[0]
+        else:
+            self.tunfd, self.ifname = Interface(self.tun_dev, offload).tun_alloc()
+            self.tunfds = [self.tunfd]
+
+
+    def attach_device(self, tun_dev: str, tun_fd: int) -> None:
+        """
+        Uses a TUN device opened and configured by another process (handed over with its
+        descriptor): nothing is created or configured, the firewall rules can still be removed.
+
+        Args:
+            tun_dev (str): The name of the TUN device.
+            tun_fd (int): Its file descriptor in this process.
         """
         self.tun_dev = tun_dev
-        self.tunfd, self.ifname = Interface(self.tun_dev).tun_alloc()
+        self.ifname = tun_dev
+        self.tunfd = tun_fd
+        self.tunfds = [tun_fd]
 
 
     def set_address(self, tun_address:str, ipv4_dst: str, ipv4_gw: str, ipv6_gw: str, ipv6_dst: str) -> None:
@@ -208,6 +349,7 @@ class Iftun:
 
         This method adds the provided address to the TUN device, brings the device up, and configures 
         IPv6 and IPv4 routes to the specified destination addresses and gateways.
+        Existing routes are detected on the parsed route table (see `route_exists`).
         
         Args:
             tun_address (str): The address to assign to the TUN device (e.g., '10.0.0.1/24').
@@ -220,98 +362,269 @@ class Iftun:
             logger.error("TUN device not specified.")
             return
         try:
-            subprocess.run(["sudo", "ip", "address", "add", tun_address, "dev", self.tun_dev], check=True)
+            if not self.with_netlink(lambda netlink: netlink.add_address(self.tun_dev, tun_address), "add the address"):
+                subprocess.run([*SUDO, "ip", "address", "add", tun_address, "dev", self.tun_dev], check=True)
             self.up()
 
-            if not self.check_exist_cmd(["ip", "-6", "route", "show"], ipv6_gw) or not self.check_exist_cmd(["ip", "-6", "route", "show"], ipv6_dst):
-                subprocess.run(["sudo", "ip", "-6", "route", "add", ipv6_dst, "via", ipv6_gw], check=True)
+            if not self.route_exists(ipv6_dst, ipv6_gw):
+                self.add_route(ipv6_dst, gateway=ipv6_gw)
 
-            if not self.check_exist_cmd(["ip", "route", "show"], ipv4_gw) or not self.check_exist_cmd(["ip", "route", "show"], ipv4_dst):
-                subprocess.run(["sudo", "ip", "route", "add", ipv4_dst, "via", ipv4_gw, "dev", "eth1"], check=True)
+            if not self.route_exists(ipv4_dst, ipv4_gw):
+                self.add_route(ipv4_dst, gateway=ipv4_gw, device="eth1")
 
             # subprocess.run(["sudo", "ip", "-6", "neigh", "flush", "state", "STALE"], check=True)
-            subprocess.run(["sudo", "ip", "-6", "neigh", "flush", "all"], check=True)
+            if not self.with_netlink(lambda netlink: netlink.flush_neighbours(socket.AF_INET6), "flush the neighbours"):
+                subprocess.run([*SUDO, "ip", "-6", "neigh", "flush", "all"], check=True)
 
             logger.info("Address and routes configured successfully.")
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to set address: {e}")
             exit(-1)
             
-        subprocess.run(["ip", "address"])
-        subprocess.run(["ip", "-6", "r"])
+        if self.netlink is None:
+            subprocess.run(["ip", "address"])
+            subprocess.run(["ip", "-6", "r"])
 
 
-    def set_iptables(self, ipv4_src_addr: str, src_port:int,  ipv4_dst_addr: str, dst_port, ipv6_gateway: str) -> None:        
+    def route_exists(self, destination: str, gateway: str) -> bool:
         """
-        Configures IPv6 ICMP rules for Neighbor Discovery Protocol (NDP) by adding specific ip6tables rules.
+        Checks whether the main routing table already has a route to a destination.
 
-        This method adds rules to the system's IPv6 firewall (using `ip6tables`) to accept important ICMPv6 message types that 
-        are required for NDP functionality. These messages are used for operations like neighbour discovery, router 
-        advertisement, and other essential IPv6 operations.
+        With netlink, the destinations of the dumped routes are compared as prefixes; with the
+        `ip` commands, the output of `ip route show` is searched for both the destination and
+        the gateway (see `check_exist_cmd`).
 
-        The following ICMPv6 message types are allowed:
-        - Type 135: Neighbor Solicitation
-        - Type 136: Neighbor Advertisement
-        - Type 133: Router Solicitation
-        - Type 134: Router Advertisement
-        - Type 137: Redirect
-        - Type 128: Echo Request (ping)
-        - Type 129: Echo Reply (ping)
+        Args:
+            destination (str): The destination prefix or address.
+            gateway (str): The gateway of the route to add.
 
-        The method attempts to add the appropriate ip6tables rules for each of these ICMPv6 types. If successful, a log message
-        is recorded indicating that the rules have been successfully configured. If an error occurs during the process, 
-        an error log is generated with details about the failure.
+        Returns:
+            bool: True if a route to the destination exists.
+        """
+        family = socket.AF_INET6 if ":" in destination else socket.AF_INET
+        network = ipaddress.ip_network(destination, strict=False)
+        found = []
+        if self.with_netlink(lambda netlink: found.extend(route for route in netlink.routes(family) if route.destination == network),
+                             "dump the routes"):
+            if found:
+                logger.info(f"The route to '{destination}' already exists.")
+            return bool(found)
+        command = ["ip", "-6", "route", "show"] if family == socket.AF_INET6 else ["ip", "route", "show"]
+        return self.check_exist_cmd(command, gateway) and self.check_exist_cmd(command, destination)
+
+
+    def add_route(self, destination: str, gateway: Optional[str] = None, device: Optional[str] = None) -> None:
+        """
+        Adds a route to the main routing table.
+
+        Args:
+            destination (str): The destination prefix or address.
+            gateway (Optional[str]): The next hop.
+            device (Optional[str]): The output interface.
 
         Raises:
-            subprocess.CalledProcessError: If the ip6tables command fails, an exception is raised and logged.
+            subprocess.CalledProcessError: If the `ip` fallback fails.
+        """
+        if self.with_netlink(lambda netlink: netlink.add_route(destination, gateway, device), f"add the route to {destination}"):
+            return
+        command = [*SUDO, "ip"] + (["-6"] if ":" in destination else []) + ["route", "add", destination]
+        if gateway:
+            command += ["via", gateway]
+        if device:
+            command += ["dev", device]
+        subprocess.run(command, check=True)
 
-        Example:
-            self.set_iptables()
 
-        Notes:
-            - The method requires root privileges to modify ip6tables, so it uses `sudo` to execute the commands.
-            - It is important to ensure that these rules are persistent across system reboots, typically by using a tool like
-            `iptables-persistent` or manually saving the iptables configuration.
+    def add_routes(self, prefixes: List[str]) -> None:
         """
-        icmp_types = ["135", "136", "133", "134", "137", "128", "129"]
+        Routes IPv6 prefixes to the TUN device (hub mode: one prefix per remote island).
+
+        With netlink, the routes are pipelined on the same socket; otherwise they are given to a
+        single `ip -batch` process, so that thousands of prefixes do not cost one process each.
+
+        Args:
+            prefixes (List[str]): The IPv6 prefixes, e.g. ["fc00:1234:3::/64"].
+        """
+        if not self.tun_dev:
+            logger.error("TUN device not specified.")
+            return
+        if self.with_netlink(lambda netlink: netlink.replace_routes(prefixes, self.tun_dev), "add the routes"):
+            logger.info(f"{len(prefixes)} IPv6 routes added to '{self.tun_dev}'.")
+            return
+        commands = "".join(f"route replace {prefix} dev {self.tun_dev}\n" for prefix in prefixes)
         try:
-            for icmp_type in icmp_types:
-                subprocess.run(["sudo", "ip6tables", "-A", "INPUT", "-p", "ipv6-icmp", "--icmpv6-type", icmp_type, "-j", "ACCEPT"], check=True)
-            logger.info("IP6Tables rules for ICMP configured successfully.")
+            subprocess.run([*SUDO, "ip", "-6", "-batch", "-"], input=commands.encode(), check=True)
+            logger.info(f"{len(prefixes)} IPv6 routes added to '{self.tun_dev}'.")
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to configure iptables: {e}")
-        for iface in ["eth2", self.tun_dev]:
-            try:    
-                subprocess.run(("sudo", "ip6tables", "-t", "nat", "-A", "POSTROUTING", "-o", iface, "-j", "MASQUERADE"),check=True)
-                
-                subprocess.run(("sudo", "ip6tables", "-A", "INPUT", "-i", self.tun_dev, "-p", "ipv6", "-j", "ACCEPT" ),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "OUTPUT", "-o", self.tun_dev, "-p", "ipv6", "-j", "ACCEPT" ),check=True)
-                
-                subprocess.run(("sudo", "iptables", "-A", "INPUT", "-i", self.tun_dev ,"-p", "ipv6", "-s", ipv4_src_addr, "-j", "ACCEPT"  ),check=True)
-                subprocess.run(("sudo", "iptables", "-A", "OUTPUT", "-o", self.tun_dev ,"-p", "ipv6", "-s", ipv4_src_addr, "-j", "ACCEPT"  ),check=True)
-                
-                subprocess.run(("sudo", "iptables", "-A", "INPUT", "-i", self.tun_dev ,"-p", "ipv6", "-d", ipv4_dst_addr, "-j", "ACCEPT"  ),check=True)
-                subprocess.run(("sudo", "iptables", "-A", "OUTPUT", "-o", self.tun_dev ,"-p", "ipv6", "-d", ipv4_dst_addr, "-j", "ACCEPT"  ),check=True)
-                
-                subprocess.run(("sudo", "ip6tables", "-A", "INPUT", "-p", "icmpv6", "--icmpv6-type", "echo-request", "-j", "ACCEPT"),check=True)
-                
-                subprocess.run(("sudo", "ip6tables", "-A", "OUTPUT", "-o", self.tun_dev, "-p", "tcp", "-d", ipv6_gateway, "--dport", "123:65535",
-                                "--sport", str(src_port), "!", "--syn", "-j", "ACCEPT" ),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "INPUT", "-i", self.tun_dev, "-p", "tcp", "-d", ipv6_gateway, "--dport", "123:65535",
-                                "--sport", str(src_port), "!", "--syn", "-j", "ACCEPT" ),check=True)
-                
-                subprocess.run(("sudo", "ip6tables", "-A", "OUTPUT", "-o", self.tun_dev, "-p", "tcp", "-s", ipv6_gateway, "--dport", "123:65535",
-                                "--sport",str(dst_port), "!", "--syn", "-j", "ACCEPT" ),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "INPUT", "-i", self.tun_dev, "-p", "tcp", "-s", ipv6_gateway, "--dport", "123:65535",
-                                "--sport", str(dst_port), "!", "--syn", "-j", "ACCEPT" ),check=True)
-                
-                subprocess.run(("sudo", "ip6tables", "-A", "FORWARD", "-i", self.tun_dev, "-o", "eth1", "-j", "ACCEPT"),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "FORWARD", "-i", self.tun_dev, "-o", "eth2", "-j", "ACCEPT"),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "FORWARD", "-i", "eth2", "-o", self.tun_dev, "-j", "ACCEPT"),check=True)
-                subprocess.run(("sudo", "ip6tables", "-A", "FORWARD", "-i", "eth1", "-o", self.tun_dev, "-j", "ACCEPT"),check=True)
-            except subprocess.CalledProcessError as e:
-                logging.error(f"On func set_iptables --> Error : {e}")
-                exit(0)
+            logger.error(f"Failed to add routes: {e}")
+            exit(-1)
+
+
+    # Built-in chains jumping to the dedicated chains of a tunnel, per table
+    FIREWALL_HOOKS = {"filter": ("INPUT", "OUTPUT", "FORWARD"), "nat": ("POSTROUTING",)}
+
+    def firewall_chain(self, hook: str) -> str:
+        """
+        Returns the name of the dedicated chain of this tunnel for a built-in chain.
+
+        Args:
+            hook (str): The built-in chain (e.g. "INPUT").
+
+        Returns:
+            str: The chain name, e.g. "TUN64-tun0-INPUT" (at most 28 characters).
+        """
+        return f"TUN64-{self.tun_dev}-{hook}"[:28]
+
+
+    def firewall_rules(self, ipv4_src_addr: str, src_port: int, ipv4_dst_addr: str, dst_port: int, ipv6_gateway: str) -> dict:
+        """
+        Builds the complete ruleset of the tunnel, each rule once.
+
+        The rules are those the tunnel always needed: the ICMPv6 types of the Neighbor
+        Discovery Protocol and ping, the tunnel traffic (IPv6 over the tunnel, protocol 41 from
+        and to the endpoints), the TCP traffic of the endpoints through the gateway, forwarding
+        between the tunnel and the LAN interfaces (eth1, eth2) and the masquerading on eth2
+        and on the tunnel.
+
+        Args:
+            ipv4_src_addr (str): The local IPv4 address.
+            src_port (int): The local port.
+            ipv4_dst_addr (str): The remote IPv4 address.
+            dst_port (int): The remote port.
+            ipv6_gateway (str): The IPv6 gateway.
+
+        Returns:
+            dict: Command ("iptables" or "ip6tables") -> table -> built-in chain -> rules
+                  (arguments of `-A`, without the chain).
+        """
+        tun = self.tun_dev
+        # 135/136: Neighbor Solicitation/Advertisement, 133/134: Router Solicitation/Advertisement,
+        # 137: Redirect, 128/129: Echo Request/Reply
+        icmp_types = ["135", "136", "133", "134", "137", "128", "129"]
+        established = "--dport 123:65535 --sport {port} ! --syn -j ACCEPT"
+        return {
+            "ip6tables": {
+                "filter": {
+                    "INPUT": [f"-p ipv6-icmp --icmpv6-type {icmp_type} -j ACCEPT" for icmp_type in icmp_types] + [
+                        f"-i {tun} -p ipv6 -j ACCEPT",
+                        f"-i {tun} -p tcp -d {ipv6_gateway} " + established.format(port=src_port),
+                        f"-i {tun} -p tcp -s {ipv6_gateway} " + established.format(port=dst_port),
+                    ],
+                    "OUTPUT": [
+                        f"-o {tun} -p ipv6 -j ACCEPT",
+                        f"-o {tun} -p tcp -d {ipv6_gateway} " + established.format(port=src_port),
+                        f"-o {tun} -p tcp -s {ipv6_gateway} " + established.format(port=dst_port),
+                    ],
+                    "FORWARD": [
+                        f"-i {tun} -o eth1 -j ACCEPT",
+                        f"-i {tun} -o eth2 -j ACCEPT",
+                        f"-i eth2 -o {tun} -j ACCEPT",
+                        f"-i eth1 -o {tun} -j ACCEPT",
+                    ],
+                },
+                "nat": {
+                    "POSTROUTING": [f"-o {iface} -j MASQUERADE" for iface in ("eth2", tun)],
+                },
+            },
+            "iptables": {
+                "filter": {
+                    "INPUT": [f"-i {tun} -p ipv6 -s {ipv4_src_addr} -j ACCEPT", f"-i {tun} -p ipv6 -d {ipv4_dst_addr} -j ACCEPT"],
+                    "OUTPUT": [f"-o {tun} -p ipv6 -s {ipv4_src_addr} -j ACCEPT", f"-o {tun} -p ipv6 -d {ipv4_dst_addr} -j ACCEPT"],
+                },
+            },
+        }
+
+
+    def firewall_restore_input(self, tables: dict, saved: str, remove: bool = False) -> str:
+        """
+        Builds the input of `iptables-restore --noflush` installing (or removing) the dedicated
+        chains of the tunnel in a single transaction.
+
+        Declaring a chain in the input creates it, or flushes it if it exists: the ruleset of
+        the tunnel is replaced, never appended to. The jump from the built-in chain is only
+        added if the current ruleset (`saved`, the output of `iptables-save`) does not have it.
+
+        Args:
+            tables (dict): Table -> built-in chain -> rules (see `firewall_rules`).
+            saved (str): The current ruleset, as printed by `iptables-save`.
+            remove (bool): Remove the jumps and the chains instead of installing them.
+
+        Returns:
+            str: The restore input.
+        """
+        existing = set(saved.splitlines())
+        lines = []
+        for table, chains in tables.items():
+            lines.append(f"*{table}")
+            hooks = [hook for hook in self.FIREWALL_HOOKS[table] if hook in chains or remove]
+            for hook in hooks:
+                chain = self.firewall_chain(hook)
+                if remove and not any(line.startswith(f":{chain} ") for line in existing):
+                    continue
+                lines.append(f":{chain} - [0:0]")
+                jump = f"-A {hook} -j {chain}"
+                if remove:
+                    if jump in existing:
+                        lines.append(f"-D {hook} -j {chain}")
+                    lines.append(f"-X {chain}")
+                    continue
+                lines.extend(f"-A {chain} {rule}" for rule in chains[hook])
+                if jump not in existing:
+                    lines.append(jump)
+            lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+
+    def apply_firewall(self, tables_by_command: dict, remove: bool = False) -> None:
+        """
+        Applies rulesets with one `<command>-save` and one `<command>-restore --noflush` per
+        family, each restore being atomic.
+
+        Args:
+            tables_by_command (dict): Command ("iptables" or "ip6tables") -> table -> rules.
+            remove (bool): Remove the dedicated chains instead of installing them.
+        """
+        for command, tables in tables_by_command.items():
+            try:
+                saved = subprocess.run([*SUDO, f"{command}-save"], stdout=subprocess.PIPE, check=True, text=True).stdout
+                restore_input = self.firewall_restore_input(tables, saved, remove)
+                subprocess.run([*SUDO, f"{command}-restore", "--noflush"], input=restore_input, check=True, text=True)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.error(f"Failed to {'remove' if remove else 'install'} the {command} rules: {e}")
+                continue
+            logger.info(f"{command} rules of '{self.tun_dev}' {'removed' if remove else 'installed'}.")
+
+
+    def set_iptables(self, ipv4_src_addr: str, src_port:int,  ipv4_dst_addr: str, dst_port, ipv6_gateway: str) -> None:        
+        """
+        Installs the firewall rules of the tunnel (see `firewall_rules`).
+
+        The rules live in dedicated chains (`TUN64-<device>-<built-in chain>`), each reached by
+        one jump from its built-in chain. Each family is installed in a single
+        `iptables-restore --noflush` / `ip6tables-restore --noflush` transaction that replaces
+        the content of the chains: restarting the tunnel never duplicates a rule, and the
+        rules of other tunnels and of the system are left untouched. `teardown_iptables`
+        removes them.
+
+        Args:
+            ipv4_src_addr (str): The local IPv4 address.
+            src_port (int): The local port.
+            ipv4_dst_addr (str): The remote IPv4 address.
+            dst_port (int): The remote port.
+            ipv6_gateway (str): The IPv6 gateway.
+
+        Notes:
+            - The method requires root privileges to modify the rules (`sudo` is used when not root).
+        """
+        self.apply_firewall(self.firewall_rules(ipv4_src_addr, src_port, ipv4_dst_addr, dst_port, ipv6_gateway))
+
+
+    def teardown_iptables(self) -> None:
+        """
+        Removes the jumps to the dedicated chains of the tunnel and the chains themselves.
+        """
+        self.apply_firewall({command: {table: {} for table in self.FIREWALL_HOOKS}
+                             for command in ("iptables", "ip6tables")}, remove=True)
 
 
     def from_tun_to(self, src:int, dst:int) -> None:
@@ -0,0 +1,342 @@
+import os
+import socketserver
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class Counters:
+    """
+    Per-packet counters of an endpoint, replacing the per-packet log records of the data path.
+
+    Incrementing an attribute costs far less than formatting and writing a log record.
+    The counters are plain integers updated without a lock: they are statistics, not accounting.
+
+    Direction tunnel -> peer: `tun_read_*` then `peer_sent_*`.
+    Direction peer -> tunnel: `peer_received_*` then `tun_written_*`.
+
+    Attributes:
+        tun_read_packets (int): Packets read from the tunnel (to be sent to the peer).
+        tun_read_bytes (int): Bytes of the packets read from the tunnel.
+        peer_sent_packets (int): Encapsulated packets sent to the peer.
+        peer_sent_bytes (int): Bytes of the IPv6 packets sent to the peer (without the IPv4 header).
+        peer_received_packets (int): Packets received from the peers.
+        peer_received_bytes (int): Bytes received from the peers (as received, headers included).
+        tun_written_packets (int): Packets written to the tunnel.
+        tun_written_bytes (int): Bytes of the packets written to the tunnel.
+        drops (int): Packets dropped on purpose (full queue, no peer).
+        too_big (int): Packets over the MTU of the tunnel, answered with an ICMPv6 Packet Too Big.
+        errors (int): Failed reads, writes and sends.
+        compressed_packets (int): Packets sent to the peer with a compressed IPv6 header.
+        full_headers (int): Packets sent with their whole header to install or refresh a
+                            compression context.
+        decompression_drops (int): Packets received with a compressed header that could not
+                                   be expanded (context lost or replaced).
+    """
+    __slots__ = ("tun_read_packets", "tun_read_bytes", "peer_sent_packets", "peer_sent_bytes",
+                 "peer_received_packets", "peer_received_bytes", "tun_written_packets", "tun_written_bytes",
+                 "drops", "too_big", "errors", "compressed_packets", "full_headers", "decompression_drops")
+
+    def __init__(self) -> None:
+        """
+        Initializes every counter to zero.
+        """
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current value of every counter.
+
+        Returns:
+            dict: Counter name -> value.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PacketTracer:
+    """
+    Decides which packets are traced: one packet out of `every` (0 disables tracing).
+
+    The data path checks `every` first, so when tracing is off a packet costs a single
+    attribute test and is never classified nor formatted:
+
+        if tracer.every and tracer.sample():
+            ...  # describe and log the packet
+
+    Attributes:
+        every (int): Sampling period (trace 1 packet in `every`), 0 when tracing is off.
+        countdown (int): Packets left before the next traced one.
+    """
+
+    def __init__(self, every: int = 0) -> None:
+        """
+        Initializes the tracer.
+
+        Args:
+            every (int): Sampling period, 0 to disable tracing.
+        """
+        self.every = every
+        self.countdown = every
+
+    def sample(self) -> bool:
+        """
+        Counts one packet and tells whether it must be traced.
+
+        Returns:
+            bool: True for one packet out of `every`.
+        """
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.every
+        return True
+
+
+class LatencyHistogram:
+    """
+    An HDR-style (log-linear) histogram of durations in nanoseconds.
+
+    Every power of two is split into 2**SUB_BITS buckets of equal width, so any recorded value
+    is known within 1/2**SUB_BITS (12.5%) whatever its magnitude, with a fixed and small
+    number of buckets. Recording is an integer computation and a list increment.
+
+    Attributes:
+        counts (List[int]): Number of values recorded in each bucket.
+        total (int): Number of recorded values.
+        sum (int): Sum of the recorded values (nanoseconds).
+    """
+    SUB_BITS = 3
+    MAX_SHIFT = 40  # values up to 2**44 ns (about 4.9 hours), larger ones go to the last bucket
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty histogram.
+        """
+        self.counts = [0] * ((self.MAX_SHIFT + 2) << self.SUB_BITS)
+        self.total = 0
+        self.sum = 0
+
+    def bucket(self, value: int) -> int:
+        """
+        Returns the index of the bucket holding a value.
+
+        Args:
+            value (int): The value, in nanoseconds.
+
+        Returns:
+            int: The index of its bucket in `counts`.
+        """
+        shift = value.bit_length() - self.SUB_BITS - 1
+        if shift <= 0:
+            return max(value, 0)
+        return min((shift << self.SUB_BITS) + (value >> shift), len(self.counts) - 1)
+
+    def lower_bound(self, index: int) -> int:
+        """
+        Returns the smallest value of a bucket.
+
+        Args:
+            index (int): The index of the bucket.
+
+        Returns:
+            int: The smallest value (nanoseconds) recorded in this bucket.
+        """
+        if index < 2 << self.SUB_BITS:
+            return index
+        shift = (index >> self.SUB_BITS) - 1
+        return (index - (shift << self.SUB_BITS)) << shift
+
+    def record(self, value: int) -> None:
+        """
+        Records one duration.
+
+        Args:
+            value (int): The duration in nanoseconds.
+        """
+        self.counts[self.bucket(value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> int:
+        """
+        Returns an estimate of a quantile (lower bound of the bucket holding it).
+
+        Args:
+            q (float): The quantile, between 0 and 1 (e.g. 0.99).
+
+        Returns:
+            int: The estimated quantile in nanoseconds (0 when the histogram is empty).
+        """
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.lower_bound(index)
+        return 0
+
+    def cumulative(self, bounds: List[int]) -> List[int]:
+        """
+        Returns the number of values below each bound (Prometheus `le` buckets).
+
+        Bounds must be powers of two, which are bucket boundaries: the counts are exact.
+
+        Args:
+            bounds (List[int]): Increasing upper bounds, in nanoseconds.
+
+        Returns:
+            List[int]: The number of recorded values strictly below each bound.
+        """
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            limit = self.bucket(bound)
+            while index < limit:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+class Metrics:
+    """
+    The metrics of an endpoint: counters, gauges read at collection time and the latency
+    histogram of the time a packet spends between the tunnel read and the socket send.
+
+    `render` produces the Prometheus text exposition format, served by `MetricsServer`.
+
+    Attributes:
+        counters (Counters): The packet counters of the endpoint.
+        latency (LatencyHistogram): Time from the tunnel read to the socket send.
+        gauges (Dict[str, Callable[[], int]]): Gauge name -> function returning its value.
+        sampled (Dict[str, Callable[[], int]]): Counters kept outside of `counters` (e.g. by a
+                                               queue) -> function returning their value.
+    """
+    PREFIX = "tunnel_"
+    # Prometheus buckets of the latency histogram: powers of two from about 1 us to 17 s
+    LATENCY_BOUNDS = [1 << shift for shift in range(10, 35)]
+
+    def __init__(self, counters: Counters) -> None:
+        """
+        Initializes the metrics of an endpoint.
+
+        Args:
+            counters (Counters): The packet counters of the endpoint.
+        """
+        self.counters = counters
+        self.latency = LatencyHistogram()
+        self.gauges = {}
+        self.sampled = {}
+
+    def gauge(self, name: str, read: Callable[[], int]) -> None:
+        """
+        Registers a gauge (e.g. the depth of a queue), read each time the metrics are collected.
+
+        Args:
+            name (str): The name of the gauge.
+            read (Callable[[], int]): Returns the current value.
+        """
+        self.gauges[name] = read
+
+    def counter(self, name: str, read: Callable[[], int]) -> None:
+        """
+        Registers a counter kept by another object, read each time the metrics are collected.
+
+        Args:
+            name (str): The name of the counter (without the `_total` suffix).
+            read (Callable[[], int]): Returns the current value.
+        """
+        self.sampled[name] = read
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, one sample per line.
+        """
+        lines = []
+        values = self.counters.snapshot()
+        for name, read in self.sampled.items():
+            values[name] = read()
+        for name, value in values.items():
+            lines.append(f"# TYPE {self.PREFIX}{name}_total counter")
+            lines.append(f"{self.PREFIX}{name}_total {value}")
+        for name, read in self.gauges.items():
+            lines.append(f"# TYPE {self.PREFIX}{name} gauge")
+            lines.append(f"{self.PREFIX}{name} {read()}")
+
+        name = f"{self.PREFIX}send_latency_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for bound, count in zip(self.LATENCY_BOUNDS, self.latency.cumulative(self.LATENCY_BOUNDS)):
+            lines.append(f'{name}_bucket{{le="{bound / 1e9:.9g}"}} {count}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.latency.total}')
+        lines.append(f"{name}_sum {self.latency.sum / 1e9:.9g}")
+        lines.append(f"{name}_count {self.latency.total}")
+        for q in (0.5, 0.99):
+            lines.append(f'{self.PREFIX}send_latency_quantile_seconds{{quantile="{q}"}} {self.latency.quantile(q) / 1e9:.9g}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves the metrics of an endpoint from a daemon thread, either:
+        - over HTTP on 127.0.0.1:<port> (`GET /metrics`, Prometheus scrape target), or
+        - on a Unix socket: each connection receives the metrics then is closed
+          (e.g. `socat - UNIX-CONNECT:/run/tunnel64.sock`).
+
+    Attributes:
+        metrics (Metrics): The metrics to serve.
+        server (socketserver.BaseServer): The underlying server.
+    """
+
+    def __init__(self, metrics: Metrics, port: Optional[int] = None, path: Optional[str] = None) -> None:
+        """
+        Creates the server (HTTP if `port` is given, Unix socket otherwise).
+
+        Args:
+            metrics (Metrics): The metrics to serve.
+            port (Optional[int]): The local HTTP port.
+            path (Optional[str]): The path of the Unix socket.
+        """
+        self.metrics = metrics
+        render = metrics.render
+
+        if port is not None:
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    body = render().encode()
+                    self.send_response(200 if self.path == "/metrics" else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format: str, *args) -> None:
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        else:
+            class Handler(socketserver.StreamRequestHandler):
+                def handle(self) -> None:
+                    self.wfile.write(render().encode())
+
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self.server.daemon_threads = True
+
+    def start(self) -> None:
+        """
+        Starts serving in a daemon thread.
+        """
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        address = self.server.server_address
+        logger.info(f"Metrics served on {address if isinstance(address, str) else f'http://{address[0]}:{address[1]}/metrics'}")
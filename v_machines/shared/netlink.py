@@ -0,0 +1,388 @@
+import os
+import socket
+import struct
+import ipaddress
+import logging
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Netlink message header and flags (linux/netlink.h)
+NLMSG_HEADER = struct.Struct("=IHHII")  # length, type, flags, sequence, port id
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x01
+NLM_F_ACK = 0x04
+NLM_F_DUMP = 0x300
+NLM_F_REPLACE = 0x100
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+# rtnetlink messages and attributes (linux/rtnetlink.h, if_link.h, if_addr.h, neighbour.h)
+RTM_NEWLINK = 16
+RTM_NEWADDR = 20
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+IFINFOMSG = struct.Struct("=BxHiII")  # family, type, index, flags, change mask
+IFADDRMSG = struct.Struct("=BBBBI")  # family, prefix length, flags, scope, index
+RTMSG = struct.Struct("=BBBBBBBBI")  # family, dst len, src len, tos, table, protocol, scope, type, flags
+NDMSG = struct.Struct("=BxxxiHBB")  # family, index, state, flags, type
+RTATTR = struct.Struct("=HH")  # length, type
+PIPELINE = 128  # requests sent before waiting for their acknowledgements
+IFF_UP = 0x1
+IFLA_MTU = 4
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+NDA_DST = 1
+RT_TABLE_MAIN = 254
+RTPROT_BOOT = 3
+RT_SCOPE_UNIVERSE = 0
+RT_SCOPE_LINK = 253
+RTN_UNICAST = 1
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+
+
+class Route(NamedTuple):
+    """
+    A route of the main table, parsed from a netlink dump.
+
+    Attributes:
+        destination (ipaddress._BaseNetwork): The destination prefix.
+        gateway (Optional[str]): The next hop, if any.
+        oif (int): Index of the output interface (0 if none).
+    """
+    destination: ipaddress._BaseNetwork
+    gateway: Optional[str]
+    oif: int
+
+
+def _attribute(kind: int, value: bytes) -> bytes:
+    """
+    Encodes a netlink attribute (header, value, padding to 4 bytes).
+
+    Args:
+        kind (int): The attribute type.
+        value (bytes): The attribute payload.
+
+    Returns:
+        bytes: The encoded attribute.
+    """
+    length = RTATTR.size + len(value)
+    return RTATTR.pack(length, kind) + value + bytes(-length % 4)
+
+
+def _attributes(data: bytes, offset: int) -> dict:
+    """
+    Decodes the attributes following a fixed message header.
+
+    Args:
+        data (bytes): The message payload.
+        offset (int): Where the attributes start.
+
+    Returns:
+        dict: Attribute type -> payload.
+    """
+    attributes = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attributes[kind] = data[offset + RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attributes
+
+
+def _family(address: str) -> int:
+    """
+    Returns the address family of an address or prefix.
+
+    Args:
+        address (str): The IPv4 or IPv6 address or prefix.
+
+    Returns:
+        int: `socket.AF_INET` or `socket.AF_INET6`.
+    """
+    return socket.AF_INET6 if ":" in address else socket.AF_INET
+
+
+class Netlink:
+    """
+    A minimal rtnetlink client: link state and MTU, addresses, routes and neighbours are
+    configured with messages on an `AF_NETLINK` socket, without starting any process.
+
+    Every request asks for an acknowledgement, so that a failure is raised as an `OSError`
+    carrying the errno of the kernel (the same errors as `ip` reports).
+
+    Attributes:
+        sock (socket.socket): The NETLINK_ROUTE socket.
+        sequence (int): Sequence number of the last request.
+    """
+
+    def __init__(self) -> None:
+        """
+        Opens the netlink socket.
+
+        Raises:
+            OSError: If netlink is not available.
+        """
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.sequence = 0
+
+    def close(self) -> None:
+        """
+        Closes the netlink socket.
+        """
+        self.sock.close()
+
+    def _send(self, kind: int, flags: int, payload: bytes) -> int:
+        """
+        Sends one request.
+
+        Args:
+            kind (int): The message type.
+            flags (int): The flags (`NLM_F_REQUEST` is added).
+            payload (bytes): The message payload.
+
+        Returns:
+            int: The sequence number of the request.
+        """
+        self.sequence += 1
+        self.sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), kind, flags | NLM_F_REQUEST, self.sequence, 0) + payload)
+        return self.sequence
+
+    def _messages(self, sequence: int) -> Iterator[Tuple[int, bytes]]:
+        """
+        Yields the answers to a request until its acknowledgement or the end of its dump.
+
+        Args:
+            sequence (int): The sequence number of the request.
+
+        Yields:
+            Tuple[int, bytes]: The type and payload of each message.
+
+        Raises:
+            OSError: If the kernel answered with an error.
+        """
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, kind, _, message_sequence, _ = NLMSG_HEADER.unpack_from(data, offset)
+                payload = data[offset + NLMSG_HEADER.size:offset + length]
+                offset += (length + 3) & ~3
+                if message_sequence != sequence:
+                    continue
+                if kind == NLMSG_DONE:
+                    return
+                if kind == NLMSG_ERROR:
+                    error = -struct.unpack_from("=i", payload)[0]
+                    if error:
+                        raise OSError(error, os.strerror(error))
+                    return
+                yield kind, payload
+
+    def request(self, kind: int, flags: int, payload: bytes) -> None:
+        """
+        Sends a request and waits for its acknowledgement.
+
+        Args:
+            kind (int): The message type.
+            flags (int): The flags of the request.
+            payload (bytes): The message payload.
+
+        Raises:
+            OSError: If the kernel rejected the request.
+        """
+        for _ in self._messages(self._send(kind, flags | NLM_F_ACK, payload)):
+            pass
+
+    def request_all(self, kind: int, flags: int, payloads: List[bytes]) -> None:
+        """
+        Sends many requests of the same type, `PIPELINE` at a time before reading their
+        acknowledgements, instead of one round trip per request.
+
+        Args:
+            kind (int): The message type.
+            flags (int): The flags of the requests.
+            payloads (List[bytes]): The payload of each request.
+
+        Raises:
+            OSError: The first error returned by the kernel (the other requests are still done).
+        """
+        failure = None
+        for start in range(0, len(payloads), PIPELINE):
+            pending = {self._send(kind, flags | NLM_F_ACK, payload) for payload in payloads[start:start + PIPELINE]}
+            while pending:
+                data = self.sock.recv(65536)
+                offset = 0
+                while offset + NLMSG_HEADER.size <= len(data):
+                    length, message_kind, _, sequence, _ = NLMSG_HEADER.unpack_from(data, offset)
+                    if message_kind == NLMSG_ERROR and sequence in pending:
+                        pending.discard(sequence)
+                        error = -struct.unpack_from("=i", data, offset + NLMSG_HEADER.size)[0]
+                        if error and failure is None:
+                            failure = OSError(error, os.strerror(error))
+                    offset += (length + 3) & ~3
+        if failure is not None:
+            raise failure
+
+    def dump(self, kind: int, payload: bytes) -> Iterator[Tuple[int, bytes]]:
+        """
+        Sends a dump request and yields the returned objects.
+
+        Args:
+            kind (int): The message type (e.g. `RTM_GETROUTE`).
+            payload (bytes): The message payload (selects the family).
+
+        Yields:
+            Tuple[int, bytes]: The type and payload of each object.
+        """
+        return self._messages(self._send(kind, NLM_F_DUMP, payload))
+
+    def set_link(self, device: str, up: Optional[bool] = None, mtu: Optional[int] = None) -> None:
+        """
+        Changes the state and/or the MTU of a link (`ip link set <device> up|down mtu <mtu>`).
+
+        Args:
+            device (str): The name of the link.
+            up (Optional[bool]): True to bring it up, False to bring it down, None to keep it.
+            mtu (Optional[int]): The new MTU, None to keep it.
+        """
+        flags = IFF_UP if up else 0
+        change = IFF_UP if up is not None else 0
+        payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, socket.if_nametoindex(device), flags, change)
+        if mtu is not None:
+            payload += _attribute(IFLA_MTU, struct.pack("=I", mtu))
+        self.request(RTM_NEWLINK, 0, payload)
+
+    def add_address(self, device: str, address: str) -> None:
+        """
+        Adds an address to a link (`ip address add <address> dev <device>`).
+
+        Args:
+            device (str): The name of the link.
+            address (str): The address with its prefix length (e.g. "fc00:1234:ffff::1/64").
+        """
+        interface = ipaddress.ip_interface(address)
+        family = _family(address)
+        packed = interface.ip.packed
+        payload = IFADDRMSG.pack(family, interface.network.prefixlen, 0, RT_SCOPE_UNIVERSE, socket.if_nametoindex(device))
+        payload += _attribute(IFA_LOCAL, packed) + _attribute(IFA_ADDRESS, packed)
+        self.request(RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, payload)
+
+    def _route(self, destination: str, gateway: Optional[str], oif: int) -> bytes:
+        """
+        Encodes the payload of a route message.
+
+        Args:
+            destination (str): The destination prefix (or address, for a host route).
+            gateway (Optional[str]): The next hop.
+            oif (int): Index of the output link (0 for none).
+
+        Returns:
+            bytes: The rtmsg header and its attributes.
+        """
+        # inet_pton rather than ipaddress: thousands of hub routes are encoded at startup
+        family = _family(destination)
+        address, _, length = destination.partition("/")
+        packed = socket.inet_pton(family, address)
+        bits = len(packed) * 8
+        prefix_length = int(length) if length else bits
+        masked = int.from_bytes(packed, "big") >> (bits - prefix_length) << (bits - prefix_length)
+        scope = RT_SCOPE_UNIVERSE if gateway else RT_SCOPE_LINK
+        payload = RTMSG.pack(family, prefix_length, 0, 0, RT_TABLE_MAIN, RTPROT_BOOT, scope, RTN_UNICAST, 0)
+        payload += _attribute(RTA_DST, masked.to_bytes(len(packed), "big"))
+        if gateway:
+            payload += _attribute(RTA_GATEWAY, socket.inet_pton(family, gateway))
+        if oif:
+            payload += _attribute(RTA_OIF, struct.pack("=i", oif))
+        return payload
+
+    def add_route(self, destination: str, gateway: Optional[str] = None, device: Optional[str] = None, replace: bool = False) -> None:
+        """
+        Adds a route to the main table (`ip route add|replace <destination> [via <gateway>] [dev <device>]`).
+
+        Args:
+            destination (str): The destination prefix (or address, for a host route).
+            gateway (Optional[str]): The next hop.
+            device (Optional[str]): The output link.
+            replace (bool): Replace an existing route instead of failing with EEXIST.
+        """
+        oif = socket.if_nametoindex(device) if device else 0
+        self.request(RTM_NEWROUTE, NLM_F_CREATE | (NLM_F_REPLACE if replace else NLM_F_EXCL),
+                     self._route(destination, gateway, oif))
+
+    def replace_routes(self, destinations: List[str], device: str) -> None:
+        """
+        Routes many prefixes to a link (`ip -batch` of `route replace <prefix> dev <device>`),
+        with pipelined requests.
+
+        Args:
+            destinations (List[str]): The destination prefixes.
+            device (str): The output link.
+        """
+        oif = socket.if_nametoindex(device)
+        self.request_all(RTM_NEWROUTE, NLM_F_CREATE | NLM_F_REPLACE,
+                         [self._route(destination, None, oif) for destination in destinations])
+
+    def routes(self, family: int) -> List[Route]:
+        """
+        Returns the routes of the main table (`ip route show`), parsed.
+
+        Args:
+            family (int): `socket.AF_INET` or `socket.AF_INET6`.
+
+        Returns:
+            List[Route]: The routes.
+        """
+        routes = []
+        for _, payload in self.dump(RTM_GETROUTE, RTMSG.pack(family, 0, 0, 0, 0, 0, 0, 0, 0)):
+            _, dst_len, _, _, table, _, _, kind, _ = RTMSG.unpack_from(payload)
+            attributes = _attributes(payload, RTMSG.size)
+            if RTA_TABLE in attributes:
+                table = struct.unpack("=I", attributes[RTA_TABLE])[0]
+            if table != RT_TABLE_MAIN or kind != RTN_UNICAST:
+                continue
+            address_type = ipaddress.IPv6Address if family == socket.AF_INET6 else ipaddress.IPv4Address
+            destination = address_type(attributes[RTA_DST]) if RTA_DST in attributes else address_type(0)
+            gateway = str(address_type(attributes[RTA_GATEWAY])) if RTA_GATEWAY in attributes else None
+            oif = struct.unpack("=i", attributes[RTA_OIF])[0] if RTA_OIF in attributes else 0
+            routes.append(Route(ipaddress.ip_network((destination, dst_len)), gateway, oif))
+        return routes
+
+    def flush_neighbours(self, family: int) -> int:
+        """
+        Deletes the dynamic neighbour entries (`ip neigh flush all`): permanent and NOARP
+        entries are kept.
+
+        Args:
+            family (int): `socket.AF_INET` or `socket.AF_INET6`.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        entries = []
+        for _, payload in self.dump(RTM_GETNEIGH, NDMSG.pack(family, 0, 0, 0, 0)):
+            _, index, state, _, _ = NDMSG.unpack_from(payload)
+            destination = _attributes(payload, NDMSG.size).get(NDA_DST)
+            if destination and not state & (NUD_PERMANENT | NUD_NOARP):
+                entries.append(NDMSG.pack(family, index, 0, 0, 0) + _attribute(NDA_DST, destination))
+        deleted = 0
+        for entry in entries:
+            try:
+                self.request(RTM_DELNEIGH, 0, entry)
+                deleted += 1
+            except FileNotFoundError:
+                # Already gone (expired meanwhile)
+                pass
+        return deleted
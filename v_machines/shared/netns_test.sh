@@ -0,0 +1,65 @@
+#!/bin/bash
+
+# Runs two tunnel endpoints in two network namespaces linked by a veth pair,
+# then sends UDP datagrams between the IPv6 addresses of their TUN interfaces.
+# Usage: sudo ./netns_test.sh [tcp|udp|raw] (default: raw)
+
+proto="${1:-raw}"
+cd "$(dirname "$0")"
+
+cleanup() {
+    kill $(jobs -p) 2>/dev/null
+    wait 2>/dev/null
+    ip netns del tun64a 2>/dev/null
+    ip netns del tun64b 2>/dev/null
+}
+trap cleanup EXIT
+
+# Namespaces and IPv4 link
+ip netns add tun64a
+ip netns add tun64b
+ip link add veth64a netns tun64a type veth peer name veth64b netns tun64b
+ip -n tun64a address add 10.64.0.1/24 dev veth64a
+ip -n tun64b address add 10.64.0.2/24 dev veth64b
+for ns in tun64a tun64b; do
+    ip -n $ns link set lo up
+    ip -n $ns link set veth64${ns: -1} up
+done
+
+# TUN interfaces and their IPv6 addresses
+endpoint() {
+    # $1 namespace, $2 IPv6 address, $3 local IPv4, $4 remote IPv4
+    ip -n $1 tuntap add dev tun64 mode tun
+    ip -n $1 address add $2/64 dev tun64
+    ip -n $1 link set tun64 up
+    ip netns exec $1 python3 -c "
+from iftun import Interface
+from extremity import Extremity
+tun_fd, _ = Interface('tun64').tun_alloc()
+Extremity('$2/64', tun_fd, '$3', '$4', 6464, 6464, proto='$proto').start()
+" &
+}
+endpoint tun64b fd00:64::2 10.64.0.2 10.64.0.1
+sleep 1
+endpoint tun64a fd00:64::1 10.64.0.1 10.64.0.2
+sleep 2
+
+# Echo server behind tun64b, client behind tun64a
+ip netns exec tun64b python3 -c "
+import socket
+server = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+server.bind(('fd00:64::2', 9064))
+while True:
+    data, address = server.recvfrom(2048)
+    server.sendto(data, address)
+" &
+sleep 1
+ip netns exec tun64a python3 -c "
+import socket, sys
+client = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+client.settimeout(2)
+for i in range(10):
+    client.sendto(b'ping %d' % i, ('fd00:64::2', 9064))
+    print(client.recvfrom(2048)[0].decode())
+print('$proto tunnel OK')
+" 2>&1 | grep -v " - INFO - "
@@ -0,0 +1,99 @@
+import struct
+from typing import List
+
+# virtio-net header put in front of every packet by a TUN device opened with IFF_VNET_HDR
+VNET_HEADER = struct.Struct("=BBHHHH")  # flags, gso_type, hdr_len, gso_size, csum_start, csum_offset
+VNET_HDR_LEN = VNET_HEADER.size
+VNET_NONE = bytes(VNET_HDR_LEN)  # a complete packet: nothing to segment nor to checksum
+VNET_F_NEEDS_CSUM = 1
+GSO_NONE = 0
+GSO_TCPV6 = 4
+GSO_ECN = 0x80
+
+# TUNSETOFFLOAD flags: what the kernel may hand over unfinished
+TUN_F_CSUM = 0x01
+TUN_F_TSO6 = 0x04
+
+# Largest frame (virtio-net header and packet) behind the 20-byte header of the tcp carrier,
+# whose total length field is 16 bits. With the default gso_max_size (64 KB) the TCP
+# super-packets of the kernel always fit.
+FRAME_MAX = 65535 - 20
+
+TCP = 6
+TCP_FIN_PSH = 0x09
+TCP_CWR = 0x80
+
+
+def wire_size(frame: bytes) -> int:
+    """
+    Returns the size of the largest packet a frame read from the tunnel becomes on the wire:
+    the segments of a TCP super-packet (headers + `gso_size`), or the packet itself.
+
+    Args:
+        frame (bytes): virtio-net header followed by the packet.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if frame[1] == GSO_NONE:
+        return len(frame) - VNET_HDR_LEN
+    return 40 + (frame[VNET_HDR_LEN + 52] >> 4) * 4 + VNET_HEADER.unpack_from(frame)[3]
+
+
+def segment(frame: bytes) -> List[List[bytes]]:
+    """
+    Turns a frame read from the tunnel into complete IPv6 packets, doing in software what the
+    kernel left to the "hardware": the checksum of a partial packet, the segmentation (TSO) of
+    a TCP super-packet. Only the datagram carriers need it, the tcp carrier sends the frame.
+
+    Each segment is a fresh IPv6 + TCP header followed by a slice of the payload (no copy):
+    the sequence number advances by the payload already sent, FIN and PSH stay on the last
+    segment, CWR on the first, and the checksum is computed over the pseudo-header, the header
+    and the slice (see `pmtu.internet_checksum` for the modulo 0xFFFF trick).
+
+    Args:
+        frame (bytes): virtio-net header followed by the packet.
+
+    Returns:
+        List[List[bytes]]: The buffers of each packet (empty if the frame cannot be segmented:
+                           only TCP over IPv6 without extension headers is offloaded).
+    """
+    flags, gso_type, _, gso_size, csum_start, csum_offset = VNET_HEADER.unpack_from(frame)
+    packet = memoryview(frame)[VNET_HDR_LEN:]
+    if gso_type == GSO_NONE:
+        if not flags & VNET_F_NEEDS_CSUM:
+            return [[packet]]
+        # The checksum field holds the sum of the pseudo-header: summing from csum_start completes it
+        complete = bytearray(packet)
+        covered = complete[csum_start:] + b"\x00" * (len(complete[csum_start:]) % 2)
+        struct.pack_into("!H", complete, csum_start + csum_offset, ~(int.from_bytes(covered, "big") % 0xFFFF) & 0xFFFF)
+        return [[complete]]
+    if gso_type & ~GSO_ECN != GSO_TCPV6 or packet[6] != TCP or not gso_size:
+        return []
+
+    header_length = 40 + (packet[52] >> 4) * 4
+    header = bytes(packet[:header_length])
+    payload = packet[header_length:]
+    sequence = int.from_bytes(header[44:48], "big")
+    tcp_flags = header[53]
+    # Addresses and next header of the pseudo-header, the same for every segment
+    pseudo_sum = int.from_bytes(header[8:40], "big") + TCP
+    segments = []
+    for offset in range(0, len(payload), gso_size):
+        chunk = payload[offset:offset + gso_size]
+        tcp_length = header_length - 40 + len(chunk)
+        segment_header = bytearray(header)
+        struct.pack_into("!H", segment_header, 4, tcp_length)
+        struct.pack_into("!I", segment_header, 44, (sequence + offset) & 0xFFFFFFFF)
+        segment_flags = tcp_flags
+        if offset:
+            segment_flags &= ~TCP_CWR
+        if offset + gso_size < len(payload):
+            segment_flags &= ~TCP_FIN_PSH
+        segment_header[53] = segment_flags
+        segment_header[56:58] = b"\x00\x00"
+        data = int.from_bytes(chunk, "big") << (8 * (len(chunk) % 2))
+        total = pseudo_sum + tcp_length + int.from_bytes(segment_header[40:], "big") + data
+        struct.pack_into("!H", segment_header, 56, ~(total % 0xFFFF) & 0xFFFF)
+        segments.append([segment_header, chunk])
+    return segments
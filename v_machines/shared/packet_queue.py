@@ -0,0 +1,235 @@
+import math
+import time
+import threading
+from collections import deque
+from queue import Empty
+from typing import Callable, Optional, Tuple
+
+from metrics import Counters
+
+QUEUE_BYTES = 4 * 1024 * 1024  # default byte budget of a packet queue
+DROP_POLICIES = ("tail", "head", "codel")
+CODEL_TARGET = 5_000_000  # ns, acceptable standing queue delay (RFC 8289)
+CODEL_INTERVAL = 100_000_000  # ns, time the delay may stay above the target before dropping
+CODEL_MTU = 1500  # a queue holding at most this many bytes is never considered standing
+
+
+class PacketQueue:
+    """
+    A thread-safe FIFO of packets bounded by a byte budget, replacing `queue.Queue` between the
+    tunnel and the sockets so that a slow or absent peer cannot grow the memory and the queueing
+    delay without limit.
+
+    Each packet is stored with its enqueue time; `get` returns `(enqueue time in ns, packet)`.
+    When the budget is exceeded, the drop policy decides which packet is lost:
+        - "tail": the arriving packet is dropped (the queue keeps the oldest packets).
+        - "head": the oldest packets are dropped to make room (the freshest packets are kept,
+          better for interactive traffic); a packet larger than the whole budget is dropped.
+        - "codel": tail drop on the budget, and on dequeue the CoDel control law (RFC 8289)
+          drops packets while their sojourn time stays above `CODEL_TARGET` for more than
+          `CODEL_INTERVAL`, keeping the queueing delay low whatever the budget.
+
+    `None` is accepted whatever the budget, so that it can be used as a stop sentinel.
+    Every dropped packet is passed to `release` (e.g. `BufferPool.release`, to reuse its buffer).
+
+    Attributes:
+        max_bytes (int): The byte budget.
+        policy (str): The drop policy ("tail", "head" or "codel").
+        counters (Optional[Counters]): Endpoint counters, whose `drops` is incremented as well.
+        bytes (int): Bytes currently queued.
+        dropped_packets (int): Packets dropped by this queue.
+        dropped_bytes (int): Bytes dropped by this queue.
+        release (Optional[Callable[[bytes], None]]): Called with each dropped packet.
+    """
+
+    def __init__(self, max_bytes: int = QUEUE_BYTES, policy: str = "tail", counters: Optional[Counters] = None, release: Optional[Callable[[bytes], None]] = None) -> None:
+        """
+        Initializes an empty queue.
+
+        Args:
+            max_bytes (int): The byte budget.
+            policy (str): The drop policy ("tail", "head" or "codel").
+            counters (Optional[Counters]): Endpoint counters to account the drops in.
+            release (Optional[Callable[[bytes], None]]): Called with each dropped packet.
+
+        Raises:
+            ValueError: If the policy is unknown.
+        """
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.counters = counters
+        self.release = release
+        self.items = deque()
+        self.bytes = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.not_empty = threading.Condition(threading.Lock())
+
+        # CoDel state
+        self.first_above_time = 0
+        self.drop_next = 0
+        self.drop_count = 0
+        self.last_count = 0
+        self.dropping = False
+
+    def qsize(self) -> int:
+        """
+        Returns the number of queued packets.
+
+        Returns:
+            int: The number of packets.
+        """
+        return len(self.items)
+
+    def put(self, packet: Optional[bytes]) -> bool:
+        """
+        Queues a packet, unless the drop policy drops it.
+
+        Args:
+            packet (Optional[bytes]): The packet (or `None`, the stop sentinel).
+
+        Returns:
+            bool: False if the packet was dropped.
+        """
+        if packet is None:
+            # The sentinel takes no room: nothing is dropped for it, even over the budget
+            with self.not_empty:
+                self.items.append((time.perf_counter_ns(), None, 0))
+                self.not_empty.notify()
+            return True
+        size = len(packet)
+        with self.not_empty:
+            if self.bytes + size > self.max_bytes:
+                # Emptying the queue cannot make room for a packet larger than the whole budget
+                if self.policy != "head" or size > self.max_bytes:
+                    self._dropped((0, packet, size))
+                    return False
+                while self.items and self.bytes + size > self.max_bytes:
+                    self._dropped(self._pop())
+            self.items.append((time.perf_counter_ns(), packet, size))
+            self.bytes += size
+            self.not_empty.notify()
+        return True
+
+    def get(self, block: bool = True) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the oldest packet, waiting for one if the queue is empty.
+
+        Args:
+            block (bool): Whether to wait for a packet.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If `block` is False and the queue is empty.
+        """
+        with self.not_empty:
+            while True:
+                if not self.items:
+                    if not block:
+                        raise Empty
+                    self.not_empty.wait()
+                    continue
+                item = self._codel_pop() if self.policy == "codel" else self._pop()
+                if item is not None:
+                    return item[0], item[1]
+
+    def get_nowait(self) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the oldest packet without waiting.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If the queue is empty.
+        """
+        return self.get(False)
+
+    def _pop(self) -> tuple:
+        """
+        Removes the oldest item (the lock is held by the caller).
+
+        Returns:
+            tuple: The (enqueue time, packet, size) item.
+        """
+        item = self.items.popleft()
+        self.bytes -= item[2]
+        return item
+
+    def _dropped(self, item: tuple) -> None:
+        """
+        Accounts for a dropped packet and releases it.
+
+        Args:
+            item (tuple): The (enqueue time, packet, size) item of the packet.
+        """
+        self.dropped_packets += 1
+        self.dropped_bytes += item[2]
+        if self.counters is not None:
+            self.counters.drops += 1
+        if self.release is not None:
+            self.release(item[1])
+
+    def _codel_ok_to_drop(self, item: tuple, now: int) -> bool:
+        """
+        Tells whether the queue has stayed above the target delay for a whole interval
+        (`dodequeue` of RFC 8289).
+
+        Args:
+            item (tuple): The item just dequeued.
+            now (int): The current time in ns.
+
+        Returns:
+            bool: True if the item may be dropped.
+        """
+        if item[1] is None or now - item[0] < CODEL_TARGET or self.bytes <= CODEL_MTU:
+            self.first_above_time = 0
+            return False
+        if self.first_above_time == 0:
+            self.first_above_time = now + CODEL_INTERVAL
+            return False
+        return now >= self.first_above_time
+
+    def _codel_pop(self) -> Optional[tuple]:
+        """
+        Dequeues an item applying the CoDel control law: in the dropping state, packets are
+        dropped at intervals shrinking with the square root of the number of drops.
+
+        Returns:
+            Optional[tuple]: The item to deliver, or None if every queued packet was dropped.
+        """
+        now = time.perf_counter_ns()
+        item = self._pop()
+        ok_to_drop = self._codel_ok_to_drop(item, now)
+        if self.dropping:
+            if not ok_to_drop:
+                self.dropping = False
+            while self.dropping and now >= self.drop_next:
+                self._dropped(item)
+                self.drop_count += 1
+                if not self.items:
+                    self.dropping = False
+                    self.first_above_time = 0
+                    return None
+                item = self._pop()
+                if not self._codel_ok_to_drop(item, now):
+                    self.dropping = False
+                else:
+                    self.drop_next += int(CODEL_INTERVAL / math.sqrt(self.drop_count))
+        elif ok_to_drop:
+            self._dropped(item)
+            item = None
+            if self.items:
+                item = self._pop()
+                self._codel_ok_to_drop(item, now)
+            self.dropping = True
+            # Resume near the previous drop rate if the last dropping state was recent
+            delta = self.drop_count - self.last_count
+            self.drop_count = delta if delta > 1 and now - self.drop_next < 16 * CODEL_INTERVAL else 1
+            self.drop_next = now + int(CODEL_INTERVAL / math.sqrt(self.drop_count))
+            self.last_count = self.drop_count
+        return item
@@ -0,0 +1,204 @@
+import fcntl
+import socket
+import struct
+import time
+import logging
+from typing import Optional
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+IPV6_MIN_MTU = 1280  # every IPv6 link must carry packets of this size (RFC 8200)
+DEFAULT_LINK_MTU = 1500  # used when the path to the peer cannot be probed
+PMTU_INTERVAL = 10.0  # seconds between two probes of the path MTU
+PTB_RATE = 100  # Packet Too Big messages sent per second at most (RFC 4443, 2.4 f)
+
+# Bytes added in front of each IPv6 packet on the path to the peer: outer IPv4 header,
+# carrier header (TCP with timestamps, UDP) and the encapsulation header sent in the payload
+CARRIER_OVERHEAD = {"raw": 20, "udp": 20 + 8 + 20, "tcp": 20 + 32 + 20}
+
+# Linux constants missing from the socket module
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2  # set DF, never fragment locally (EMSGSIZE instead)
+IP_MTU = 14
+TUNGETIFF = 0x800454d2
+SIOCSIFMTU = 0x8922
+
+ICMPV6 = 58
+ICMPV6_PACKET_TOO_BIG = 2
+
+
+class PathMTU:
+    """
+    The largest IPv6 packet that can go through the tunnel to a peer without being fragmented
+    or split: the path MTU to the peer minus the overhead of the transport.
+
+    The path MTU is read from the kernel (`IP_MTU` of a UDP socket connected to the peer with
+    `IP_PMTUDISC_DO`): it is the MTU of the egress link, lowered by the "fragmentation needed"
+    ICMP messages received for the peer. It is never below the IPv6 minimum of 1280 bytes:
+    a path too narrow for that is still used, fragmenting the carrier.
+
+    Attributes:
+        dst_address (str): IPv4 address of the peer.
+        overhead (int): Bytes added to each packet by the transport.
+        fixed (bool): True if the MTU was given (never probed).
+        link_mtu (int): Last path MTU read from the kernel.
+        mtu (int): Largest IPv6 packet sent to the peer.
+    """
+
+    def __init__(self, dst_address: str, proto: str, mtu: Optional[int] = None, extra_overhead: int = 0) -> None:
+        """
+        Initializes the MTU, probing the path unless it is given.
+
+        Args:
+            dst_address (str): IPv4 address of the peer.
+            proto (str): Transport to the peer ('tcp', 'udp' or 'raw').
+            mtu (Optional[int]): Fixed MTU of the tunnel, None to follow the path.
+            extra_overhead (int): Bytes the endpoint may add in front of the IPv6 header (the
+                                  prefix of a full header with header compression).
+        """
+        self.dst_address = dst_address
+        self.overhead = CARRIER_OVERHEAD[proto] + extra_overhead
+        self.fixed = mtu is not None
+        self.link_mtu = DEFAULT_LINK_MTU
+        self.mtu = mtu if self.fixed else 0
+        self.refresh()
+
+    def probe(self) -> int:
+        """
+        Reads the path MTU to the peer from the routing cache of the kernel.
+
+        Returns:
+            int: The path MTU (`DEFAULT_LINK_MTU` if there is no route to the peer).
+        """
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            probe.connect((self.dst_address, 9))
+            return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except OSError as e:
+            logger.warning(f"Cannot probe the path MTU to {self.dst_address}: {e}")
+            return DEFAULT_LINK_MTU
+        finally:
+            probe.close()
+
+    def refresh(self) -> bool:
+        """
+        Probes the path again and updates the MTU.
+
+        Returns:
+            bool: True if the MTU changed.
+        """
+        if self.fixed:
+            return False
+        self.link_mtu = self.probe()
+        mtu = self.link_mtu - self.overhead
+        if mtu < IPV6_MIN_MTU:
+            logger.warning(f"Path MTU {self.link_mtu} to {self.dst_address} too small for IPv6: the carrier will be fragmented")
+            mtu = IPV6_MIN_MTU
+        changed = mtu != self.mtu
+        self.mtu = mtu
+        return changed
+
+
+class PacketTooBig:
+    """
+    Builds the ICMPv6 Packet Too Big messages (RFC 4443, 3.2) answering the packets that do not
+    fit the tunnel, to be written back into the TUN device: the sender (local socket or host
+    behind the endpoint) then lowers its path MTU instead of seeing its packets vanish.
+
+    No message answers an ICMPv6 error or a packet from an unspecified or multicast source,
+    and at most `rate` messages are built per second (token bucket).
+
+    Attributes:
+        source (bytes): IPv6 address the messages come from (the address of the tunnel).
+        rate (int): Messages per second.
+        tokens (float): Messages that can be sent right now.
+        last (float): Time of the last refill of the bucket.
+    """
+    _header = struct.Struct("!IHBB16s16sBBHI")
+
+    def __init__(self, source: str, rate: int = PTB_RATE) -> None:
+        """
+        Initializes the builder.
+
+        Args:
+            source (str): IPv6 address of the tunnel (a "/length" suffix is ignored).
+            rate (int): Messages per second.
+        """
+        self.source = socket.inet_pton(socket.AF_INET6, source.split("/")[0])
+        self.rate = rate
+        self.tokens = float(rate)
+        self.last = time.monotonic()
+
+    def build(self, ipv6_packet: bytes, mtu: int) -> Optional[bytes]:
+        """
+        Builds the answer to a packet too big for the tunnel.
+
+        Args:
+            ipv6_packet (bytes): The packet that does not fit.
+            mtu (int): The MTU of the tunnel, announced to the sender.
+
+        Returns:
+            Optional[bytes]: The ICMPv6 message, or None if no message must be sent.
+        """
+        if len(ipv6_packet) < 48 or ipv6_packet[0] >> 4 != 6:
+            return None
+        sender = bytes(ipv6_packet[8:24])
+        if sender[0] == 0xFF or not any(sender):
+            return None
+        if ipv6_packet[6] == ICMPV6 and ipv6_packet[40] < 128:
+            return None
+        now = time.monotonic()
+        self.tokens = min(float(self.rate), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return None
+        self.tokens -= 1
+
+        # As much of the invoking packet as fits in a minimum MTU packet
+        body = bytes(ipv6_packet[:IPV6_MIN_MTU - 48])
+        length = 8 + len(body)
+        pseudo_header = self.source + sender + struct.pack("!I3xB", length, ICMPV6)
+        checksum = internet_checksum(pseudo_header + struct.pack("!BBHI", ICMPV6_PACKET_TOO_BIG, 0, 0, mtu) + body)
+        return self._header.pack(6 << 28, length, ICMPV6, 64, self.source, sender,
+                                 ICMPV6_PACKET_TOO_BIG, 0, checksum, mtu) + body
+
+
+def internet_checksum(data: bytes) -> int:
+    """
+    Computes the Internet checksum (RFC 1071) of a buffer.
+
+    The one's complement sum of the 16-bit words is the remainder of the buffer, read as one
+    big-endian integer, modulo 0xFFFF (2**16 = 1 modulo 0xFFFF): a single C-level operation
+    instead of a Python loop over the words.
+
+    Args:
+        data (bytes): The data covered by the checksum.
+
+    Returns:
+        int: The checksum.
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    return ~(int.from_bytes(data, "big") % 0xFFFF) & 0xFFFF
+
+
+def set_device_mtu(tun_fd: int, mtu: int) -> None:
+    """
+    Changes the MTU of the TUN device behind a file descriptor (its name is read with `TUNGETIFF`).
+
+    Args:
+        tun_fd (int): A file descriptor of the TUN device.
+        mtu (int): The new MTU.
+
+    Raises:
+        OSError: If the device cannot be identified or changed.
+    """
+    name = fcntl.ioctl(tun_fd, TUNGETIFF, bytes(18))[:16]
+    control = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        fcntl.ioctl(control, SIOCSIFMTU, struct.pack("16si12x", name, mtu))
+    finally:
+        control.close()
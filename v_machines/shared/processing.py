@@ -1,23 +1,49 @@
 import socket
+import struct
+from typing import Optional
+
+from compression import COMPRESSED_PROTOCOL, FULL_HEADER, IPV6_HEADER_LEN, HeaderCompressor, HeaderDecompressor
+from qos import traffic_class
 
 class Processing:
     """
     Handles the encapsulation and decapsulation of IPv6 packets within IPv4 packets.
 
+    The TOS of the IPv4 header is the traffic class of the IPv6 packet: its DSCP is copied,
+    and so is its ECN field (the normal mode of RFC 6040, section 4.1).
+
+    With `compression`, the IPv6 header of the packets can be compressed (see
+    `HeaderCompressor`): such packets have their own IPv4 protocol, `COMPRESSED_PROTOCOL`.
+    Decapsulation expands them whatever the setting of this endpoint.
+
     Attributes:
         ipv4_src (str): The source IPv4 address.
         ipv4_dst (str): The destination IPv4 address.
+        offset (int): Where the IPv6 header starts in the packets (after a virtio-net header).
+        compression (int): Flow contexts of each compressor (0: the headers are not compressed).
+        refresh (bool): The compressors send the whole headers again (datagram carriers).
     """
-    def __init__(self, ipv4_src:str, ipv4_dst:str):
+    def __init__(self, ipv4_src:str, ipv4_dst:str, dont_fragment: bool = False, offset: int = 0, compression: int = 0, refresh: bool = False):
         """
         Initializes the Processing class with source and destination IPv4 addresses.
 
         Args:
             ipv4_src (str): The source IPv4 address.
             ipv4_dst (str): The destination IPv4 address.
+            dont_fragment (bool): Set the DF flag of the headers (when they go onto the wire).
+            offset (int): Where the IPv6 header starts in the packets.
+            compression (int): Flow contexts of each compressor (0: no header compression).
+            refresh (bool): The compressors send the whole headers again, for a carrier that
+                            loses packets.
         """
         self.ipv4_src = ipv4_src
         self.ipv4_dst = ipv4_dst
+        self.offset = offset
+        self.compression = compression
+        self.refresh = refresh
+        # Addresses, TTL and protocol never change for a tunnel: the header is built once
+        self.header = IPv4HeaderTemplate(ipv4_src, ipv4_dst, dont_fragment)
+        self.compressed_header = IPv4HeaderTemplate(ipv4_src, ipv4_dst, dont_fragment, COMPRESSED_PROTOCOL)
 
     def encapsulate(self, ipv6_packet: bytes):
         """
@@ -29,19 +55,77 @@ class Processing:
         Returns:
             bytes: The encapsulated packet with an IPv4 header.
         """
-        ipv4_header = IPv4Header(self.ipv4_src, self.ipv4_dst)
-        return ipv4_header.build() + ipv6_packet
+        return self.encapsulation_header(ipv6_packet) + ipv6_packet
+
+    def encapsulation_header(self, ipv6_packet: bytes, packet_id: int = None) -> bytes:
+        """
+        Builds only the IPv4 header that encapsulates an IPv6 packet, so that header and
+        payload can be sent as separate buffers without concatenating them.
+
+        Args:
+            ipv6_packet (bytes): The raw IPv6 packet to be encapsulated.
+            packet_id (int): The identification field (the template's ID by default), e.g. the
+                             sequence number of a packet striped over several connections.
+
+        Returns:
+            bytes: The 20-byte IPv4 header to put in front of the packet.
+        """
+        # The total length is what lets the receiver split the TCP stream into packets
+        return self.header.build(20 + len(ipv6_packet), packet_id, traffic_class(ipv6_packet, self.offset))
+
+    def compressor(self, counters=None) -> Optional[HeaderCompressor]:
+        """
+        Creates the header compressor of a connection (or of a datagram socket).
+
+        Args:
+            counters (Optional[Counters]): Counters of the endpoint.
+
+        Returns:
+            Optional[HeaderCompressor]: The compressor, None without header compression.
+        """
+        if not self.compression:
+            return None
+        return HeaderCompressor(self.compression, self.refresh, counters)
 
-    def decapsulate(self, encapsulated_packet: bytes):
+    def compressed_buffers(self, ipv6_packet: bytes, compressor: HeaderCompressor, packet_id: int = None) -> Optional[list]:
+        """
+        Builds the buffers of an encapsulated packet whose IPv6 header is compressed: the IPv4
+        header, the prefix of the compressor, then the whole packet (context installed) or its
+        payload. The packet is not copied.
+
+        Args:
+            ipv6_packet (bytes): The raw IPv6 packet to be encapsulated.
+            compressor (HeaderCompressor): The compressor of the connection.
+            packet_id (int): The identification field (the template's ID by default).
+
+        Returns:
+            Optional[list]: The buffers to send, or None if the packet cannot be compressed
+                            (it is sent with `encapsulation_header`).
+        """
+        prefix = compressor.compress(ipv6_packet)
+        if prefix is None:
+            return None
+        payload = ipv6_packet if prefix[0] & FULL_HEADER else memoryview(ipv6_packet)[IPV6_HEADER_LEN:]
+        header = self.compressed_header.build(20 + len(prefix) + len(payload), packet_id, traffic_class(ipv6_packet))
+        return [header, prefix, payload]
+
+    def decapsulate(self, encapsulated_packet: bytes, decompressor: HeaderDecompressor = None):
         """
         Decapsulates an IPv6 packet from an IPv4 packet.
 
         Args:
             encapsulated_packet (bytes): The encapsulated IPv4 packet containing the IPv6 payload.
+            decompressor (HeaderDecompressor): Expands the compressed headers received on the
+                                               connection (or datagram socket), if any.
 
         Returns:
-            bytes: The raw IPv6 packet extracted from the IPv4 packet.
+            bytes: The raw IPv6 packet extracted from the IPv4 packet (a `memoryview` when
+                   the encapsulated packet is one, so that no copy is made), or None if its
+                   compressed header cannot be expanded.
         """
+        if decompressor is not None and encapsulated_packet[9] == COMPRESSED_PROTOCOL:
+            # The TOS of the header is the traffic class of the packet
+            return decompressor.decompress(encapsulated_packet[20:], encapsulated_packet[1])
         # IPv4 header is 20 bytes for a standard header
         return encapsulated_packet[20:]
     
@@ -56,7 +140,7 @@ class IPv4Header:
         version (int): The IP version (default is 4 for IPv4).
         ihl (int): Internet Header Length (default is 5 for a standard header).
         tos (int): Type of Service (default is 0).
-        total_length (int): Total packet length (set to 0; kernel sets this for raw sockets).
+        total_length (int): Total packet length (0 by default; set by `Processing.encapsulate`).
         id (int): Packet ID (default is 54321).
         flags_offset (int): Flags and fragment offset (default is 0).
         ttl (int): Time to Live (default is 64).
@@ -76,7 +160,7 @@ class IPv4Header:
         self.version = 4
         self.ihl = 5
         self.tos = 0
-        self.total_length = 0  # Kernel sets this for raw sockets
+        self.total_length = 0  # Set by the encapsulation, needed to frame the TCP stream
         self.id = 54321
         self.flags_offset = 0
         self.ttl = 64
@@ -139,3 +223,99 @@ class IPv4Header:
                 checksum = (checksum & 0xFFFF) + (checksum >> 16)
 
         return ~checksum & 0xFFFF
+
+
+class IPv4HeaderTemplate:
+    """
+    A precomputed IPv4 header for a given tunnel, producing the same bytes as `IPv4Header.build`.
+
+    The 20-byte header is built once with `IPv4Header`. For every packet only the TOS, total
+    length and identification fields are patched, and the checksum is updated incrementally
+    (RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m')) instead of being recomputed over the whole header.
+
+    Attributes:
+        template (bytes): The header built by `IPv4Header` (TOS 0, total length 0, default ID).
+        default_id (int): The identification field of the template.
+        base_sum (int): ~HC + ~m for the version/TOS, total length and ID words of the template, folded.
+    """
+    _layout = struct.Struct("!BBHH4sH8s")
+
+    def __init__(self, src_ip: str, dst_ip: str, dont_fragment: bool = False, protocol: int = 41):
+        """
+        Builds the header template for the given source and destination addresses.
+
+        Args:
+            src_ip (str): The source IPv4 address.
+            dst_ip (str): The destination IPv4 address.
+            dont_fragment (bool): Set the DF flag (routers drop the packet and report the
+                                  path MTU instead of fragmenting it).
+            protocol (int): The protocol field (41: IPv6).
+        """
+        header = IPv4Header(src_ip, dst_ip)
+        header.protocol = protocol
+        if dont_fragment:
+            header.flags_offset = 0x4000
+        self.template = header.build()
+        self.default_id = header.id
+        self._ver_ihl = self.template[0]
+        self._word0 = self._ver_ihl << 8
+        self._flags_ttl_proto = self.template[6:10]
+        self._addresses = self.template[12:20]
+        total = (~header.checksum & 0xFFFF) + (~self._word0 & 0xFFFF) + (~header.total_length & 0xFFFF) + (~header.id & 0xFFFF)
+        self.base_sum = self._fold(total)
+
+    @staticmethod
+    def _fold(value: int) -> int:
+        """
+        Folds a sum into 16 bits with end-around carry (one's complement addition).
+
+        Args:
+            value (int): The sum to fold.
+
+        Returns:
+            int: The folded 16-bit value.
+        """
+        while value > 0xFFFF:
+            value = (value & 0xFFFF) + (value >> 16)
+        return value
+
+    def build(self, total_length: int, packet_id: int = None, tos: int = 0) -> bytes:
+        """
+        Builds the header of one packet from the template.
+
+        Args:
+            total_length (int): The total length of the IPv4 packet (header included).
+            packet_id (int): The identification field (the template's ID by default).
+            tos (int): The TOS field (DSCP and ECN).
+
+        Returns:
+            bytes: The 20-byte IPv4 header with a valid checksum.
+        """
+        if packet_id is None:
+            packet_id = self.default_id
+        checksum = self.base_sum + (self._word0 | tos) + total_length + packet_id
+        # Two folds are enough: the sum of four 16-bit words is below 2**18
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        return self._layout.pack(self._ver_ihl, tos, total_length, packet_id,
+                                 self._flags_ttl_proto, ~checksum & 0xFFFF, self._addresses)
+
+    def build_into(self, buffer, offset: int, total_length: int, packet_id: int = None, tos: int = 0) -> None:
+        """
+        Writes the header of one packet into a buffer, e.g. in the headroom left in front of
+        the packet by a `BufferPool`, so that header and packet are sent as one buffer.
+
+        Args:
+            buffer (bytearray | memoryview): The writable buffer.
+            offset (int): Where the header starts in the buffer.
+            total_length (int): The total length of the IPv4 packet (header included).
+            packet_id (int): The identification field (the template's ID by default).
+            tos (int): The TOS field (DSCP and ECN).
+        """
+        if packet_id is None:
+            packet_id = self.default_id
+        checksum = self.base_sum + (self._word0 | tos) + total_length + packet_id
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+        self._layout.pack_into(buffer, offset, self._ver_ihl, tos, total_length, packet_id,
+                               self._flags_ttl_proto, ~checksum & 0xFFFF, self._addresses)
@@ -0,0 +1,95 @@
+from typing import Union
+
+# ECN codepoints, the two low bits of the IPv4 TOS and of the IPv6 traffic class (RFC 3168)
+ECN_NOT_ECT = 0
+ECN_ECT1 = 1
+ECN_ECT0 = 2
+ECN_CE = 3
+
+# Strict-priority bands, 0 served first (RFC 4594 service classes)
+BAND_REALTIME = 0  # network control (CS6, CS7), telephony (EF, VOICE-ADMIT), signaling (CS5)
+BAND_INTERACTIVE = 1  # multimedia and low-latency data (AF2x-AF4x, CS2-CS4)
+BAND_DEFAULT = 2  # best effort (CS0) and high-throughput data (AF1x)
+BAND_LOW = 3  # lower effort (LE, RFC 8622) and low-priority data (CS1)
+PRIORITY_BANDS = 4
+
+
+def _dscp_band(dscp: int) -> int:
+    """
+    Returns the priority band of a DSCP (unknown codepoints are best effort).
+
+    Args:
+        dscp (int): The DSCP, from 0 to 63.
+
+    Returns:
+        int: The band.
+    """
+    if dscp in (46, 44) or dscp >= 40 and dscp & 7 == 0:
+        return BAND_REALTIME
+    if dscp in (1, 8):
+        return BAND_LOW
+    if 16 <= dscp < 40 and not dscp & 1:
+        return BAND_INTERACTIVE
+    return BAND_DEFAULT
+
+
+DSCP_BANDS = tuple(_dscp_band(dscp) for dscp in range(64))
+
+
+def traffic_class(ipv6_packet: Union[bytes, memoryview], offset: int = 0) -> int:
+    """
+    Returns the traffic class of an IPv6 packet (DSCP in the 6 high bits, ECN in the 2 low ones),
+    the value the TOS of its IPv4 header takes.
+
+    Args:
+        ipv6_packet (Union[bytes, memoryview]): The packet.
+        offset (int): Where the IPv6 header starts (after the virtio-net header in offload mode).
+
+    Returns:
+        int: The traffic class (0 for a packet too short to have one).
+    """
+    if len(ipv6_packet) < offset + 2:
+        return 0
+    return ((ipv6_packet[offset] & 0x0F) << 4) | (ipv6_packet[offset + 1] >> 4)
+
+
+def priority_band(ipv6_packet: Union[bytes, memoryview], offset: int = 0) -> int:
+    """
+    Returns the strict-priority band of an IPv6 packet, from its DSCP.
+
+    Args:
+        ipv6_packet (Union[bytes, memoryview]): The packet.
+        offset (int): Where the IPv6 header starts.
+
+    Returns:
+        int: The band, 0 being served first.
+    """
+    return DSCP_BANDS[traffic_class(ipv6_packet, offset) >> 2]
+
+
+def decapsulate_ecn(outer_tos: int, ipv6_packet: Union[bytearray, memoryview]) -> bool:
+    """
+    Combines the ECN field of the outer IPv4 header with that of the inner packet at
+    decapsulation (RFC 6040, section 4.2), in place. A congestion experienced on the path is
+    carried over to the inner packet, unless the inner transport does not support ECN: the
+    packet is then dropped, as a congested router would have done.
+
+    Args:
+        outer_tos (int): The TOS field of the outer header, as received.
+        ipv6_packet (Union[bytearray, memoryview]): The inner packet (writable).
+
+    Returns:
+        bool: False if the packet must be dropped.
+    """
+    outer = outer_tos & 3
+    if outer == ECN_NOT_ECT or outer == ECN_ECT0 or len(ipv6_packet) < 2:
+        return True
+    inner = (ipv6_packet[1] >> 4) & 3
+    if outer == ECN_CE:
+        if inner == ECN_NOT_ECT:
+            return False
+        ipv6_packet[1] |= ECN_CE << 4
+    elif inner == ECN_ECT0:
+        # ECT(1) on the path (an L4S marking) is kept
+        ipv6_packet[1] ^= (ECN_ECT0 ^ ECN_ECT1) << 4
+    return True
@@ -0,0 +1,174 @@
+import ipaddress
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class RouteTable:
+    """
+    A longest-prefix-match index of IPv6 prefixes, each routed to the IPv4 address of a peer.
+
+    Routes are grouped by prefix length: for each length there is a dict from the masked
+    destination (the `length` high bits of the address, as an integer) to the peer. A lookup
+    tries the lengths present in the table from the longest to the shortest, so it costs at
+    most one shift and one dict probe per distinct prefix length (never more than 129,
+    whatever the number of routes).
+
+    The table is compiled (on the first lookup after a change) into a first-level index on
+    the 16 high bits of the address: each /16 lists only the lengths of the routes inside it,
+    so most lookups probe one or two lengths, and an address outside every route none.
+
+    Attributes:
+        by_length (Dict[int, Dict[int, str]]): Prefix length -> masked prefix -> peer address.
+        lengths (List[int]): The prefix lengths in use, longest first.
+        first_level (Optional[Dict[int, List[int]]]): 16 high bits -> lengths to try, longest
+                                                      first (None until compiled).
+        short_lengths (List[int]): Lengths shorter than 16, tried for any address.
+    """
+    FIRST_LEVEL_BITS = 16
+
+    def __init__(self, routes: Iterable[Tuple[str, str]] = ()) -> None:
+        """
+        Builds the index.
+
+        Args:
+            routes (Iterable[Tuple[str, str]]): (IPv6 prefix, IPv4 peer address) pairs,
+                                               e.g. ("fc00:1234:3::/64", "172.16.2.163").
+        """
+        self.by_length = {}
+        self.lengths = []
+        self.first_level = None
+        self.short_lengths = []
+        for prefix, peer in routes:
+            self.add(prefix, peer)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of routes.
+
+        Returns:
+            int: The number of routes.
+        """
+        return sum(len(entries) for entries in self.by_length.values())
+
+    def add(self, prefix: str, peer: str) -> None:
+        """
+        Adds (or replaces) a route.
+
+        Args:
+            prefix (str): The IPv6 prefix (host bits must be zero), e.g. "fc00:1234:3::/64".
+            peer (str): The IPv4 address of the peer serving it.
+
+        Raises:
+            ValueError: If the prefix or the peer address is invalid.
+        """
+        network = ipaddress.IPv6Network(prefix)
+        ipaddress.IPv4Address(peer)
+        length = network.prefixlen
+        if length not in self.by_length:
+            self.by_length[length] = {}
+            self.lengths = sorted(self.by_length, reverse=True)
+        self.by_length[length][int(network.network_address) >> (128 - length)] = peer
+        self.first_level = None
+
+    def compile(self) -> None:
+        """
+        Builds the first-level index (done by `lookup` after any change of the table).
+        """
+        bits = self.FIRST_LEVEL_BITS
+        self.short_lengths = [length for length in self.lengths if length < bits]
+        first_level = {}
+        for length, entries in self.by_length.items():
+            if length < bits:
+                continue
+            for masked in entries:
+                first_level.setdefault(masked >> (length - bits), set()).add(length)
+        self.first_level = {top: sorted(lengths, reverse=True) + self.short_lengths
+                            for top, lengths in first_level.items()}
+
+    def peers(self) -> List[str]:
+        """
+        Returns the distinct peers of the table.
+
+        Returns:
+            List[str]: The IPv4 addresses of the peers.
+        """
+        return sorted({peer for entries in self.by_length.values() for peer in entries.values()})
+
+    def prefixes(self) -> List[str]:
+        """
+        Returns the prefixes of the table (e.g. to route them to the tunnel).
+
+        Returns:
+            List[str]: The prefixes, in CIDR notation.
+        """
+        return [str(ipaddress.IPv6Network((masked << (128 - length), length)))
+                for length, entries in self.by_length.items() for masked in entries]
+
+    def lookup(self, address: int) -> Optional[str]:
+        """
+        Returns the peer of the longest prefix containing an address.
+
+        Args:
+            address (int): The IPv6 address, as an integer.
+
+        Returns:
+            Optional[str]: The IPv4 address of the peer, or None if no route matches.
+        """
+        if self.first_level is None:
+            self.compile()
+        by_length = self.by_length
+        for length in self.first_level.get(address >> (128 - self.FIRST_LEVEL_BITS), self.short_lengths):
+            peer = by_length[length].get(address >> (128 - length))
+            if peer is not None:
+                return peer
+        return None
+
+    def lookup_packet(self, ipv6_packet: bytes, offset: int = 0) -> Optional[str]:
+        """
+        Returns the peer serving the destination of an IPv6 packet.
+
+        Args:
+            ipv6_packet (bytes): The IPv6 packet (the destination address is at bytes 24-40).
+            offset (int): Where the packet starts in the buffer (after a virtio-net header).
+
+        Returns:
+            Optional[str]: The IPv4 address of the peer, or None if no route matches.
+        """
+        if len(ipv6_packet) < offset + 40:
+            return None
+        return self.lookup(int.from_bytes(ipv6_packet[offset + 24:offset + 40], "big"))
+
+
+def load_routes(path: str) -> RouteTable:
+    """
+    Loads a route table file: one "<IPv6 prefix> <IPv4 peer>" route per line,
+    empty lines and lines starting with '#' are ignored.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        RouteTable: The loaded table.
+
+    Raises:
+        ValueError: If a line is not a valid route.
+    """
+    table = RouteTable()
+    with open(path) as routes_file:
+        for number, line in enumerate(routes_file, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError(f"{path}:{number}: expected '<IPv6 prefix> <IPv4 peer>', got: {line}")
+            try:
+                table.add(fields[0], fields[1])
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: {e}") from e
+    logger.info(f"{len(table)} routes to {len(table.peers())} peers loaded from {path}")
+    return table
@@ -0,0 +1,483 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from queue import Empty
+from typing import Callable, Optional, Tuple, Union
+
+from metrics import Counters
+from packet_queue import PacketQueue, QUEUE_BYTES
+from qos import PRIORITY_BANDS, priority_band
+from striping import flow_hash
+
+SCHEDULERS = ("fifo", "drr", "fq_codel")
+FLOW_TABLE_SIZE = 1024  # flows remembered at most, the least recently used one is evicted beyond
+QUANTUM = 1514  # bytes a flow may send per round (one full-sized packet, as fq_codel)
+OVERFLOW_BATCH = 64  # packets dropped at most from the fattest flow per overflow
+
+
+class Flow:
+    """
+    The state of one inner flow in a `FlowScheduler`.
+
+    The packets are kept in a `PacketQueue` used without its lock (the lock of the scheduler
+    covers every flow): it brings its byte accounting and, for fq_codel, its CoDel state.
+
+    Attributes:
+        queue (PacketQueue): The packets of the flow.
+        deficit (int): Bytes the flow may still send in the current round.
+        active (bool): Whether the flow is in one of the round-robin lists.
+    """
+
+    def __init__(self, policy: str, release: Callable[[bytes], None]) -> None:
+        """
+        Initializes an idle flow.
+
+        Args:
+            policy (str): 'codel' (fq_codel) or 'tail' (drr).
+            release (Callable[[bytes], None]): Called with each packet dropped from the flow.
+        """
+        self.queue = PacketQueue(policy=policy, release=release)
+        self.deficit = 0
+        self.active = False
+
+
+class FlowScheduler:
+    """
+    A byte-bounded queue serving the inner flows fairly instead of in arrival order, so that
+    a bulk transfer through the tunnel does not delay the interactive flows sharing it (SSH,
+    DNS...). Drop-in replacement for `PacketQueue` between the tunnel and the sockets.
+
+    Each packet is classified by the hash of its inner 5-tuple (see `flow_hash`) into the
+    queue of its flow, and the flows are served by deficit round robin (RFC 8290, section
+    4.2): each turn, a flow sends packets as long as its deficit is positive, then gets
+    `quantum` more bytes and goes to the end of the round.
+        - "drr": every flow takes its turn in a single round.
+        - "fq_codel": a flow that starts sending goes into a list of new flows served first
+          (sparse flows such as a ping or a DNS query are sent at once), and each flow has its
+          own CoDel (see `PacketQueue`), so that only the queue of the bulk flows is kept short.
+
+    When the byte budget is exceeded, packets are dropped from the head of the flow holding
+    the most bytes (the bulk flow, not the arriving packet): up to half its bytes at once, so
+    that the scan of the flows is paid once per `OVERFLOW_BATCH` packets at most.
+
+    The flow table remembers at most `max_flows` flows (their deficit and CoDel state stay
+    while they are idle). Beyond, the least recently used idle flow is forgotten, or, if every
+    flow holds packets, the least recently used one is evicted with its packets.
+
+    `None` (the stop sentinel) is accepted whatever the budget and returned before any packet.
+    Every dropped packet is passed to `release`.
+
+    Attributes:
+        max_bytes (int): The byte budget of all the flows.
+        discipline (str): "drr" or "fq_codel".
+        counters (Optional[Counters]): Endpoint counters, whose `drops` is incremented as well.
+        offset (int): Where the IPv6 header starts in the packets (after a virtio-net header).
+        max_flows (int): Size of the flow table.
+        quantum (int): Bytes added to the deficit of a flow at each turn.
+        flows (OrderedDict): Flow hash -> `Flow`, least recently used first.
+        bytes (int): Bytes currently queued.
+        dropped_packets (int): Packets dropped (budget, CoDel or eviction).
+        dropped_bytes (int): Bytes dropped.
+        evicted_flows (int): Flows forgotten to make room in the flow table.
+        release (Optional[Callable[[bytes], None]]): Called with each dropped packet.
+    """
+
+    def __init__(self, max_bytes: int = QUEUE_BYTES, discipline: str = "fq_codel", counters: Optional[Counters] = None, release: Optional[Callable[[bytes], None]] = None, offset: int = 0, max_flows: int = FLOW_TABLE_SIZE, quantum: int = QUANTUM) -> None:
+        """
+        Initializes an empty scheduler.
+
+        Args:
+            max_bytes (int): The byte budget of all the flows.
+            discipline (str): "drr" or "fq_codel".
+            counters (Optional[Counters]): Endpoint counters to account the drops in.
+            release (Optional[Callable[[bytes], None]]): Called with each dropped packet.
+            offset (int): Where the IPv6 header starts in the packets.
+            max_flows (int): Size of the flow table.
+            quantum (int): Bytes added to the deficit of a flow at each turn.
+
+        Raises:
+            ValueError: If the discipline is unknown.
+        """
+        if discipline not in ("drr", "fq_codel"):
+            raise ValueError(f"Unknown flow scheduler: {discipline}")
+        self.max_bytes = max_bytes
+        self.discipline = discipline
+        self.counters = counters
+        self.release = release
+        self.offset = offset
+        self.max_flows = max_flows
+        self.quantum = quantum
+        self.flows = OrderedDict()
+        self.new_flows = deque()
+        self.old_flows = deque()
+        self.control = deque()
+        self.bytes = 0
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.evicted_flows = 0
+        self.not_empty = threading.Condition(threading.Lock())
+        self._policy = "codel" if discipline == "fq_codel" else "tail"
+
+    def qsize(self) -> int:
+        """
+        Returns the number of queued packets.
+
+        Returns:
+            int: The number of packets of every flow.
+        """
+        with self.not_empty:
+            return sum(flow.queue.qsize() for flow in self.flows.values()) + len(self.control)
+
+    def put(self, packet: Optional[bytes]) -> bool:
+        """
+        Queues a packet in the queue of its flow, then makes room if the budget is exceeded.
+
+        Args:
+            packet (Optional[bytes]): The packet (or `None`, the stop sentinel).
+
+        Returns:
+            bool: False if the packet was dropped.
+        """
+        if packet is None:
+            with self.not_empty:
+                self.control.append((time.perf_counter_ns(), None))
+                self.not_empty.notify()
+            return True
+        size = len(packet)
+        key = flow_hash(packet, self.offset)
+        with self.not_empty:
+            flow = self.flows.get(key)
+            if flow is None:
+                flow = self._add_flow(key)
+            else:
+                self.flows.move_to_end(key)
+            flow.queue.items.append((time.perf_counter_ns(), packet, size))
+            flow.queue.bytes += size
+            self.bytes += size
+            if not flow.active:
+                flow.active = True
+                flow.deficit = self.quantum
+                (self.new_flows if self.discipline == "fq_codel" else self.old_flows).append(flow)
+            accepted = True
+            if self.bytes > self.max_bytes:
+                accepted = self._overflow(packet)
+            self.not_empty.notify()
+        return accepted
+
+    def get(self, block: bool = True) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the next packet of the round, waiting for one if every flow is empty.
+
+        Args:
+            block (bool): Whether to wait for a packet.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If `block` is False and no packet is queued.
+        """
+        with self.not_empty:
+            while True:
+                if self.control:
+                    return self.control.popleft()
+                flows = self.new_flows or self.old_flows
+                if not flows:
+                    if not block:
+                        raise Empty
+                    self.not_empty.wait()
+                    continue
+                flow = flows[0]
+                if flow.deficit <= 0:
+                    # Turn over: more bytes for the next round
+                    flow.deficit += self.quantum
+                    flows.popleft()
+                    self.old_flows.append(flow)
+                    continue
+                item = self._dequeue(flow)
+                if item is None:
+                    flows.popleft()
+                    if flows is self.new_flows and self.old_flows:
+                        # A flow emptied by a burst still waits for a round: sparse flows only
+                        # get ahead of the others once
+                        self.old_flows.append(flow)
+                    else:
+                        flow.active = False
+                    continue
+                flow.deficit -= item[2]
+                return item[0], item[1]
+
+    def get_nowait(self) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the next packet without waiting.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If no packet is queued.
+        """
+        return self.get(False)
+
+    def _dequeue(self, flow: Flow) -> Optional[tuple]:
+        """
+        Removes the next item of a flow, through its CoDel for fq_codel (the lock is held).
+
+        Args:
+            flow (Flow): The flow.
+
+        Returns:
+            Optional[tuple]: The (enqueue time, packet, size) item, or None if the flow is empty.
+        """
+        queue = flow.queue
+        if not queue.items:
+            return None
+        before = queue.bytes
+        item = queue._codel_pop() if self._policy == "codel" else queue._pop()
+        self.bytes -= before - queue.bytes
+        return item
+
+    def _add_flow(self, key: int) -> Flow:
+        """
+        Adds a flow to the table, forgetting the least recently used one if it is full (the
+        lock is held).
+
+        Args:
+            key (int): The flow hash.
+
+        Returns:
+            Flow: The new flow.
+        """
+        if len(self.flows) >= self.max_flows:
+            victim = next((candidate for candidate, flow in self.flows.items() if not flow.active), None)
+            if victim is None:
+                victim = next(iter(self.flows))
+            flow = self.flows.pop(victim)
+            self.evicted_flows += 1
+            if flow.active:
+                while flow.queue.items:
+                    item = flow.queue._pop()
+                    self.bytes -= item[2]
+                    flow.queue._dropped(item)
+                (self.new_flows if flow in self.new_flows else self.old_flows).remove(flow)
+        flow = Flow(self._policy, self._drop)
+        self.flows[key] = flow
+        return flow
+
+    def _overflow(self, packet: bytes) -> bool:
+        """
+        Drops packets from the head of the fattest flow until the budget is met and half of
+        its bytes are gone (the lock is held).
+
+        Args:
+            packet (bytes): The packet just queued.
+
+        Returns:
+            bool: False if that packet was among the dropped ones.
+        """
+        accepted = True
+        while self.bytes > self.max_bytes:
+            queue = max(self.flows.values(), key=lambda flow: flow.queue.bytes).queue
+            threshold = queue.bytes // 2
+            dropped = 0
+            while queue.items and dropped < OVERFLOW_BATCH and (self.bytes > self.max_bytes or queue.bytes > threshold):
+                item = queue._pop()
+                self.bytes -= item[2]
+                dropped += 1
+                if item[1] is packet:
+                    accepted = False
+                queue._dropped(item)
+        return accepted
+
+    def _drop(self, packet: bytes) -> None:
+        """
+        Accounts for a packet dropped from a flow and releases it.
+
+        Args:
+            packet (bytes): The packet.
+        """
+        self.dropped_packets += 1
+        self.dropped_bytes += len(packet)
+        if self.counters is not None:
+            self.counters.drops += 1
+        if self.release is not None:
+            self.release(packet)
+
+
+class PriorityQueues:
+    """
+    Strict-priority bands in front of the sockets: each packet goes to the band of its DSCP
+    (see `qos.priority_band`), and a band is only served when every band before it is empty,
+    so that telephony and interactive traffic get ahead of bulk transfers under congestion.
+    Drop-in replacement for `PacketQueue`.
+
+    Each band is a queue of its own (a `PacketQueue` or a `FlowScheduler`, see
+    `egress_queue`) with its own byte budget: a full bulk band never makes room by dropping
+    the packets of a more urgent one. A band holding the traffic of a greedy sender starves
+    the bands after it; the marking is trusted, as in any DiffServ domain edge-to-edge.
+
+    `None` (the stop sentinel) is returned before any packet.
+
+    Attributes:
+        bands (list): The queue of each band, the first served first.
+        offset (int): Where the IPv6 header starts in the packets (after a virtio-net header).
+    """
+
+    def __init__(self, bands: list, offset: int = 0) -> None:
+        """
+        Initializes the priority queues over empty bands.
+
+        Args:
+            bands (list): The queue of each band (`PRIORITY_BANDS` of them).
+            offset (int): Where the IPv6 header starts in the packets.
+        """
+        self.bands = bands
+        self.offset = offset
+        self.control = deque()
+        self.not_empty = threading.Condition(threading.Lock())
+
+    @property
+    def bytes(self) -> int:
+        """
+        Bytes currently queued in every band.
+        """
+        return sum(band.bytes for band in self.bands)
+
+    @property
+    def dropped_packets(self) -> int:
+        """
+        Packets dropped by every band.
+        """
+        return sum(band.dropped_packets for band in self.bands)
+
+    @property
+    def dropped_bytes(self) -> int:
+        """
+        Bytes dropped by every band.
+        """
+        return sum(band.dropped_bytes for band in self.bands)
+
+    @property
+    def flows(self) -> list:
+        """
+        The flows of every band (bands of `FlowScheduler` only).
+        """
+        return [flow for band in self.bands for flow in list(band.flows.values())]
+
+    @property
+    def evicted_flows(self) -> int:
+        """
+        Flows evicted by every band (bands of `FlowScheduler` only).
+        """
+        return sum(band.evicted_flows for band in self.bands)
+
+    @property
+    def max_bytes(self) -> int:
+        """
+        The byte budget of each band.
+        """
+        return self.bands[0].max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int) -> None:
+        for band in self.bands:
+            band.max_bytes = max_bytes
+
+    def qsize(self) -> int:
+        """
+        Returns the number of queued packets.
+
+        Returns:
+            int: The number of packets of every band.
+        """
+        return sum(band.qsize() for band in self.bands) + len(self.control)
+
+    def put(self, packet: Optional[bytes]) -> bool:
+        """
+        Queues a packet in the band of its DSCP.
+
+        Args:
+            packet (Optional[bytes]): The packet (or `None`, the stop sentinel).
+
+        Returns:
+            bool: False if the packet was dropped.
+        """
+        if packet is None:
+            accepted = True
+            self.control.append((time.perf_counter_ns(), None))
+        else:
+            accepted = self.bands[priority_band(packet, self.offset)].put(packet)
+        # A getter checks the bands under this lock: the notification cannot be missed
+        with self.not_empty:
+            self.not_empty.notify()
+        return accepted
+
+    def get(self, block: bool = True) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the next packet of the first band that has one, waiting for one
+        if every band is empty.
+
+        Args:
+            block (bool): Whether to wait for a packet.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If `block` is False and no packet is queued.
+        """
+        with self.not_empty:
+            while True:
+                if self.control:
+                    return self.control.popleft()
+                for band in self.bands:
+                    # Packets are never empty: no byte means no packet, without taking its lock
+                    if band.bytes:
+                        try:
+                            return band.get_nowait()
+                        except Empty:
+                            # Emptied by its CoDel
+                            pass
+                if not block:
+                    raise Empty
+                self.not_empty.wait()
+
+    def get_nowait(self) -> Tuple[int, Optional[bytes]]:
+        """
+        Removes and returns the next packet without waiting.
+
+        Returns:
+            Tuple[int, Optional[bytes]]: The enqueue time (perf_counter_ns) and the packet.
+
+        Raises:
+            Empty: If no packet is queued.
+        """
+        return self.get(False)
+
+
+def egress_queue(scheduler: str = "fifo", max_bytes: int = QUEUE_BYTES, policy: str = "tail", counters: Optional[Counters] = None, release: Optional[Callable[[bytes], None]] = None, offset: int = 0, priority: bool = False) -> Union[PacketQueue, FlowScheduler, PriorityQueues]:
+    """
+    Builds the queue of the packets read from the tunnel.
+
+    Args:
+        scheduler (str): 'fifo' (a `PacketQueue`, in arrival order), 'drr' or 'fq_codel'
+                         (a `FlowScheduler`).
+        max_bytes (int): The byte budget (of each band with `priority`).
+        policy (str): What a 'fifo' queue drops when it is full ('tail', 'head' or 'codel').
+        counters (Optional[Counters]): Endpoint counters to account the drops in.
+        release (Optional[Callable[[bytes], None]]): Called with each dropped packet.
+        offset (int): Where the IPv6 header starts in the packets.
+        priority (bool): Put one such queue in each strict-priority band (`PriorityQueues`).
+
+    Returns:
+        Union[PacketQueue, FlowScheduler, PriorityQueues]: The queue.
+
+    Raises:
+        ValueError: If the scheduler or the drop policy is unknown.
+    """
+    if priority:
+        return PriorityQueues([egress_queue(scheduler, max_bytes, policy, counters, release, offset)
+                               for _ in range(PRIORITY_BANDS)], offset)
+    if scheduler == "fifo":
+        return PacketQueue(max_bytes, policy, counters, release)
+    return FlowScheduler(max_bytes, scheduler, counters, release, offset)
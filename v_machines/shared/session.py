@@ -0,0 +1,160 @@
+import random
+import socket
+import threading
+import logging
+from typing import Callable, Optional
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE = 0.05  # seconds, first reconnection delay
+BACKOFF_MAX = 2.0  # seconds, longest reconnection delay
+CONNECT_TIMEOUT = 2.0  # seconds allowed to a connection attempt
+
+
+class Backoff:
+    """
+    Jittered exponential backoff between connection attempts ("full jitter"): the n-th delay is
+    drawn uniformly between 0 and min(`maximum`, `base` * 2**n), so that endpoints restarted
+    together do not retry in lockstep, and a peer back online is found again quickly.
+
+    Attributes:
+        base (float): Upper bound of the first delay, in seconds.
+        maximum (float): Upper bound of every delay, in seconds.
+        attempts (int): Failed attempts since the last success.
+    """
+
+    def __init__(self, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> None:
+        """
+        Initializes the backoff.
+
+        Args:
+            base (float): Upper bound of the first delay, in seconds.
+            maximum (float): Upper bound of every delay, in seconds.
+        """
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        Counts a failed attempt and returns the time to wait before the next one.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        ceiling = min(self.maximum, self.base * (1 << min(self.attempts, 30)))
+        self.attempts += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self) -> None:
+        """
+        Restarts from the shortest delay (after a successful connection).
+        """
+        self.attempts = 0
+
+
+class PeerSession:
+    """
+    The one authoritative outbound connection of an endpoint to its peer.
+
+    A single thread connects to the peer, runs the egress writer on the connection until the
+    writer returns (the connection failed), then reconnects with a jittered exponential
+    backoff. There is never more than one writer: packets keep waiting in the bounded tunnel
+    queue while the peer is away, and are sent in order on the next connection.
+    Inbound connections are accepted independently (see `Extremity.tcp`).
+
+    Attributes:
+        address (str): IPv4 address of the peer.
+        port (int): Port of the peer.
+        writer (Callable[[socket.socket], None]): Sends packets on a connection until it fails.
+        backoff (Backoff): Delays between the connection attempts.
+        connection (Optional[socket.socket]): The current connection, None while reconnecting.
+        connects (int): Successful connections so far (reconnections are `connects - 1`).
+        stopped (threading.Event): Set by `stop` to end the session.
+        adopted (Optional[socket.socket]): A connection established by a previous process,
+                                           used by `run` before connecting (see `adopt`).
+    """
+
+    def __init__(self, address: str, port: int, writer: Callable[[socket.socket], None], backoff: Optional[Backoff] = None) -> None:
+        """
+        Initializes the session (`run` opens the connection).
+
+        Args:
+            address (str): IPv4 address of the peer.
+            port (int): Port of the peer.
+            writer (Callable[[socket.socket], None]): The egress writer.
+            backoff (Optional[Backoff]): The reconnection delays (default: `Backoff()`).
+        """
+        self.address = address
+        self.port = port
+        self.writer = writer
+        self.backoff = backoff or Backoff()
+        self.connection = None
+        self.connects = 0
+        self.stopped = threading.Event()
+        self.adopted = None
+
+    def adopt(self, client: socket.socket) -> None:
+        """
+        Takes over a connection to the peer handed over by a previous process: `run` starts
+        with it instead of connecting.
+
+        Args:
+            client (socket.socket): The established connection.
+        """
+        self.adopted = client
+
+    def connect(self) -> Optional[socket.socket]:
+        """
+        Makes one connection attempt.
+
+        Returns:
+            Optional[socket.socket]: The connected socket, or None if the attempt failed.
+        """
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(CONNECT_TIMEOUT)
+        try:
+            client.connect((self.address, self.port))
+        except OSError:
+            client.close()
+            return None
+        client.settimeout(None)
+        # Packets are already batched by the writer: do not delay the small ones
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client
+
+    def run(self) -> None:
+        """
+        Keeps the connection to the peer up and runs the writer on it, until `stop` is called.
+        """
+        while not self.stopped.is_set():
+            adopted, self.adopted = self.adopted, None
+            client = adopted or self.connect()
+            if client is None:
+                self.stopped.wait(self.backoff.next_delay())
+                continue
+            self.backoff.reset()
+            self.connects += 1
+            self.connection = client
+            logger.info(f"Connexion {'taken over' if adopted else 'established'} with: {self.address}")
+            try:
+                self.writer(client)
+            finally:
+                self.connection = None
+                client.close()
+            if not self.stopped.is_set():
+                logger.error(f"Connection lost with: {self.address}, reconnecting")
+
+    def stop(self) -> None:
+        """
+        Ends the session: no more reconnection, and the current connection is shut down.
+        """
+        self.stopped.set()
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
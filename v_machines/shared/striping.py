@@ -0,0 +1,183 @@
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Optional
+
+STRIPE_MODES = ("flow", "packet")
+REORDER_WINDOW = 8192  # packets held at most while a missing one is waited for (a timeout at 160k pps)
+REORDER_TIMEOUT = 0.05  # seconds a missing packet is waited for before it is given up
+SEQUENCE_MASK = 0xFFFF  # sequence numbers are the 16-bit identification field of the IPv4 header
+
+TCP = 6
+UDP = 17
+
+
+def flow_hash(ipv6_packet: bytes, offset: int = 0) -> int:
+    """
+    Hashes the 5-tuple of an IPv6 packet (addresses, next header and, for TCP and UDP, ports),
+    so that all the packets of an inner flow take the same connection and stay in order.
+
+    Args:
+        ipv6_packet (bytes): The packet.
+        offset (int): Where the IPv6 header starts (after the virtio-net header in offload mode).
+
+    Returns:
+        int: The hash (0 for a packet too short to carry an IPv6 header).
+    """
+    if len(ipv6_packet) < offset + 40:
+        return 0
+    next_header = ipv6_packet[offset + 6]
+    key = zlib.crc32(ipv6_packet[offset + 8:offset + 40], next_header)
+    if next_header in (TCP, UDP):
+        key = zlib.crc32(ipv6_packet[offset + 40:offset + 44], key)
+    return key
+
+
+class ReorderBuffer:
+    """
+    Puts back in order the packets of a peer striped packet by packet over several
+    connections (see `Extremity.ext_in`), numbered in the identification field of their
+    IPv4 header.
+
+    A packet arriving in order is delivered at once, with the held packets that follow it.
+    A packet arriving ahead is held (copied: it is a view of a receive buffer) until the
+    missing ones arrive or `timeout` elapses: the missing packets are then given up
+    (`skipped`) and delivery resumes at the next held packet. A packet arriving after it was
+    given up is delivered anyway (`late`): the inner transport handles a reordering better
+    than a loss. A packet more than `window` ahead gives up the oldest missing packets, so
+    that the held packets never exceed the window. When a connection of the peer arrives
+    while none is left (the peer restarted its numbering), the order starts over.
+
+    Attributes:
+        deliver (Callable[[bytes], None]): Writes a packet to the tunnel.
+        window (int): Largest number of packets held.
+        timeout (float): Seconds a missing packet is waited for.
+        expected (Optional[int]): Sequence number of the next packet to deliver.
+        held (Dict[int, bytes]): Packets received ahead, by sequence number.
+        connections (int): Connections of the peer currently feeding the buffer.
+        late (int): Packets delivered after having been given up.
+        skipped (int): Packets given up.
+    """
+
+    def __init__(self, deliver: Callable[[bytes], None], window: int = REORDER_WINDOW, timeout: float = REORDER_TIMEOUT) -> None:
+        """
+        Initializes an empty buffer (the first packet received sets the order).
+
+        Args:
+            deliver (Callable[[bytes], None]): Writes a packet to the tunnel.
+            window (int): Largest number of packets held (below 32768).
+            timeout (float): Seconds a missing packet is waited for.
+        """
+        self.deliver = deliver
+        self.window = window
+        self.timeout = timeout
+        self.expected: Optional[int] = None
+        self.held: Dict[int, bytes] = {}
+        self.gap_since = 0.0
+        self.connections = 0
+        self.late = 0
+        self.skipped = 0
+        # The connections of the peer push concurrently: delivery is serialized
+        self.lock = threading.Lock()
+
+    def attach(self) -> None:
+        """
+        Registers a connection of the peer. The first one after all the others have ended
+        starts a new order: what is still held is delivered.
+        """
+        with self.lock:
+            if not self.connections:
+                if self.held:
+                    for sequence in sorted(self.held, key=self._distance):
+                        self.deliver(self.held.pop(sequence))
+                self.expected = None
+            self.connections += 1
+
+    def detach(self) -> None:
+        """
+        Unregisters a connection of the peer that ended.
+        """
+        with self.lock:
+            self.connections -= 1
+
+    def push(self, sequence: int, packet: bytes) -> None:
+        """
+        Delivers a packet, or holds it until the packets before it arrive.
+
+        Args:
+            sequence (int): Its sequence number.
+            packet (bytes): The packet (a view is accepted, it is copied if held).
+        """
+        with self.lock:
+            if self.expected is None:
+                self.expected = sequence
+            distance = (sequence - self.expected) & SEQUENCE_MASK
+            if distance > SEQUENCE_MASK - self.window:
+                # Behind: its turn was given up
+                self.late += 1
+                self.deliver(packet)
+                return
+            while distance >= self.window:
+                # Too far ahead: give up the oldest missing packets to make room
+                if self.held:
+                    self._skip()
+                else:
+                    self.skipped += distance - self.window + 1
+                    self.expected = (sequence - self.window + 1) & SEQUENCE_MASK
+                distance = (sequence - self.expected) & SEQUENCE_MASK
+            if distance == 0:
+                self.deliver(packet)
+                self.expected = (sequence + 1) & SEQUENCE_MASK
+                if self.held:
+                    self._drain()
+            else:
+                if not self.held:
+                    self.gap_since = time.monotonic()
+                self.held[sequence] = bytes(packet)
+                if time.monotonic() - self.gap_since > self.timeout:
+                    self._skip()
+
+    def expire(self) -> None:
+        """
+        Gives up the missing packets waited for longer than `timeout` (called periodically, so
+        that the held packets are delivered even when no packet follows them).
+        """
+        with self.lock:
+            if self.held and time.monotonic() - self.gap_since > self.timeout:
+                self._skip()
+
+    def _distance(self, sequence: int) -> int:
+        """
+        Returns how far ahead of the expected packet a packet is (the lock is held).
+
+        Args:
+            sequence (int): Its sequence number.
+
+        Returns:
+            int: The distance, modulo 2**16.
+        """
+        return (sequence - self.expected) & SEQUENCE_MASK
+
+    def _drain(self) -> None:
+        """
+        Delivers the held packets that follow the expected one (the lock is held).
+        """
+        held = self.held
+        expected = self.expected
+        while expected in held:
+            self.deliver(held.pop(expected))
+            expected = (expected + 1) & SEQUENCE_MASK
+        self.expected = expected
+        if held:
+            # The wait for the next missing packet starts now
+            self.gap_since = time.monotonic()
+
+    def _skip(self) -> None:
+        """
+        Gives up the missing packets before the first held one, and delivers from there
+        (the lock is held).
+        """
+        first = min(self.held, key=self._distance)
+        self.skipped += self._distance(first)
+        self.expected = first
+        self._drain()
@@ -0,0 +1,439 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+from routes import load_routes
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+HANDOVER_POLL = 0.2  # seconds, longest time a blocked stream reader takes to notice a handover
+PAUSE_TIMEOUT = 1.0  # seconds the data path threads have to reach a safe point
+HANDOVER_TIMEOUT = 10.0  # seconds the successor has to take over once it has the sockets
+FD_CHUNK = 250  # descriptors per SCM_RIGHTS message (the kernel accepts 253 at most)
+HANDOVER_ACK = b"\x01"
+# Settings of the configuration file applied on SIGHUP (the others need a restart)
+RELOADABLE = ("log_level", "queue_bytes", "routes")
+
+
+class Pause:
+    """
+    Brings the threads of the data path to a safe point, where they no longer touch their
+    socket, while the sockets are handed over to another process.
+
+    The threads check `requested` where they can stop without cutting a packet (a stream
+    reader between two receives, a writer between two batches) and call `park`, which
+    blocks until `resume` (the handover failed). After a successful handover the process
+    exits with its threads still parked: their sockets live on in the successor.
+
+    Attributes:
+        requested (bool): A handover is in progress: the threads must park.
+        parked (Dict[Hashable, object]): The parked threads, by their socket, with what the
+                                         successor needs to go on (e.g. an incomplete packet).
+        condition (threading.Condition): Guards `parked` and `requested`.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the pause (not requested).
+        """
+        self.requested = False
+        self.parked = {}
+        self.condition = threading.Condition()
+
+    def request(self) -> None:
+        """
+        Asks the threads of the data path to park.
+        """
+        with self.condition:
+            self.requested = True
+
+    def park(self, key: Hashable, state: object = None) -> None:
+        """
+        Parks the calling thread until `resume` (returns at once if no pause is requested).
+
+        Args:
+            key (Hashable): What the thread holds, usually its socket.
+            state (object): What the successor needs to take over from this thread.
+        """
+        with self.condition:
+            if not self.requested:
+                return
+            self.parked[key] = state
+            self.condition.notify_all()
+            while self.requested:
+                self.condition.wait()
+            del self.parked[key]
+
+    def wait(self, keys: Iterable[Hashable], timeout: float = PAUSE_TIMEOUT) -> Dict[Hashable, object]:
+        """
+        Waits until the threads holding `keys` are parked, or the timeout.
+
+        Args:
+            keys (Iterable[Hashable]): The sockets whose threads must park.
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            Dict[Hashable, object]: The parked threads and their state (possibly not all of
+                                    `keys`: a thread stuck in a send on a stalled connection).
+        """
+        keys = set(keys)
+        with self.condition:
+            self.condition.wait_for(lambda: keys <= self.parked.keys(), timeout)
+            return dict(self.parked)
+
+    def resume(self) -> None:
+        """
+        Lets the parked threads go on (the handover did not happen).
+        """
+        with self.condition:
+            self.requested = False
+            self.condition.notify_all()
+
+
+def _recv_exactly(connection: socket.socket, size: int) -> bytes:
+    """
+    Receives exactly `size` bytes from a stream socket.
+
+    Args:
+        connection (socket.socket): The socket.
+        size (int): Number of bytes.
+
+    Returns:
+        bytes: The bytes.
+
+    Raises:
+        ConnectionError: If the connection is closed first.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Handover connection closed")
+        data += chunk
+    return bytes(data)
+
+
+class HandoverServer:
+    """
+    Hands the data path of a running endpoint over to a new process (zero-downtime restart).
+
+    The server listens on a Unix socket. A successor (`take_over`) connects, the endpoint
+    pauses its data path (`Extremity.suspend`) and sends, with `SCM_RIGHTS`, the TUN device
+    and its sockets: the transport socket and the established connections of the 'tcp'
+    transport, with the bytes of the packets they were receiving and the packets still
+    queued for the peers. Once the successor acknowledges, `on_handover` is called (it
+    exits the process, leaving the interface, routes and firewall rules in place); if it
+    never does, the endpoint resumes.
+
+    Only processes of the same user (or root) may take over.
+
+    Attributes:
+        endpoint (Extremity): The endpoint whose data path is handed over.
+        path (str): The path of the Unix socket.
+        on_handover (Callable[[], None]): Called once the successor runs the data path.
+        server (socket.socket): The listening Unix socket.
+    """
+
+    def __init__(self, endpoint, path: str, on_handover: Callable[[], None]) -> None:
+        """
+        Creates the listening socket (replacing a stale one).
+
+        Args:
+            endpoint (Extremity): The endpoint whose data path is handed over.
+            path (str): The path of the Unix socket.
+            on_handover (Callable[[], None]): Called once the successor runs the data path.
+        """
+        self.endpoint = endpoint
+        self.path = path
+        self.on_handover = on_handover
+        # The stream sockets of the endpoint must time out to notice a handover
+        endpoint.handover = True
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        os.chmod(path, 0o600)
+        self.server.listen(1)
+
+    def start(self) -> None:
+        """
+        Serves the successors in a daemon thread.
+        """
+        threading.Thread(target=self.serve, name="handover", daemon=True).start()
+        logger.info(f"Handover socket listening on {self.path}")
+
+    def serve(self) -> None:
+        """
+        Accepts the successors one at a time.
+        """
+        while True:
+            connection, _ = self.server.accept()
+            try:
+                if self.authorized(connection):
+                    self.hand_over(connection)
+            except OSError as e:
+                logger.error(f"Handover failed: {e}")
+            finally:
+                connection.close()
+
+    def authorized(self, connection: socket.socket) -> bool:
+        """
+        Tells whether the connected process may take over (same user, or root).
+
+        Args:
+            connection (socket.socket): The connection of the successor.
+
+        Returns:
+            bool: True if it may.
+        """
+        _, uid, _ = struct.unpack("3i", connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+        if uid in (0, os.getuid()):
+            return True
+        logger.error(f"Handover refused to uid {uid}")
+        return False
+
+    def hand_over(self, connection: socket.socket) -> None:
+        """
+        Pauses the data path, sends it to the successor and waits for its acknowledgment.
+
+        Message: the lengths of the state and the number of descriptors (with the first
+        descriptors), the other descriptors, the state (JSON), then each queued packet
+        preceded by its length.
+
+        Args:
+            connection (socket.socket): The connection of the successor.
+        """
+        state, fds, backlog = self.endpoint.suspend()
+        handed_over = False
+        try:
+            payload = json.dumps(state).encode()
+            chunks = [fds[start:start + FD_CHUNK] for start in range(0, len(fds), FD_CHUNK)] or [[]]
+            socket.send_fds(connection, [struct.pack("!II", len(payload), len(fds))], chunks[0])
+            for chunk in chunks[1:]:
+                socket.send_fds(connection, [b"\0"], chunk)
+            connection.sendall(payload)
+            for packet in backlog:
+                connection.sendall(struct.pack("!I", len(packet)) + packet)
+            connection.settimeout(HANDOVER_TIMEOUT)
+            handed_over = connection.recv(1) == HANDOVER_ACK
+        except OSError as e:
+            logger.error(f"Handover interrupted: {e}")
+        if handed_over:
+            logger.info(f"Data path handed over ({len(fds)} descriptors, {len(backlog)} queued packets)")
+            self.on_handover()
+            return
+        logger.error("The successor did not take over: resuming")
+        self.endpoint.resume(backlog)
+
+
+class Handover:
+    """
+    The data path received from the previous process of an endpoint (see `take_over`).
+
+    Attributes:
+        state (dict): What each descriptor is (see `Extremity.suspend`).
+        fds (List[int]): The received descriptors.
+        backlog (List[bytes]): The packets that were queued for the peers.
+        connection (socket.socket): The connection to the previous process.
+    """
+
+    def __init__(self, state: dict, fds: List[int], backlog: List[bytes], connection: socket.socket) -> None:
+        """
+        Initializes the handover.
+
+        Args:
+            state (dict): What each descriptor is.
+            fds (List[int]): The received descriptors.
+            backlog (List[bytes]): The packets that were queued for the peers.
+            connection (socket.socket): The connection to the previous process.
+        """
+        self.state = state
+        self.fds = fds
+        self.backlog = backlog
+        self.connection = connection
+
+    @property
+    def tun_fd(self) -> int:
+        """
+        The descriptor of the TUN device.
+        """
+        return self.fds[self.state["tun"]]
+
+    def complete(self) -> None:
+        """
+        Tells the previous process that the data path is taken over, then waits for it to
+        exit (its listening sockets, e.g. the metrics port, are then free).
+        """
+        self.connection.sendall(HANDOVER_ACK)
+        self.connection.settimeout(HANDOVER_TIMEOUT)
+        try:
+            self.connection.recv(1)
+        except OSError:
+            logger.warning("The previous process did not exit")
+        self.connection.close()
+
+
+def take_over(path: str) -> Handover:
+    """
+    Connects to the handover socket of a running endpoint and receives its data path.
+
+    Args:
+        path (str): The path of its Unix socket.
+
+    Returns:
+        Handover: The received state, descriptors and packets (`complete` must be called
+                  once the new endpoint is ready; closing the connection instead makes the
+                  running endpoint resume).
+
+    Raises:
+        OSError: If there is no endpoint to take over or the transfer fails.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        connection.settimeout(HANDOVER_TIMEOUT)
+        header, fds, _, _ = socket.recv_fds(connection, 8, FD_CHUNK)
+        size, count = struct.unpack("!II", header + _recv_exactly(connection, 8 - len(header)))
+        while len(fds) < count:
+            _, more, _, _ = socket.recv_fds(connection, 1, FD_CHUNK)
+            if not more:
+                raise ConnectionError("Handover descriptors missing")
+            fds += more
+        state = json.loads(_recv_exactly(connection, size))
+        backlog = [_recv_exactly(connection, struct.unpack("!I", _recv_exactly(connection, 4))[0])
+                   for _ in range(state["backlog"])]
+    except (OSError, ValueError):
+        connection.close()
+        raise
+    logger.info(f"Data path received ({len(fds)} descriptors, {len(backlog)} queued packets)")
+    return Handover(state, fds, backlog, connection)
+
+
+def read_config(path: str) -> Dict[str, str]:
+    """
+    Reads a configuration file of `tunnel64d.sh` ('key="value"' lines, '#' comments).
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        Dict[str, str]: Key -> value, without the quotes (empty values are left out).
+
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    settings = {}
+    with open(path) as config:
+        for line in config:
+            key, _, value = line.partition("=")
+            key, value = key.strip(), value.strip().strip('"')
+            if key and not key.startswith("#") and value:
+                settings[key] = value
+    return settings
+
+
+def set_log_level(name: str) -> None:
+    """
+    Sets the level of every logger of the endpoint.
+
+    Args:
+        name (str): The level name, e.g. "DEBUG" or "warning".
+
+    Raises:
+        ValueError: If the level is unknown.
+    """
+    level = logging.getLevelName(name.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {name}")
+    logging.getLogger().setLevel(level)
+
+
+def reload_config(endpoint, path: str, add_routes: Optional[Callable[[List[str]], None]] = None) -> None:
+    """
+    Applies the reloadable settings of a configuration file to a running endpoint
+    (on SIGHUP): the log level, the byte budget of the queues and, in hub mode, the routes
+    (new peers are connected, the peers no longer routed are disconnected).
+
+    Args:
+        endpoint (Extremity): The endpoint (a `Hub` for the routes).
+        path (str): The configuration file.
+        add_routes (Optional[Callable[[List[str]], None]]): Routes the IPv6 prefixes of the
+                                                            route table to the TUN device.
+    """
+    try:
+        settings = read_config(path)
+        if "log_level" in settings:
+            set_log_level(settings["log_level"])
+        if "queue_bytes" in settings:
+            endpoint.set_queue_bytes(int(settings["queue_bytes"]))
+        if "routes" in settings:
+            if not hasattr(endpoint, "set_routes"):
+                logger.warning("Routes configured for a single-peer endpoint: a restart is needed")
+            else:
+                routes = load_routes(settings["routes"])
+                if add_routes is not None:
+                    add_routes(routes.prefixes())
+                endpoint.set_routes(routes)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to reload {path}: {e}")
+        return
+    logger.info(f"Configuration reloaded from {path} ({', '.join(key for key in RELOADABLE if key in settings) or 'nothing to apply'})")
+
+
+class ConfigReloader:
+    """
+    Reloads the configuration file of a running endpoint on request (SIGHUP).
+
+    The signal handler only calls `request`: the reload itself (the executor, the routes
+    and the logging locks) runs in the thread of the reloader, never in the handler, which
+    could interrupt the main thread while it holds one of those locks.
+
+    Attributes:
+        endpoint (Extremity): The endpoint the settings are applied to.
+        path (str): The configuration file.
+        add_routes (Optional[Callable[[List[str]], None]]): Routes the IPv6 prefixes of the
+                                                            route table to the TUN device.
+        requested (threading.Event): Set by `request`, cleared when the reload starts.
+    """
+
+    def __init__(self, endpoint, path: str, add_routes: Optional[Callable[[List[str]], None]] = None) -> None:
+        """
+        Initializes the reloader (no reload requested).
+
+        Args:
+            endpoint (Extremity): The endpoint the settings are applied to.
+            path (str): The configuration file.
+            add_routes (Optional[Callable[[List[str]], None]]): Routes the IPv6 prefixes of
+                                                                the route table to the TUN device.
+        """
+        self.endpoint = endpoint
+        self.path = path
+        self.add_routes = add_routes
+        self.requested = threading.Event()
+
+    def start(self) -> None:
+        """
+        Serves the reload requests in a daemon thread.
+        """
+        threading.Thread(target=self.serve, name="reload", daemon=True).start()
+
+    def request(self) -> None:
+        """
+        Asks for a reload (safe in a signal handler: it only sets an event).
+        """
+        self.requested.set()
+
+    def serve(self) -> None:
+        """
+        Reloads the configuration once per request (requests made during a reload are merged).
+        """
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            reload_config(self.endpoint, self.path, self.add_routes)
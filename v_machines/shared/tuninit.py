@@ -1,6 +1,19 @@
 from iftun import Iftun
-import sys, os
+import argparse, os, signal, time
 from extremity import Extremity
+from async_extremity import AsyncExtremity
+from workers import start_workers, join_workers, stop_workers
+from metrics import MetricsServer
+from packet_queue import DROP_POLICIES, QUEUE_BYTES
+from buffers import POOL_BUFFERS
+from hub import Hub
+from routes import load_routes
+from pmtu import PathMTU
+from striping import STRIPE_MODES
+from scheduler import SCHEDULERS
+from supervisor import HandoverServer, ConfigReloader, take_over, set_log_level
+from compression import COMPRESSION_OVERHEAD, MAX_CONTEXTS
+from capture import PacketCapture, CAPTURE_POINTS, CAPTURE_SIZE, SNAPLEN
 
 
             
@@ -29,50 +42,284 @@ if __name__ == "__main__":
     - ipv6_gateway: IPv6 gateway for routing.
     - ipv6_dst_lan: IPv6 destination LAN address.
 
+    Options:
+    - --engine: data path engine, "threads" (default, `Extremity`) or "asyncio" (`AsyncExtremity`).
+    - --proto: transport between the endpoints, "tcp" (default), "udp" or "raw" (native IP
+      protocol 41, no carrier header, a single queue).
+    - --trace-every: log a trace of 1 packet out of N (default 0: no per-packet log).
+    - --metrics-port / --metrics-socket: serve the metrics (counters, queue depths, latency
+      histogram) in the Prometheus text format on http://127.0.0.1:<port>/metrics or on a Unix socket.
+    - --queue-bytes / --drop-policy: byte budget of the tunnel queues of the threaded engine (of
+      the backlog kept while the asyncio engine reconnects) and what to drop when it is
+      exhausted: "tail" (default), "head" or "codel".
+    - --routes: hub mode, serve many IPv6 islands: the file holds one "<IPv6 prefix> <IPv4 peer>"
+      route per line, each packet goes to the peer of the longest matching prefix (threaded
+      engine, tcp only). The prefixes are routed to the TUN device.
+    - --net-backend: how the interface and the routes are configured, "netlink" (default, no
+      process started) or "ip" (one `ip` command per operation). The configuration time is printed.
+    - --queues: number of queues of the TUN device (default 1). With N > 1 the device is
+      allocated with IFF_MULTI_QUEUE and each queue is served by its own worker process.
+    - --mtu: MTU of the TUN device. By default it is the path MTU to the peer (to the narrowest
+      peer in hub mode) minus the overhead of the transport, and it follows the path MTU while
+      the tunnel runs. Larger packets are answered with ICMPv6 Packet Too Big, never fragmented.
+    - --offload: open the TUN device with IFF_VNET_HDR and the TCP offloads: the kernel hands over
+      TCP super-packets of up to 64 KB (threaded engine). They are sent whole over tcp (both
+      endpoints need --offload) and segmented for udp and raw (compatible with any peer).
+    - --pool-buffers: number of preallocated buffers the threaded engine reads the packets of the
+      TUN device into, 2 KB each (default 0: one new bytes object per packet, faster under CPython).
+    - --stripes K / --stripe-mode: number of tcp connections to the peer (default 1), each with
+      its own congestion window, and how the packets are spread over them: "flow" (default, by
+      hash of the inner 5-tuple, no reordering) or "packet" (numbered and put back in order by
+      the receiving endpoint, which must use --stripe-mode packet too). Threads engine, tcp only.
+    - --scheduler: order in which the packets read from the TUN device are sent: "fifo" (default,
+      arrival order), "drr" or "fq_codel" (round robin between the inner flows, so that a bulk
+      transfer does not delay the interactive traffic). Threads engine.
+    - --priority: strict-priority bands by DSCP class in front of the scheduler (network control
+      and telephony first, lower effort last), each band with its own --queue-bytes. Threads engine.
+      Whatever the options, the DSCP and ECN of the inner packets are copied to the outer header
+      (on the wire with udp and raw), and a congestion marked on the path is passed on (RFC 6040).
+    - --handover-socket: listen on this Unix socket for a new process of the endpoint (threads
+      engine, single queue). Started with --takeover, the new process receives the TUN device and
+      the sockets of the running one (SCM_RIGHTS), skips the interface, route and firewall setup,
+      and takes over the data path without closing any connection; the old process then exits
+      (with no endpoint listening, the new process starts as usual).
+      Both must be given the same device options (--offload, --proto).
+    - --config: configuration file (as read by tunnel64d.sh) reloaded on SIGHUP: log_level,
+      queue_bytes and, in hub mode, routes (peers added and removed without a restart).
+    - --log-level: level of the logs (default: INFO).
+    - --header-compression N: compress the IPv6 header of the packets sent to the peer (threads
+      engine, tcp or udp, no --offload): the first packet of a flow carries its header and a
+      context identifier, the next ones only that 2-byte identifier (RFC 2507 style), with up to
+      N flows (at most 256) per connection, the least recently used one evicted. Over udp the
+      whole headers are sent again now and then, so that a flow recovers from a lost one (a
+      single queue on both sides). Any endpoint receives the compressed headers.
+    - --capture FILE: mirror the packets of the data path into FILE, a pcapng file of fixed size
+      (--capture-size, 16 MB by default) used as a ring: the oldest packets are overwritten. It is
+      mapped in memory, so a packet captured costs a copy of its first --capture-snaplen bytes
+      (128 by default, 0: whole packets) and no system call. --capture-points chooses among
+      tun_read, peer_send, peer_receive and tun_write (comma-separated, default: all), and
+      --capture-filter selects the packets on their inner IPv6 header, in the pcap filter syntax
+      (e.g. "tcp and port 443"). Threads engine, single queue. `python3 capture.py FILE out.pcapng`
+      writes the packets in order for tcpdump or Wireshark.
+
     Usage:
         python <script_name> <tun_name> <tun_address> <ipv4_src_addr> <src_port> 
-            <ipv4_dst_addr> <dst_port> <ipv4_gateway> <ipv6_gateway> <ipv6_dst_lan>
+            <ipv4_dst_addr> <dst_port> <ipv4_gateway> <ipv6_gateway> <ipv6_dst_lan> [--engine asyncio] [--proto raw] [--queues N] [--trace-every N] [--metrics-port PORT] [--drop-policy codel] [--routes FILE] [--mtu MTU] [--offload] [--pool-buffers N] [--stripes K] [--stripe-mode packet] [--scheduler fq_codel] [--priority] [--handover-socket PATH [--takeover]] [--config FILE] [--log-level LEVEL] [--header-compression N] [--capture FILE [--capture-points LIST] [--capture-size BYTES] [--capture-snaplen N] [--capture-filter EXPR]]
 
     Example:
         python config_tun.py tun0 192.168.1.1 192.168.1.2 8080 192.168.1.3 9090 
             192.168.1.254 fc00:1234:abcd::1 fc00:1234:abcd::2
     """
-    # Command-line arguments are captured as a tuple
-    tun_name, tun_address, ipv4_src_addr, src_port, ipv4_dst_addr,  dst_port, ipv4_gateway, ipv6_gateway, ipv6_dst_lan = tuple(sys.argv[1:])
+    # Command-line arguments
+    positionals = ("tun_name", "tun_address", "ipv4_src_addr", "src_port", "ipv4_dst_addr", "dst_port",
+                   "ipv4_gateway", "ipv6_gateway", "ipv6_dst_lan")
+    parser = argparse.ArgumentParser(description="Create a TUN interface and run an IPv6 over IPv4 tunnel endpoint.")
+    for name in positionals:
+        parser.add_argument(name)
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads",
+                        help="data path engine (default: threads)")
+    parser.add_argument("--proto", choices=("tcp", "udp", "raw"), default="tcp",
+                        help="transport between the endpoints (default: tcp)")
+    parser.add_argument("--trace-every", type=int, default=0,
+                        help="trace 1 packet out of N in the logs (default: 0, no trace)")
+    parser.add_argument("--metrics-port", type=int, help="serve the metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-socket", help="serve the metrics on this Unix socket")
+    parser.add_argument("--queue-bytes", type=int, default=QUEUE_BYTES,
+                        help=f"byte budget of each tunnel queue (default: {QUEUE_BYTES})")
+    parser.add_argument("--drop-policy", choices=DROP_POLICIES, default="tail",
+                        help="packet dropped when a queue is full (default: tail)")
+    parser.add_argument("--routes", help="hub mode: file of '<IPv6 prefix> <IPv4 peer>' routes")
+    parser.add_argument("--net-backend", choices=("netlink", "ip"), default="netlink",
+                        help="interface configuration backend (default: netlink, falls back to ip)")
+    parser.add_argument("--queues", type=int, default=1,
+                        help="number of TUN queues, each served by its own worker process (default: 1)")
+    parser.add_argument("--mtu", type=int,
+                        help="MTU of the TUN device (default: path MTU to the peer minus the transport overhead)")
+    parser.add_argument("--offload", action="store_true",
+                        help="receive TCP super-packets from the TUN device (IFF_VNET_HDR, threads engine)")
+    parser.add_argument("--pool-buffers", type=int, default=POOL_BUFFERS,
+                        help=f"preallocated packet buffers of the threads engine (default: {POOL_BUFFERS})")
+    parser.add_argument("--stripes", type=int, default=1,
+                        help="tcp connections to the peer (default: 1, threads engine)")
+    parser.add_argument("--stripe-mode", choices=STRIPE_MODES, default="flow",
+                        help="spread the packets over the stripes per flow or per packet (default: flow)")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="fifo",
+                        help="order of the packets sent to the peer (default: fifo, threads engine)")
+    parser.add_argument("--priority", action="store_true",
+                        help="serve the packets sent to the peer by strict priority of their DSCP (threads engine)")
+    parser.add_argument("--handover-socket", help="hand the data path over to a new process connecting to this Unix socket")
+    parser.add_argument("--takeover", action="store_true",
+                        help="take over the data path of the endpoint listening on --handover-socket")
+    parser.add_argument("--config", help="configuration file reloaded on SIGHUP (log_level, queue_bytes, routes)")
+    parser.add_argument("--log-level", help="level of the logs (default: INFO)")
+    parser.add_argument("--header-compression", type=int, default=0,
+                        help=f"compress the IPv6 headers sent with up to N flow contexts (default: 0, off; at most {MAX_CONTEXTS})")
+    parser.add_argument("--capture", help="mirror the packets of the data path into this pcapng ring file")
+    parser.add_argument("--capture-points", default=",".join(CAPTURE_POINTS),
+                        help=f"comma-separated capture points (default: {','.join(CAPTURE_POINTS)})")
+    parser.add_argument("--capture-size", type=int, default=CAPTURE_SIZE,
+                        help=f"size of the capture file in bytes (default: {CAPTURE_SIZE})")
+    parser.add_argument("--capture-snaplen", type=int, default=SNAPLEN,
+                        help=f"bytes captured of each packet (default: {SNAPLEN}, 0: whole packets)")
+    parser.add_argument("--capture-filter", help='capture the packets matching this filter, e.g. "tcp and port 443"')
+    args = parser.parse_args()
+    
+    # Positional arguments are captured as a tuple
+    tun_name, tun_address, ipv4_src_addr, src_port, ipv4_dst_addr,  dst_port, ipv4_gateway, ipv6_gateway, ipv6_dst_lan = tuple(getattr(args, name) for name in positionals)
     
     # Initialize the Iftun object to manage the virtual network device
-    iftun = Iftun()
+    configure_start = time.perf_counter()
+    iftun = Iftun(backend=args.net_backend)
     
     # Create the virtual network tunnel device with the given name
-    iftun.create_vnet_device(tun_name)
+    if args.engine == "asyncio" and args.proto != "tcp":
+        parser.error("--engine asyncio requires the tcp transport")
+    if args.offload and args.engine != "threads":
+        parser.error("--offload requires the threads engine")
+    if args.routes and (args.engine != "threads" or args.proto != "tcp"):
+        parser.error("--routes requires the threads engine and the tcp transport")
+    if (args.stripes != 1 or args.stripe_mode != "flow") and (args.engine != "threads" or args.proto != "tcp"):
+        parser.error("--stripes and --stripe-mode require the threads engine and the tcp transport")
+    if (args.scheduler != "fifo" or args.priority) and args.engine != "threads":
+        parser.error("--scheduler and --priority require the threads engine")
+    if (args.handover_socket or args.config) and (args.engine != "threads" or args.queues != 1):
+        parser.error("--handover-socket and --config require the threads engine and a single queue")
+    if args.takeover and not args.handover_socket:
+        parser.error("--takeover requires --handover-socket")
+    if args.proto == "raw" and args.queues != 1:
+        # Every protocol 41 socket gets a copy of each packet: it would be written once per worker
+        parser.error("--proto raw requires a single queue")
+    if args.header_compression:
+        if not 0 < args.header_compression <= MAX_CONTEXTS:
+            parser.error(f"--header-compression takes 1 to {MAX_CONTEXTS} contexts")
+        if args.engine != "threads" or args.proto == "raw" or args.offload:
+            parser.error("--header-compression requires the threads engine and the tcp or udp transport, without --offload")
+        if args.proto == "udp" and args.queues != 1:
+            # The datagrams of every worker of the peer reach the same socket: their contexts would mix
+            parser.error("--header-compression over udp requires a single queue")
+    capture_points = [point for point in args.capture_points.split(",") if point]
+    if args.capture:
+        if args.engine != "threads" or args.queues != 1:
+            parser.error("--capture requires the threads engine and a single queue")
+        if args.offload and args.proto == "tcp" and {"peer_send", "peer_receive"} & set(capture_points):
+            # The frames are sent whole: the carrier packets hold virtio-net headers
+            parser.error("--offload over tcp only captures the tun_read and tun_write points")
+    if args.log_level:
+        try:
+            set_log_level(args.log_level)
+        except ValueError as e:
+            parser.error(str(e))
+    # Before a takeover: a wrong capture option must not stop the running endpoint for nothing
+    capture = None
+    if args.capture:
+        try:
+            capture = PacketCapture(args.capture, capture_points, args.capture_size, args.capture_snaplen, args.capture_filter)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot capture to {args.capture}: {e}")
     
-    # Set the network addresses and gateway information for the tunnel
-    iftun.set_address(tun_address, ipv4_dst_addr, ipv4_gateway, ipv6_gateway, ipv6_dst_lan)
+    handover = None
+    if args.takeover:
+        try:
+            handover = take_over(args.handover_socket)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # A socket left by a stopped endpoint
+            print(f"No endpoint to take over on {args.handover_socket}: starting a new one")
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot take over from {args.handover_socket}: {e}")
+    if handover is not None:
+        # The device, its addresses, routes and firewall rules are those of the running endpoint
+        iftun.attach_device(tun_name, handover.tun_fd)
+    else:
+        iftun.create_vnet_device(tun_name, queues=args.queues, offload=args.offload)
+        
+        # Set the network addresses and gateway information for the tunnel
+        iftun.set_address(tun_address, ipv4_dst_addr, ipv4_gateway, ipv6_gateway, ipv6_dst_lan)
+        
+        # Set up iptables rules if enabled
+        iftun.set_iptables(ipv4_src_addr, src_port, ipv4_dst_addr, dst_port, ipv6_gateway)
     
-    # Set up iptables rules if enabled
-    iftun.set_iptables(ipv4_src_addr, src_port, ipv4_dst_addr, dst_port, ipv6_gateway)
+    # Remove the firewall rules of the tunnel when the endpoint is stopped (after its workers)
+    workers = []
+    def stop(signum: int, frame) -> None:
+        stop_workers(workers)
+        iftun.teardown_iptables()
+        os._exit(0)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
    
     # Retrieve the created tunnel device and file descriptor
     tun_dev = iftun.tun_dev
     tun_fd = iftun.tunfd
     ifname = iftun.ifname
 
+    # Parameters of the Extremity object managing the traffic in the tunnel
+    engine = AsyncExtremity if args.engine == "asyncio" else Extremity
+    endpoint_args = dict(tun_address=tun_address, 
+                         src_address=ipv4_src_addr, 
+                         dst_address=ipv4_dst_addr, 
+                         src_port=int(src_port),
+                         dst_port=int(dst_port),
+                         proto=args.proto,
+                         trace_every=args.trace_every,
+                         queue_bytes=args.queue_bytes,
+                         drop_policy=args.drop_policy,
+                         mtu=args.mtu)
+    if engine is Extremity:
+        # The asyncio engine only queues while it reconnects: it drops when the socket or the tunnel is full
+        endpoint_args.update(offload=args.offload, pool_buffers=args.pool_buffers, stripes=args.stripes, stripe_mode=args.stripe_mode,
+                             scheduler=args.scheduler, priority=args.priority, compression=args.header_compression)
+    if capture is not None:
+        endpoint_args["capture"] = capture
+    if args.routes:
+        # Hub mode: the route table replaces the single destination
+        routes = load_routes(args.routes)
+        if handover is None:
+            iftun.add_routes(routes.prefixes())
+        engine = Hub
+        del endpoint_args["dst_address"]
+        endpoint_args["routes"] = routes
+    
+    # Size the TUN device so that an encapsulated packet fits the path to the peer(s)
+    peers = endpoint_args["routes"].peers() if args.routes else [ipv4_dst_addr]
+    extra_overhead = COMPRESSION_OVERHEAD if args.header_compression else 0
+    mtu = args.mtu or min(PathMTU(peer, args.proto, None, extra_overhead).mtu for peer in peers)
+    if handover is None:
+        iftun.set_mtu(mtu)
+        backend = "netlink" if iftun.netlink is not None else "ip"
+        print(f"Interface configured in {(time.perf_counter() - configure_start) * 1e3:.1f} ms ({backend} backend, MTU {mtu})")
+    
+    if args.queues > 1:
+        # One worker process (and its own connection to the peer) per queue of the device
+        print(f'The tunnel: "{ifname}" with {args.queues} queues (fds: {iftun.tunfds}) is created ;)\nEnjoy it.')
+        workers.extend(start_workers(engine, iftun.tunfds, args.metrics_port, args.metrics_socket, **endpoint_args))
+        join_workers(workers)
+        for fd in iftun.tunfds:
+            os.close(fd)
+        exit(0)
+    
     # Initialize the Extremity object to manage and handle the traffic in the tunnel
-    traffic = Extremity(tun_address=tun_address, 
-                        tun_fd=tun_fd, 
-                        src_address=ipv4_src_addr, 
-                        dst_address=ipv4_dst_addr, 
-                        src_port=int(src_port),
-                        dst_port=int(dst_port),
-                        proto="tcp")
+    traffic = engine(tun_fd=tun_fd, **endpoint_args)
+    if handover is not None:
+        # Once acknowledged, the previous process exits: its metrics port is then free
+        traffic.adopt(handover.state, handover.fds, handover.backlog)
+        handover.complete()
+        print(f"Data path taken over in {(time.perf_counter() - configure_start) * 1e3:.1f} ms")
+    if args.metrics_port is not None or args.metrics_socket is not None:
+        MetricsServer(traffic.metrics, args.metrics_port, args.metrics_socket).start()
+    if args.handover_socket:
+        # A successor took over: exit without removing the firewall rules it relies on
+        HandoverServer(traffic, args.handover_socket, lambda: os._exit(0)).start()
+    if args.config:
+        # The handler only wakes the reloader up: the reload runs in its thread
+        reloader = ConfigReloader(traffic, args.config, iftun.add_routes)
+        reloader.start()
+        signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request())
     # Print a confirmation message indicating that the tunnel has been created successfully
     print(f'The tunnel: "{ifname}" with fd: {tun_fd} is created ;)\nEnjoy it.')
     
     # Enter an infinite loop to handle the traffic
     while True: 
-        # Monitoring traffic on standard output
-        # iftun.from_tun_to(tun_fd, dst=1) # execution: ./config1.sh | hexdump -C
-        # iftun.show_traffic()
+        # Monitoring traffic: --capture (a pcapng ring file, no packet taken off the data path)
         
         # Start the traffic handling process using the Extremity object
         traffic.start()
@@ -83,12 +330,3 @@ if __name__ == "__main__":
         # Close the tunnel file descriptor (typically done when terminating the process)
         os.close(tun_fd)
         break
-    
-    
-    
-   
-    
-
-    
-   
-    
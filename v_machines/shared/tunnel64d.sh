@@ -24,4 +24,41 @@ while IFS='=' read -r key value; do
     declare "$key"="$value"
 done < "$file"
 
-sudo python3 tuninit.py $tun $tunaddr $inip $inport $outip $outport $ipv4_gateway $ipv6_gateway $ipv6_dst_lan
\ No newline at end of file
+# Optional settings of the configuration file
+options=()
+[ -n "$engine" ] && options+=(--engine "$engine")
+[ -n "$queues" ] && options+=(--queues "$queues")
+[ -n "$proto" ] && options+=(--proto "$proto")
+[ -n "$trace_every" ] && options+=(--trace-every "$trace_every")
+[ -n "$metrics_port" ] && options+=(--metrics-port "$metrics_port")
+[ -n "$queue_bytes" ] && options+=(--queue-bytes "$queue_bytes")
+[ -n "$drop_policy" ] && options+=(--drop-policy "$drop_policy")
+[ -n "$routes" ] && options+=(--routes "$routes")
+[ -n "$net_backend" ] && options+=(--net-backend "$net_backend")
+[ -n "$mtu" ] && options+=(--mtu "$mtu")
+[ "$offload" = "yes" ] && options+=(--offload)
+[ -n "$stripes" ] && options+=(--stripes "$stripes")
+[ -n "$stripe_mode" ] && options+=(--stripe-mode "$stripe_mode")
+[ -n "$scheduler" ] && options+=(--scheduler "$scheduler")
+[ "$priority" = "yes" ] && options+=(--priority)
+[ -n "$log_level" ] && options+=(--log-level "$log_level")
+[ -n "$header_compression" ] && options+=(--header-compression "$header_compression")
+if [ -n "$capture" ]; then
+    options+=(--capture "$capture")
+    [ -n "$capture_points" ] && options+=(--capture-points "$capture_points")
+    [ -n "$capture_size" ] && options+=(--capture-size "$capture_size")
+    [ -n "$capture_snaplen" ] && options+=(--capture-snaplen "$capture_snaplen")
+    [ -n "$capture_filter" ] && options+=(--capture-filter "$capture_filter")
+fi
+# The handover and the reload on SIGHUP need the threads engine with a single queue
+if [ "${engine:-threads}" = "threads" ] && [ "${queues:-1}" = "1" ]; then
+    if [ -n "$handover_socket" ]; then
+        options+=(--handover-socket "$handover_socket")
+        # An endpoint already running: take its data path over (zero-downtime restart)
+        [ -S "$handover_socket" ] && options+=(--takeover)
+    fi
+    # log_level, queue_bytes and routes are reloaded from the file on SIGHUP
+    options+=(--config "$file")
+fi
+
+sudo python3 tuninit.py $tun $tunaddr $inip $inport $outip $outport $ipv4_gateway $ipv6_gateway $ipv6_dst_lan "${options[@]}"
\ No newline at end of file
@@ -0,0 +1,84 @@
+import multiprocessing
+import signal
+import logging
+from typing import List, Optional, Type
+from metrics import MetricsServer
+
+# Logs configuration
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def run_queue(engine: Type, tun_fd: int, endpoint_args: dict, metrics_port: Optional[int] = None, metrics_socket: Optional[str] = None) -> None:
+    """
+    Runs one endpoint on one queue of a multi-queue TUN device (target of a worker process).
+
+    Args:
+        engine (Type): The endpoint class (`Extremity` or `AsyncExtremity`).
+        tun_fd (int): The file descriptor of the queue served by this worker.
+        endpoint_args (dict): The other keyword arguments of the endpoint.
+        metrics_port (Optional[int]): HTTP port serving the metrics of this worker.
+        metrics_socket (Optional[str]): Unix socket serving the metrics of this worker.
+    """
+    logger.info(f"Worker {multiprocessing.current_process().name} serving TUN queue fd {tun_fd}")
+    # The parent process owns the cleanup (firewall rules): workers just stop
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    endpoint = engine(tun_fd=tun_fd, reuse_port=True, **endpoint_args)
+    if metrics_port is not None or metrics_socket is not None:
+        MetricsServer(endpoint.metrics, metrics_port, metrics_socket).start()
+    endpoint.start()
+
+
+def start_workers(engine: Type, tun_fds: List[int], metrics_port: Optional[int] = None, metrics_socket: Optional[str] = None, **endpoint_args) -> List[multiprocessing.Process]:
+    """
+    Starts one worker process per TUN queue.
+
+    Each worker runs its own endpoint with its own sockets to the peer, so the GIL of one
+    process no longer caps the tunnel: the kernel spreads the flows over the queues and
+    each queue is served on its own core. The listening port is shared with `SO_REUSEPORT`.
+
+    Args:
+        engine (Type): The endpoint class (`Extremity` or `AsyncExtremity`).
+        tun_fds (List[int]): The file descriptors of the queues (see `Interface.tun_alloc_queues`).
+        metrics_port (Optional[int]): First HTTP metrics port, worker N serves on `metrics_port + N`.
+        metrics_socket (Optional[str]): Unix socket path prefix, worker N serves on `<path>.<N>`.
+        **endpoint_args: The other keyword arguments of the endpoint (addresses, ports, protocol).
+
+    Returns:
+        List[multiprocessing.Process]: The started worker processes.
+    """
+    # Fork keeps the inherited TUN fds valid in the children
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for queue, tun_fd in enumerate(tun_fds):
+        worker = context.Process(target=run_queue, name=f"tun-queue-{queue}", args=(
+            engine, tun_fd, endpoint_args,
+            None if metrics_port is None else metrics_port + queue,
+            None if metrics_socket is None else f"{metrics_socket}.{queue}"))
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+def join_workers(workers: List[multiprocessing.Process]) -> None:
+    """
+    Waits for all the worker processes to finish.
+
+    Args:
+        workers (List[multiprocessing.Process]): The worker processes.
+    """
+    for worker in workers:
+        worker.join()
+
+
+def stop_workers(workers: List[multiprocessing.Process]) -> None:
+    """
+    Terminates the worker processes (SIGTERM) and waits for them to exit.
+
+    Args:
+        workers (List[multiprocessing.Process]): The worker processes.
+    """
+    for worker in workers:
+        worker.terminate()
+    join_workers(workers)